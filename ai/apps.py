@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class AiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ai'
+
+    def ready(self):
+        from .signals import connect_signals
+        connect_signals()
+        # Registers the system checks
+        from . import checks
+
+        from django.conf import settings
+        if getattr(settings, 'AI_LLM_WARM_UP', False):
+            from .llm_utils import warm_up_in_background
+            warm_up_in_background()
@@ -0,0 +1,116 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from core.models import Project
+from .response_cache import agenerate_cached_response
+from .context_cache import get_cached_project_context
+from .context_formats import CONTEXT_FORMATS
+from .jobs import jobs_enabled
+from .rate_limit import RateLimitExceeded, client_key
+from .resilience import CircuitOpenError
+from .views import (ENTITY_CONFIGURATIONS, require_api_key, _get_context_format, _get_llm_context,
+                    _enqueue_job_response, _rate_limited_response, _unavailable_response)
+import json
+
+# Async counterparts of the views in views.py. Under ASGI the LLM call is awaited
+# on the event loop, so a slow generation no longer holds a worker thread; the
+# ORM work around it is short and goes through Django's async ORM API or
+# sync_to_async.
+
+async def _aget_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+async def _aget_entity_config_and_instance(entity_type, entity_id, project):
+    config = ENTITY_CONFIGURATIONS.get(entity_type)
+    if not config:
+        return None, None, JsonResponse({'status': 'error', 'message': 'Invalid entity type'}, status=400)
+
+    queryset = config['model'].objects.all()
+    if entity_type == 'chapter':
+        # The chapter prompt names the point of view character; lazy loading it would be a sync query
+        queryset = queryset.select_related('point_of_view')
+    entity = await _aget_or_404(queryset, pk=entity_id, project=project)
+    return entity, config, None
+
+@require_api_key
+async def view_project_context_html(request, project_id):
+    project = await _aget_or_404(Project.objects.all(), pk=project_id)
+    context_data, _ = await sync_to_async(get_cached_project_context)(project)
+    # Rendering touches request.user through the context processors, which is sync-only
+    return await sync_to_async(render)(request, 'ai/project_context_display.html', {
+        'project_name': project.name,
+        'raw_data': context_data
+    })
+
+@require_api_key
+async def view_project_context_llm(request, project_id):
+    project = await _aget_or_404(Project.objects.all(), pk=project_id)
+    context_format, error_response = _get_context_format(request)
+    if error_response:
+        return error_response
+    _, llm_context = await sync_to_async(get_cached_project_context)(project, context_format)
+    return await sync_to_async(render)(request, 'ai/project_context_llm.html', {
+        'project_name': project.name,
+        'llm_context': llm_context,
+        'context_format': context_format,
+        'context_format_label': CONTEXT_FORMATS[context_format][1],
+    })
+
+@require_api_key
+async def improve_entity_description(request, project_id, entity_type, entity_id):
+    project = await _aget_or_404(Project.objects.all(), pk=project_id)
+
+    entity, config, error_response = await _aget_entity_config_and_instance(entity_type, entity_id, project)
+    if error_response:
+        return error_response
+
+    if request.method == 'GET':
+        llm_context, budget_report, error_response = \
+            await sync_to_async(_get_llm_context)(request, project, entity_type, entity)
+        if error_response:
+            return error_response
+        final_prompt_args = {**config['prompt_args_fn'](entity), 'llm_context': llm_context}
+        response_data = {
+            'status': 'success',
+            'prompt': config['prompt_template'].format(**final_prompt_args)
+        }
+        if budget_report:
+            response_data['context_report'] = budget_report
+        return JsonResponse(response_data)
+
+    elif request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            user_provided_prompt = data.get('prompt')
+            if not user_provided_prompt:
+                return JsonResponse({'status': 'error', 'message': 'Prompt not provided in POST request'}, status=400)
+
+            if jobs_enabled():
+                return await sync_to_async(_enqueue_job_response)(project, entity_type, entity, user_provided_prompt, data)
+
+            client = client_key(request, await request.auser())
+            improved_text, cached = await agenerate_cached_response(
+                user_provided_prompt, bypass=bool(data.get('bypass_cache')), client=client,
+                telemetry={'project_id': project.pk, 'entity_type': entity_type})
+
+            return JsonResponse({
+                'status': 'success',
+                config['response_key']: improved_text,
+                'cached': cached
+            })
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON in request body'}, status=400)
+        except RateLimitExceeded as e:
+            return _rate_limited_response(e)
+        except CircuitOpenError as e:
+            return _unavailable_response(e)
+        except Exception as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': f'Error improving {entity_type} description: {str(e)}'
+            }, status=500)
+
+    return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
@@ -0,0 +1,176 @@
+from django.conf import settings
+from .context_formats import DEFAULT_FORMAT, serialize_context
+from .context_utils import project_entry
+from .fragments import render_fragment, build_context, assemble_llm_context
+
+# Rough characters-per-token ratio of Gemini/GPT style tokenizers on English prose
+CHARS_PER_TOKEN = 4
+
+# When trimming entities, sections earlier in this list are dropped first
+TRIM_ORDER = ['research_notes', 'relevant_passages', 'chapters', 'act_summaries', 'plot_points', 'organizations', 'places', 'characters']
+
+# JSON punctuation around each fragment (",\n") and opening up an empty section list
+FRAGMENT_OVERHEAD = 2
+SECTION_OVERHEAD = 4
+
+# Tries at fitting a budget in a format other than JSON (see build_budgeted_context)
+FORMAT_BUDGET_PASSES = 3
+
+
+def _chars_to_tokens(chars):
+    return (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate, good enough for budgeting prompts."""
+    return _chars_to_tokens(len(text))
+
+
+def default_token_budget():
+    return getattr(settings, 'AI_CONTEXT_TOKEN_BUDGET', None)
+
+
+def _excerpt_chars():
+    return getattr(settings, 'AI_CONTEXT_EXCERPT_CHARS', 600)
+
+
+def _excerpt(text, limit):
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(' ', 1)[0]
+    return f'{cut} [...]'
+
+
+def _context_chars(header_chars, fragments):
+    # Slightly overestimates the assembled length, so a context reported as
+    # fitting really does fit.
+    total = header_chars
+    for items in fragments.values():
+        if items:
+            total += SECTION_OVERHEAD + sum(len(text) + FRAGMENT_OVERHEAD for _, _, text in items)
+    return total
+
+
+def _rewrite(fragments, section, change):
+    """Apply change(entry) to copies of a section's entries; return how many changed."""
+    changed = 0
+    items = []
+    for pk, entry, text in fragments.get(section, []):
+        new_entry = change(dict(entry))
+        if new_entry != entry:
+            changed += 1
+            items.append((pk, new_entry, render_fragment(new_entry)))
+        else:
+            items.append((pk, entry, text))
+    fragments[section] = items
+    return changed
+
+
+def _strip_note_body(entry):
+    entry.pop('content', None)
+    entry.pop('file_excerpt', None)
+    return entry
+
+
+def _excerpt_chapter(entry):
+    if entry.get('content'):
+        entry['content'] = _excerpt(entry['content'], _excerpt_chars())
+    return entry
+
+
+def apply_token_budget(project, fragments, budget, distances=None):
+    """Degrade fragments in tiers until the assembled context fits `budget` tokens.
+
+    Tiers, each applied only while the context is still too large:
+      1. drop research note bodies
+      2. replace chapter content with short excerpts
+      3. drop whole entities, farthest from the focus entity first (per
+         `distances`, as returned by scope.neighbourhood), then by TRIM_ORDER
+
+    Returns the new fragments and a report of what was cut.
+    """
+    fragments = {section: list(items) for section, items in fragments.items()}
+    header_chars = len(assemble_llm_context(project_entry(project), {section: [] for section in fragments}))
+    budget_chars = budget * CHARS_PER_TOKEN
+    report = {
+        'budget': budget,
+        'estimated_tokens_before': _chars_to_tokens(_context_chars(header_chars, fragments)),
+        'tiers_applied': [],
+        'research_notes_stripped': 0,
+        'chapters_excerpted': 0,
+        'entities_dropped': [],
+    }
+
+    tiers = [
+        ('strip_research_notes', 'research_notes', _strip_note_body, 'research_notes_stripped'),
+        ('excerpt_chapters', 'chapters', _excerpt_chapter, 'chapters_excerpted'),
+    ]
+    for tier, section, change, counter in tiers:
+        if _context_chars(header_chars, fragments) <= budget_chars:
+            break
+        report[counter] = _rewrite(fragments, section, change)
+        report['tiers_applied'].append(tier)
+
+    total = _context_chars(header_chars, fragments)
+    if total > budget_chars:
+        report['tiers_applied'].append('trim_entities')
+        distances = distances or {}
+        candidates = []
+        for section, items in fragments.items():
+            for position, (pk, entry, text) in enumerate(items):
+                distance = distances.get((section, pk), float('inf'))
+                if distance == 0:
+                    continue  # never drop the entity being worked on
+                candidates.append((-distance, TRIM_ORDER.index(section), -position, section, pk, entry, text))
+        candidates.sort()
+
+        dropped = set()
+        for _, _, _, section, pk, entry, text in candidates:
+            if total <= budget_chars:
+                break
+            dropped.add((section, pk))
+            total -= len(text) + FRAGMENT_OVERHEAD
+            report['entities_dropped'].append({'section': section, 'name': entry.get('name') or entry.get('title')})
+        for section, items in fragments.items():
+            fragments[section] = [item for item in items if (section, item[0]) not in dropped]
+
+    report['estimated_tokens'] = _chars_to_tokens(total)
+    report['fits'] = total <= budget_chars
+    return fragments, report
+
+
+def build_budgeted_context(project, fragments, budget, distances=None, context_format=DEFAULT_FORMAT):
+    """Return (context_data, llm_context, report) for fragments trimmed to `budget` tokens.
+
+    llm_context is in `context_format`, and the estimates are of that text. The
+    tiers work on JSON fragments, so for other formats the budget is scaled by
+    how much smaller the format makes this project's context, and tightened
+    again (up to FORMAT_BUDGET_PASSES times) while the result is still too large.
+    """
+    if context_format == DEFAULT_FORMAT:
+        fragments, report = apply_token_budget(project, fragments, budget, distances)
+        context_data, llm_context = build_context(project, fragments)
+        report['estimated_tokens'] = estimate_tokens(llm_context)
+        report['fits'] = report['estimated_tokens'] <= budget
+        return context_data, llm_context, report
+
+    context_data, json_context = build_context(project, fragments)
+    llm_context = serialize_context(context_data['project'], context_format)
+    tokens_before = estimate_tokens(llm_context)
+    json_budget = budget * len(json_context) / max(len(llm_context), 1)
+    for _ in range(FORMAT_BUDGET_PASSES):
+        trimmed, report = apply_token_budget(project, fragments, max(int(json_budget), 1), distances)
+        context_data, _ = build_context(project, trimmed)
+        llm_context = serialize_context(context_data['project'], context_format)
+        tokens = estimate_tokens(llm_context)
+        if tokens <= budget:
+            break
+        json_budget *= budget / tokens
+    report.update({
+        'budget': budget,
+        'format': context_format,
+        'estimated_tokens_before': tokens_before,
+        'estimated_tokens': tokens,
+        'fits': tokens <= budget,
+    })
+    return context_data, llm_context, report
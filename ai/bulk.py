@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from .rate_limit import admit_batch
+from .response_cache import generate_cached_response
+
+
+def default_bulk_concurrency():
+    return getattr(settings, 'AI_BULK_MAX_CONCURRENCY', 8)
+
+
+def _generate(entity, prompt, bypass_cache, response_key, client, telemetry):
+    close_old_connections()
+    start = time.perf_counter()
+    item = {'id': entity.pk, 'name': getattr(entity, 'name', None) or getattr(entity, 'title', '')}
+    try:
+        text, cached = generate_cached_response(prompt, bypass=bypass_cache, client=client, telemetry=telemetry,
+                                                rate_limited=False)
+        item.update({'status': 'success', response_key: text, 'cached': cached})
+    except Exception as e:
+        item.update({'status': 'error', 'message': str(e)})
+    finally:
+        close_old_connections()
+    item['seconds'] = round(time.perf_counter() - start, 3)
+    return item
+
+
+def run_bulk_generation(prompts, response_key, max_concurrency=None, bypass_cache=False, client=None, telemetry=None):
+    """Run the LLM on (entity, prompt) pairs, at most max_concurrency at a time.
+
+    The run passes the rate limits once as a whole (see ai.rate_limit.admit_batch),
+    raising RateLimitExceeded before any call if it doesn't fit. Returns one result
+    per entity, in input order, each with its own status, and a report comparing
+    the wall time with the time the calls would take one by one.
+    """
+    max_concurrency = max_concurrency or default_bulk_concurrency()
+    start = time.perf_counter()
+    admit_batch(client, [prompt for _, prompt in prompts])
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts))),
+                            thread_name_prefix='ai-bulk') as executor:
+        results = list(executor.map(lambda pair: _generate(*pair, bypass_cache, response_key, client, telemetry), prompts))
+    wall_seconds = time.perf_counter() - start
+    sequential_seconds = sum(item['seconds'] for item in results)
+    report = {
+        'items': len(results),
+        'succeeded': sum(item['status'] == 'success' for item in results),
+        'failed': sum(item['status'] == 'error' for item in results),
+        'max_concurrency': max_concurrency,
+        'wall_seconds': round(wall_seconds, 3),
+        'sequential_seconds': round(sequential_seconds, 3),
+        'speedup': round(sequential_seconds / wall_seconds, 2) if wall_seconds else None,
+    }
+    return results, report
@@ -0,0 +1,15 @@
+from django.core.checks import Warning, register
+from .rate_limit import get_cache, limits, process_local
+
+
+@register()
+def check_rate_limit_cache(app_configs, **kwargs):
+    if not any((limits().get(scope) or {}).values() for scope in ('user', 'global')):
+        return []
+    if not process_local(get_cache()):
+        return []
+    return [Warning(
+        'AI rate limits are kept in a process-local cache, so each worker process enforces them on its own',
+        hint='Point AI_RATE_LIMIT_CACHE_ALIAS at a shared cache (database, Redis or Memcached)',
+        id='ai.W001',
+    )]
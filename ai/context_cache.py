@@ -0,0 +1,110 @@
+import threading
+import time
+import zlib
+from django.conf import settings
+from .context_formats import DEFAULT_FORMAT, serialize_context
+from .fragments import get_cache, assemble_project_context
+
+# Waiters poll for a context another worker is building for this long before
+# giving up and building it themselves.
+LOCK_TIMEOUT = 30
+LOCK_POLL_INTERVAL = 0.05
+
+# A small fixed pool of locks, so threads in one process asking for the same cold
+# project queue behind a single build without keeping one lock per key forever.
+_local_locks = [threading.RLock() for _ in range(64)]
+
+
+def cache_timeout():
+    return getattr(settings, 'AI_CONTEXT_CACHE_TIMEOUT', 60 * 60)
+
+
+def _version_key(project_id):
+    return f'ai:context:version:{project_id}'
+
+
+def _context_key(project_id, version, context_format=DEFAULT_FORMAT):
+    if context_format == DEFAULT_FORMAT:
+        return f'ai:context:{project_id}:{version}'
+    return f'ai:context:{project_id}:{version}:{context_format}'
+
+
+def _local_lock(key):
+    return _local_locks[zlib.crc32(key.encode()) % len(_local_locks)]
+
+
+def get_context_version(project_id):
+    """Return the current content version of a project, creating it if needed."""
+    cache = get_cache()
+    key = _version_key(project_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never restarts at a value
+        # that older cached contexts were stored under.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_context_version(project_id):
+    """Mark every cached context of a project as stale."""
+    cache = get_cache()
+    key = _version_key(project_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def _get_or_build(key, build):
+    """Return cache[key], running build() at most once across threads and processes when cold."""
+    cache = get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    with _local_lock(key):
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            try:
+                result = build()
+                cache.set(key, result, timeout=cache_timeout())
+            finally:
+                cache.delete(lock_key)
+            return result
+
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            if cache.get(lock_key) is None:
+                break
+        return build()
+
+
+def get_cached_project_context(project, context_format=DEFAULT_FORMAT):
+    """Same as get_project_context, served from the context cache when the project is unchanged.
+
+    Cache misses are assembled from per-entity fragments, so only entities that
+    changed since the last build are serialized again. Other formats than JSON
+    are derived from the cached JSON build and cached alongside it.
+
+    Only one build runs per cold project: threads of this process serialise on a
+    local lock and other processes wait on a lock entry in the shared cache.
+    """
+    version = get_context_version(project.pk)
+    if context_format == DEFAULT_FORMAT:
+        return _get_or_build(_context_key(project.pk, version), lambda: assemble_project_context(project))
+
+    def build():
+        context_data, _ = get_cached_project_context(project)
+        return context_data, serialize_context(context_data['project'], context_format)
+
+    return _get_or_build(_context_key(project.pk, version, context_format), build)
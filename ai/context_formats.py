@@ -0,0 +1,149 @@
+import json
+
+DEFAULT_FORMAT = 'json'
+
+# Short keys for the abbreviated format. Kept fixed (rather than derived per
+# project) so a key reads the same in every prompt; the legend lists the ones used.
+KEY_ABBREVIATIONS = {
+    'name': 'n',
+    'description': 'd',
+    'core_premise': 'cp',
+    'key_themes': 'kt',
+    'genre': 'g',
+    'style': 'st',
+    'characters': 'C',
+    'plot_points': 'PP',
+    'places': 'P',
+    'organizations': 'O',
+    'chapters': 'CH',
+    'research_notes': 'RN',
+    'act_summaries': 'AS',
+    'role': 'r',
+    'traits': 'tr',
+    'appearance': 'ap',
+    'age': 'ag',
+    'gender': 'ge',
+    'primary_goal': 'pg',
+    'secondary_goals': 'sg',
+    'key_motivations': 'km',
+    'character_arc_summary': 'arc',
+    'strengths': 'str',
+    'weaknesses': 'wk',
+    'internal_conflict': 'ic',
+    'external_conflict': 'ec',
+    'relationships': 'rel',
+    'to_character': 'to',
+    'title': 't',
+    'chapter_number': 'no',
+    'notes': 'nt',
+    'content': 'c',
+    'summary': 'sum',
+    'point_of_view': 'pov',
+    'order': 'o',
+    'narrative_function': 'nf',
+    'chapter_title': 'ct',
+    'key_events': 'ke',
+    'information_revealed_to_reader': 'ir',
+    'character_development_achieved': 'cd',
+    'conflict_introduced_or_escalated': 'cf',
+    'type': 'ty',
+    'sensory_details_keywords': 'sd',
+    'atmosphere_keywords': 'atm',
+    'strategic_importance_or_plot_relevance': 'si',
+    'goals_and_objectives': 'go',
+    'modus_operandi_keywords': 'mo',
+    'hierarchy_and_membership': 'hm',
+    'relationships_with_other_entities': 'rw',
+    'internal_dynamics': 'id',
+    'tags': 'tg',
+    'file_name': 'f',
+    'file_excerpt': 'fx',
+    'act': 'a',
+    'relevant_passages': 'RP',
+    'source': 'src',
+    'text': 'tx',
+}
+
+
+def _prune(value):
+    """Drop empty values, which carry no information for the model."""
+    if isinstance(value, dict):
+        return {key: _prune(item) for key, item in value.items() if item not in (None, '', [], {})}
+    if isinstance(value, list):
+        return [_prune(item) for item in value]
+    return value
+
+
+def to_json(project_data):
+    return json.dumps(project_data, indent=2, ensure_ascii=False)
+
+
+def to_minified_json(project_data):
+    return json.dumps(_prune(project_data), separators=(',', ':'), ensure_ascii=False)
+
+
+def _outline_lines(value, indent):
+    pad = '  ' * indent
+    lines = []
+    for key, item in value.items():
+        if isinstance(item, list) and item and all(isinstance(i, dict) for i in item):
+            lines.append(f'{pad}{key}:')
+            for entry in item:
+                entry_lines = _outline_lines(entry, indent + 1)
+                if not entry_lines:
+                    continue
+                # Mark the start of each list entry YAML-style
+                entry_lines[0] = f'{pad}- {entry_lines[0][len(pad) + 2:]}'
+                lines.extend(entry_lines)
+        elif isinstance(item, list):
+            lines.append(f'{pad}{key}: {"; ".join(str(i) for i in item)}')
+        else:
+            text = str(item).replace('\n', f'\n{pad}  ')
+            lines.append(f'{pad}{key}: {text}')
+    return lines
+
+
+def to_outline(project_data):
+    return '\n'.join(_outline_lines(_prune(project_data), 0))
+
+
+def _abbreviate(value):
+    if isinstance(value, dict):
+        return {KEY_ABBREVIATIONS.get(key, key): _abbreviate(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_abbreviate(item) for item in value]
+    return value
+
+
+def to_abbreviated_json(project_data):
+    pruned = _prune(project_data)
+    used = set()
+
+    def collect(value):
+        if isinstance(value, dict):
+            used.update(key for key in value if key in KEY_ABBREVIATIONS)
+            for item in value.values():
+                collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+
+    collect(pruned)
+    legend = ', '.join(f'{KEY_ABBREVIATIONS[key]}={key}' for key in KEY_ABBREVIATIONS if key in used)
+    body = json.dumps(_abbreviate(pruned), separators=(',', ':'), ensure_ascii=False)
+    return f'Key legend: {legend}\n{body}'
+
+
+# name: (serializer, human readable label)
+CONTEXT_FORMATS = {
+    'json': (to_json, 'JSON'),
+    'json-min': (to_minified_json, 'Minified JSON'),
+    'outline': (to_outline, 'Outline'),
+    'abbrev': (to_abbreviated_json, 'Abbreviated JSON'),
+}
+
+
+def serialize_context(project_data, context_format=DEFAULT_FORMAT):
+    """Serialize context_data['project'] in one of CONTEXT_FORMATS."""
+    serializer, _ = CONTEXT_FORMATS[context_format]
+    return serializer(project_data)
@@ -1,197 +1,207 @@
 import json
+from django.db.models import Prefetch
+from core.models import CharacterRelationship, ResearchFileChunk
+
+# A research note's entry starts the text extracted from its file with this many characters
+FILE_EXCERPT_CHARS = 600
+
+
+def _split_keywords(value):
+    """Split a semicolon separated field into a list of stripped keywords."""
+    if not value:
+        return []
+    return [keyword.strip() for keyword in value.split(';') if keyword.strip()]
+
+
+def _add_keywords(data, key, value):
+    keywords = _split_keywords(value)
+    if keywords:
+        data[key] = keywords
+
+
+def _add_names(data, key, related):
+    # `related` is a prefetched manager, so iterating it does not hit the database
+    names = [obj.name for obj in related.all()]
+    if names:
+        data[key] = names
+
+
+def character_queryset(project):
+    return project.characters.prefetch_related(
+        Prefetch('relationships_from', queryset=CharacterRelationship.objects.select_related('to_character'))
+    )
+
+
+def chapter_queryset(project):
+    return project.chapters.select_related('point_of_view').prefetch_related('characters', 'places', 'organizations')
+
+
+def plot_point_queryset(project):
+    return project.plot_points.select_related('chapter').prefetch_related('characters', 'places', 'organizations')
+
+
+def place_queryset(project):
+    return project.places.prefetch_related('characters')
+
+
+def organization_queryset(project):
+    return project.organizations.prefetch_related('characters', 'places')
+
+
+def research_note_queryset(project):
+    return project.research_notes.prefetch_related(
+        Prefetch('file_chunks', queryset=ResearchFileChunk.objects.filter(position=0), to_attr='first_file_chunks')
+    )
+
+
+def character_entry(character):
+    char_data = {
+        'name': character.name,
+        'role': character.role,
+        'description': character.description,
+    }
+    _add_keywords(char_data, 'traits', character.traits)
+    if character.appearance:
+        char_data['appearance'] = character.appearance
+    if character.age:
+        char_data['age'] = character.age
+    if character.gender:
+        char_data['gender'] = character.gender
+
+    if character.primary_goal:
+        char_data['primary_goal'] = character.primary_goal
+    _add_keywords(char_data, 'secondary_goals', character.secondary_goals)
+    _add_keywords(char_data, 'key_motivations', character.key_motivations)
+    if character.character_arc_summary:
+        char_data['character_arc_summary'] = character.character_arc_summary
+    _add_keywords(char_data, 'strengths', character.strengths)
+    _add_keywords(char_data, 'weaknesses', character.weaknesses)
+    _add_keywords(char_data, 'internal_conflict', character.internal_conflict)
+    _add_keywords(char_data, 'external_conflict', character.external_conflict)
+
+    relationships_list = [
+        {'to_character': rel.to_character.name, 'description': rel.description}
+        for rel in character.relationships_from.all()
+    ]
+    if relationships_list:
+        char_data['relationships'] = relationships_list
+    return char_data
+
+
+def chapter_entry(chapter_obj):
+    chapter_data = {
+        'title': chapter_obj.title,
+        'chapter_number': chapter_obj.chapter_number,
+        'notes': chapter_obj.notes,
+        'content': chapter_obj.content,
+        'point_of_view': chapter_obj.point_of_view.name if chapter_obj.point_of_view else None,
+    }
+    _add_names(chapter_data, 'characters', chapter_obj.characters)
+    _add_names(chapter_data, 'places', chapter_obj.places)
+    _add_names(chapter_data, 'organizations', chapter_obj.organizations)
+    return chapter_data
+
+
+def plot_point_entry(plot_point):
+    plot_data = {
+        'order': plot_point.order,
+        'title': plot_point.title,
+        'narrative_function': _split_keywords(plot_point.narrative_function) if plot_point.narrative_function else None,
+        'chapter_title': plot_point.chapter.title if plot_point.chapter else None
+    }
+    _add_keywords(plot_data, 'key_events', plot_point.key_events)
+    _add_keywords(plot_data, 'information_revealed_to_reader', plot_point.information_revealed_to_reader)
+    _add_keywords(plot_data, 'character_development_achieved', plot_point.character_development_achieved)
+    _add_keywords(plot_data, 'conflict_introduced_or_escalated', plot_point.conflict_introduced_or_escalated)
+    _add_names(plot_data, 'characters', plot_point.characters)
+    _add_names(plot_data, 'places', plot_point.places)
+    _add_names(plot_data, 'organizations', plot_point.organizations)
+    return plot_data
+
+
+def place_entry(place):
+    place_entry = {
+        'name': place.name,
+        'type': place.type,
+        'description': place.description,
+    }
+    if place.summary:
+        place_entry['summary'] = place.summary
+    _add_keywords(place_entry, 'sensory_details_keywords', place.sensory_details_keywords)
+    _add_keywords(place_entry, 'atmosphere_keywords', place.atmosphere_keywords)
+    _add_keywords(place_entry, 'strategic_importance_or_plot_relevance', place.strategic_importance_or_plot_relevance)
+    _add_names(place_entry, 'characters', place.characters)
+    return place_entry
+
+
+def organization_entry(org):
+    org_data = {
+        'name': org.name,
+        'type': org.type,
+        'description': org.description,
+    }
+    _add_keywords(org_data, 'goals_and_objectives', org.goals_and_objectives)
+    _add_keywords(org_data, 'modus_operandi_keywords', org.modus_operandi_keywords)
+    _add_keywords(org_data, 'hierarchy_and_membership', org.hierarchy_and_membership)
+    _add_keywords(org_data, 'relationships_with_other_entities', org.relationships_with_other_entities)
+    _add_keywords(org_data, 'internal_dynamics', org.internal_dynamics)
+    _add_names(org_data, 'characters', org.characters)
+    _add_names(org_data, 'places', org.places)
+    return org_data
+
+
+def _file_excerpt(note):
+    # Notes not loaded by research_note_queryset have no prefetched chunk
+    chunks = getattr(note, 'first_file_chunks', None)
+    if not chunks:
+        return None
+    text = chunks[0].text
+    if len(text) <= FILE_EXCERPT_CHARS:
+        return text
+    return text[:FILE_EXCERPT_CHARS].rsplit(' ', 1)[0] + ' [...]'
+
+
+def research_note_entry(note):
+    return {
+        'title': note.title,
+        'content': note.content,
+        'tags': note.tags,
+        'file_name': note.file_display_name or None,
+        'file_excerpt': _file_excerpt(note),
+    }
+
+
+# (section key in the context, queryset builder, entry builder), in output order.
+# Every queryset prefetches what its entry builder touches, so building the whole
+# project context costs a fixed number of queries regardless of project size.
+CONTEXT_SECTIONS = [
+    ('characters', character_queryset, character_entry),
+    ('plot_points', plot_point_queryset, plot_point_entry),
+    ('places', place_queryset, place_entry),
+    ('organizations', organization_queryset, organization_entry),
+    ('chapters', chapter_queryset, chapter_entry),
+    ('research_notes', research_note_queryset, research_note_entry),
+]
+
+
+def project_entry(project):
+    return {
+        'name': project.name,
+        'description': project.description,
+        'core_premise': project.core_premise,
+        'key_themes': project.key_themes,
+        'genre': project.genre,
+        'style': project.style,
+    }
+
 
 def get_project_context(project):
     """Get the full context of a project including all related data."""
-    context_data = {
-        'project': {
-            'name': project.name,
-            'description': project.description,
-            'core_premise': project.core_premise,
-            'key_themes': project.key_themes,
-            'genre': project.genre,
-            'style': project.style,
-            'characters': [],
-            'plot_points': [],
-            'places': [],
-            'organizations': [],
-            'chapters': [],
-            'research_notes': []
-        }
-    }
-    
-    for character in project.characters.all():
-        char_data = {
-            'name': character.name,
-            'role': character.role,
-            'description': character.description,
-        }
-        if character.traits:
-            keywords = [keyword.strip() for keyword in character.traits.split(';') if keyword.strip()]
-            if keywords:
-                char_data['traits'] = keywords
-        if character.appearance:
-            char_data['appearance'] = character.appearance
-        if character.age:
-            char_data['age'] = character.age
-        if character.gender:
-            char_data['gender'] = character.gender
-        
-        if character.primary_goal:
-            char_data['primary_goal'] = character.primary_goal
-        if character.secondary_goals:
-            keywords = [keyword.strip() for keyword in character.secondary_goals.split(';') if keyword.strip()]
-            if keywords: char_data['secondary_goals'] = keywords
-        if character.key_motivations:
-            keywords = [keyword.strip() for keyword in character.key_motivations.split(';') if keyword.strip()]
-            if keywords: char_data['key_motivations'] = keywords
-        if character.character_arc_summary:
-            char_data['character_arc_summary'] = character.character_arc_summary
-        if character.strengths:
-            keywords = [keyword.strip() for keyword in character.strengths.split(';') if keyword.strip()]
-            if keywords: char_data['strengths'] = keywords
-        if character.weaknesses:
-            keywords = [keyword.strip() for keyword in character.weaknesses.split(';') if keyword.strip()]
-            if keywords: char_data['weaknesses'] = keywords
-        if character.internal_conflict:
-            keywords = [keyword.strip() for keyword in character.internal_conflict.split(';') if keyword.strip()]
-            if keywords: char_data['internal_conflict'] = keywords
-        if character.external_conflict:
-            keywords = [keyword.strip() for keyword in character.external_conflict.split(';') if keyword.strip()]
-            if keywords: char_data['external_conflict'] = keywords
-        
-        relationships_list = []
-        for rel in character.relationships_from.all():
-            relationships_list.append({
-                'to_character': rel.to_character.name,
-                'description': rel.description
-            })
-        if relationships_list:
-            char_data['relationships'] = relationships_list
-        
-        context_data['project']['characters'].append(char_data)
-    
-    for chapter_obj in project.chapters.all():
-        chapter_data = {
-            'title': chapter_obj.title,
-            'chapter_number': chapter_obj.chapter_number,
-            'notes': chapter_obj.notes,
-            'content': chapter_obj.content,
-            'point_of_view': chapter_obj.point_of_view.name if chapter_obj.point_of_view else None,
-        }
-        chap_chars = [char.name for char in chapter_obj.characters.all()]
-        if chap_chars:
-            chapter_data['characters'] = chap_chars
-        
-        chap_places = [place.name for place in chapter_obj.places.all()]
-        if chap_places:
-            chapter_data['places'] = chap_places
-            
-        chap_orgs = [org.name for org in chapter_obj.organizations.all()]
-        if chap_orgs:
-            chapter_data['organizations'] = chap_orgs
-            
-        context_data['project']['chapters'].append(chapter_data)
-    
-    for plot_point in project.plot_points.all():
-        plot_data = {
-            'order': plot_point.order,
-            'title': plot_point.title,
-            'narrative_function': [kw.strip() for kw in plot_point.narrative_function.split(';') if kw.strip()] if plot_point.narrative_function else None,
-            'chapter_title': plot_point.chapter.title if plot_point.chapter else None
-        }
-        if plot_point.key_events:
-            keywords = [keyword.strip() for keyword in plot_point.key_events.split(';') if keyword.strip()]
-            if keywords: plot_data['key_events'] = keywords
-        if plot_point.information_revealed_to_reader:
-            keywords = [keyword.strip() for keyword in plot_point.information_revealed_to_reader.split(';') if keyword.strip()]
-            if keywords: plot_data['information_revealed_to_reader'] = keywords
-        if plot_point.character_development_achieved:
-            keywords = [keyword.strip() for keyword in plot_point.character_development_achieved.split(';') if keyword.strip()]
-            if keywords: plot_data['character_development_achieved'] = keywords
-        if plot_point.conflict_introduced_or_escalated:
-            keywords = [keyword.strip() for keyword in plot_point.conflict_introduced_or_escalated.split(';') if keyword.strip()]
-            if keywords: plot_data['conflict_introduced_or_escalated'] = keywords
-
-        plot_chars = [char.name for char in plot_point.characters.all()]
-        if plot_chars:
-            plot_data['characters'] = plot_chars
-        
-        plot_places = [place.name for place in plot_point.places.all()]
-        if plot_places:
-            plot_data['places'] = plot_places
-            
-        plot_orgs = [org.name for org in plot_point.organizations.all()]
-        if plot_orgs:
-            plot_data['organizations'] = plot_orgs
-            
-        context_data['project']['plot_points'].append(plot_data)
-    
-    for place in project.places.all():
-        place_entry = {
-            'name': place.name,
-            'type': place.type,
-            'description': place.description,
-        }
-        if place.summary:
-            place_entry['summary'] = place.summary
-        if place.sensory_details_keywords:
-            keywords = [keyword.strip() for keyword in place.sensory_details_keywords.split(';') if keyword.strip()]
-            if keywords:
-                place_entry['sensory_details_keywords'] = keywords
-        if place.atmosphere_keywords:
-            keywords = [keyword.strip() for keyword in place.atmosphere_keywords.split(';') if keyword.strip()]
-            if keywords: place_entry['atmosphere_keywords'] = keywords
-        if place.strategic_importance_or_plot_relevance:
-            keywords = [keyword.strip() for keyword in place.strategic_importance_or_plot_relevance.split(';') if keyword.strip()]
-            if keywords: place_entry['strategic_importance_or_plot_relevance'] = keywords
-
-        place_chars = [char.name for char in place.characters.all()]
-        if place_chars:
-            place_entry['characters'] = place_chars
-        context_data['project']['places'].append(place_entry)
-    
-    for org in project.organizations.all():
-        org_data = {
-            'name': org.name,
-            'type': org.type,
-            'description': org.description,
-        }
-        if org.goals_and_objectives:
-            keywords = [keyword.strip() for keyword in org.goals_and_objectives.split(';') if keyword.strip()]
-            if keywords: org_data['goals_and_objectives'] = keywords
-        if org.modus_operandi_keywords:
-            keywords = [keyword.strip() for keyword in org.modus_operandi_keywords.split(';') if keyword.strip()]
-            if keywords: org_data['modus_operandi_keywords'] = keywords
-        if org.hierarchy_and_membership:
-            keywords = [keyword.strip() for keyword in org.hierarchy_and_membership.split(';') if keyword.strip()]
-            if keywords: org_data['hierarchy_and_membership'] = keywords
-        if org.relationships_with_other_entities:
-            keywords = [keyword.strip() for keyword in org.relationships_with_other_entities.split(';') if keyword.strip()]
-            if keywords: org_data['relationships_with_other_entities'] = keywords
-        if org.internal_dynamics:
-            keywords = [keyword.strip() for keyword in org.internal_dynamics.split(';') if keyword.strip()]
-            if keywords: org_data['internal_dynamics'] = keywords
-
-        org_chars = [char.name for char in org.characters.all()]
-        if org_chars:
-            org_data['characters'] = org_chars
-        
-        org_places = [place.name for place in org.places.all()]
-        if org_places:
-            org_data['places'] = org_places
-            
-        context_data['project']['organizations'].append(org_data)
-    
-    for note in project.research_notes.all():
-        note_data = {
-            'title': note.title,
-            'content': note.content,
-            'tags': note.tags, # Assuming tags is handled appropriately by the model or not a list needing conditional add here
-            'file_name': note.file.name if note.file else None
-        }
-        context_data['project']['research_notes'].append(note_data)
-    
+    project_data = project_entry(project)
+    for section, queryset_fn, entry_fn in CONTEXT_SECTIONS:
+        project_data[section] = [entry_fn(obj) for obj in queryset_fn(project)]
 
+    context_data = {'project': project_data}
     llm_context = json.dumps(context_data['project'], indent=2, ensure_ascii=False)
-            
-    return context_data, llm_context 
\ No newline at end of file
+
+    return context_data, llm_context
@@ -0,0 +1,85 @@
+import json
+from django.conf import settings
+from django.core.cache import caches
+from .context_utils import CONTEXT_SECTIONS, project_entry
+
+# Fragments sit inside a section list of the project JSON, one level deeper than
+# the entry itself would be when dumped on its own.
+FRAGMENT_INDENT = ' ' * 4
+
+
+def get_cache():
+    """The cache holding project contexts, their versions and entity fragments."""
+    return caches[getattr(settings, 'AI_CONTEXT_CACHE_ALIAS', 'default')]
+
+
+def _fragment_timeout():
+    return getattr(settings, 'AI_CONTEXT_FRAGMENT_TIMEOUT', 7 * 24 * 60 * 60)
+
+
+def fragment_key(section, pk, updated_at):
+    return f'ai:fragment:{section}:{pk}:{updated_at.timestamp()}'
+
+
+def render_fragment(entry):
+    text = json.dumps(entry, indent=2, ensure_ascii=False)
+    return '\n'.join(FRAGMENT_INDENT + line for line in text.split('\n'))
+
+
+def get_project_fragments(project):
+    """Return {section: [(pk, entry, text), ...]} for a project, in context order.
+
+    Fragments are cached per entity and keyed by its updated_at, which the ai
+    signal handlers bump whenever the entity, its links or the names it shows
+    change. Unchanged entities cost one values_list query per section; only
+    stale ones are loaded and serialized again.
+    """
+    cache = get_cache()
+    fragments = {}
+    for section, queryset_fn, entry_fn in CONTEXT_SECTIONS:
+        versions = list(queryset_fn(project).values_list('pk', 'updated_at'))
+        keys = {pk: fragment_key(section, pk, updated_at) for pk, updated_at in versions}
+        cached = cache.get_many(keys.values())
+
+        missing = [pk for pk, key in keys.items() if key not in cached]
+        if missing:
+            fresh = {}
+            for obj in queryset_fn(project).filter(pk__in=missing):
+                entry = entry_fn(obj)
+                # Key by the freshly loaded timestamp, not the one read above,
+                # so a concurrent edit never gets stored under the old version.
+                fresh[fragment_key(section, obj.pk, obj.updated_at)] = (entry, render_fragment(entry))
+                keys[obj.pk] = fragment_key(section, obj.pk, obj.updated_at)
+            cache.set_many(fresh, timeout=_fragment_timeout())
+            cached.update(fresh)
+
+        fragments[section] = [(pk, *cached[keys[pk]]) for pk, _ in versions if keys[pk] in cached]
+    return fragments
+
+
+def assemble_llm_context(project_data, fragments):
+    """Join pre-rendered fragments into the same text json.dumps(indent=2) would produce."""
+    header = json.dumps(project_data, indent=2, ensure_ascii=False)
+    parts = [header[:-2]]  # reopen the object by dropping its closing "\n}"
+    for section, items in fragments.items():
+        if items:
+            body = ',\n'.join(text for _, _, text in items)
+            parts.append(f',\n  "{section}": [\n{body}\n  ]')
+        else:
+            parts.append(f',\n  "{section}": []')
+    parts.append('\n}')
+    return ''.join(parts)
+
+
+def build_context(project, fragments):
+    """Return (context_data, llm_context) for the given fragments, like get_project_context."""
+    project_data = project_entry(project)
+    llm_context = assemble_llm_context(project_data, fragments)
+    for section, items in fragments.items():
+        project_data[section] = [entry for _, entry, _ in items]
+    return {'project': project_data}, llm_context
+
+
+def assemble_project_context(project):
+    """Fragment-backed equivalent of context_utils.get_project_context."""
+    return build_context(project, get_project_fragments(project))
@@ -0,0 +1,124 @@
+import logging
+import os
+import socket
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import GenerationJob
+from .rate_limit import RateLimitExceeded, RequestTooLarge
+from .resilience import CircuitOpenError
+from .response_cache import generate_cached_response
+
+logger = logging.getLogger(__name__)
+
+
+def jobs_enabled():
+    return getattr(settings, 'AI_GENERATION_JOBS', False)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_generation(project, entity_type, entity_id, prompt, bypass_cache=False):
+    return GenerationJob.objects.create(project=project, entity_type=entity_type, entity_id=entity_id,
+                                        prompt=prompt, bypass_cache=bypass_cache)
+
+
+def claim_jobs(limit, worker=None):
+    """Mark up to `limit` queued jobs as running for this worker and return them, oldest first.
+
+    Jobs put back with a retry time are skipped until it has passed.
+
+    Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED where the database
+    supports it, so workers never wait on each other. The status-conditional
+    UPDATE makes the claim safe on databases without row locks (SQLite) too.
+    """
+    worker = worker or worker_name()
+    with transaction.atomic():
+        candidates = list(GenerationJob.objects.select_for_update(skip_locked=True)
+                          .filter(Q(not_before__isnull=True) | Q(not_before__lte=timezone.now()), status='queued')
+                          .order_by('created_at')
+                          .values_list('pk', flat=True)[:limit])
+        claimed = [pk for pk in candidates
+                   if GenerationJob.objects.filter(pk=pk, status='queued')
+                   .update(status='running', worker=worker, started_at=timezone.now())]
+    return list(GenerationJob.objects.filter(pk__in=claimed).select_related('project').order_by('created_at'))
+
+
+def max_retries():
+    return getattr(settings, 'AI_JOB_MAX_RETRIES', 10)
+
+
+def requeue_stale_jobs():
+    """Put back jobs whose worker died mid-generation (running for over AI_JOB_TIMEOUT seconds).
+
+    Each counts as a retry, and jobs out of retries are marked failed instead.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'AI_JOB_TIMEOUT', 10 * 60))
+    stale = GenerationJob.objects.filter(status='running', started_at__lt=cutoff)
+    stale.filter(retries__gte=max_retries()).update(status='failed', finished_at=now,
+                                                     error=f'Gave up after {max_retries() + 1} attempts')
+    return stale.update(status='queued', worker='', started_at=None, retries=F('retries') + 1)
+
+
+def retry_delay(job, retry_after=0):
+    """Seconds before a put-back job is tried again: doubling from AI_JOB_RETRY_DELAY
+    per retry up to AI_JOB_RETRY_MAX_DELAY, and never sooner than the error asked."""
+    base = getattr(settings, 'AI_JOB_RETRY_DELAY', 5)
+    delay = min(base * 2 ** job.retries, getattr(settings, 'AI_JOB_RETRY_MAX_DELAY', 5 * 60))
+    return max(delay, retry_after or 0)
+
+
+def run_job(job):
+    try:
+        result, _ = generate_cached_response(job.prompt, bypass=job.bypass_cache,
+                                             client=f'user:{job.project.user_id}', telemetry={
+                                                 'project_id': job.project_id,
+                                                 'entity_type': job.entity_type,
+                                                 # Time in the job queue, before a worker claimed it
+                                                 'queue_seconds': (job.started_at - job.created_at).total_seconds(),
+                                             })
+    except RequestTooLarge as e:
+        # Would never fit the rate limits, so retrying can't help
+        GenerationJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), finished_at=timezone.now())
+        return False
+    except (RateLimitExceeded, CircuitOpenError) as e:
+        if job.retries >= max_retries():
+            GenerationJob.objects.filter(pk=job.pk).update(
+                status='failed', error=f'{e} (gave up after {job.retries + 1} attempts)', finished_at=timezone.now())
+            return False
+        # Over a rate limit or the provider is down: back in the queue for a later try
+        not_before = timezone.now() + timedelta(seconds=retry_delay(job, e.retry_after))
+        GenerationJob.objects.filter(pk=job.pk).update(status='queued', worker='', started_at=None,
+                                                       retries=job.retries + 1, not_before=not_before)
+        return False
+    except Exception as e:
+        logger.exception('Generation job %s failed', job.pk)
+        GenerationJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), finished_at=timezone.now())
+        return False
+    GenerationJob.objects.filter(pk=job.pk).update(status='done', result=result, finished_at=timezone.now())
+    return True
+
+
+def job_payload(job, response_key):
+    """What the poll endpoint reports about a job; the result is under the entity's response key."""
+    payload = {
+        'id': job.pk,
+        'state': job.status,
+        'created_at': job.created_at.isoformat(),
+    }
+    if job.status == 'queued' and job.not_before:
+        payload['retry_at'] = job.not_before.isoformat()
+    if job.started_at:
+        payload['queued_seconds'] = round((job.started_at - job.created_at).total_seconds(), 3)
+    if job.finished_at and job.started_at:
+        payload['run_seconds'] = round((job.finished_at - job.started_at).total_seconds(), 3)
+    if job.status == 'done':
+        payload[response_key] = job.result
+    elif job.status == 'failed':
+        payload['message'] = f'Error improving {job.entity_type} description: {job.error}'
+    return payload
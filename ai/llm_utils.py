@@ -1,16 +1,82 @@
-import os
-import google.generativeai as genai
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from . import prompt_cache
+from .providers import default_model_name, get_provider
+from .resilience import call_with_policy, acall_with_policy, stream_with_policy
+from .telemetry import LLMCall
 
+logger = logging.getLogger(__name__)
 
-def configure_llm():
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
-        raise ValueError("Google API key not found in environment variables")
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.0-flash')
 
+def warm_up_in_background():
+    """Warm up the LLM provider on a daemon thread, so startup isn't held up by the network."""
+    def run():
+        try:
+            get_provider().warm_up(getattr(settings, 'AI_LLM_WARM_UP_MODELS', None))
+        except Exception:
+            logger.exception('LLM client warm-up failed')
+
+    threading.Thread(target=run, name='ai-llm-warm-up', daemon=True).start()
+
+
+def configure_llm(model_name=None, generation_config=None):
+    """The cached Gemini model object (for Gemini-specific features)."""
+    return get_provider('gemini').client.get_model(model_name, generation_config)
+
+
+def generate_llm_response(prompt, model_name=None, generation_config=None, telemetry=None):
+    """The model's response to a prompt, with timeouts, retries and hedging (see ai.resilience).
+
+    Every call is recorded with its timings and token counts; `telemetry` says
+    what it was for (see ai.telemetry.LLMCall).
+    """
+    provider = get_provider()
+    call = LLMCall(prompt, model_name, telemetry=telemetry)
+    try:
+        text = call_with_policy(lambda: prompt_cache.generate(provider, prompt, model_name, generation_config, call.usage))
+    except Exception:
+        call.record('error')
+        raise
+    call.record('success', text)
+    return text
+
+
+def stream_llm_response(prompt, model_name=None, generation_config=None, telemetry=None):
+    """Yield the response text in chunks as the model produces them."""
+    provider = get_provider()
+    call = LLMCall(prompt, model_name, streamed=True, telemetry=telemetry)
+    chunks = []
+    # Stays 'cancelled' if the consumer stops reading (e.g. the client went away)
+    status = 'cancelled'
+    try:
+        for text in stream_with_policy(lambda: prompt_cache.stream(provider, prompt, model_name, generation_config, call.usage)):
+            call.first_token()
+            chunks.append(text)
+            yield text
+        status = 'success'
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        call.record(status, ''.join(chunks))
+
+
+async def agenerate_llm_response(prompt, model_name=None, generation_config=None, telemetry=None):
+    """Async version of generate_llm_response, for views served under ASGI."""
+    provider = get_provider()
+    call = LLMCall(prompt, model_name, telemetry=telemetry)
+    try:
+        text = await acall_with_policy(
+            lambda: prompt_cache.agenerate(provider, prompt, model_name, generation_config, call.usage))
+    except Exception:
+        await sync_to_async(call.record)('error')
+        raise
+    await sync_to_async(call.record)('success', text)
+    return text
+
+
+def count_tokens(text, model_name=None):
+    return get_provider().count_tokens(text, model_name)
 
-def generate_llm_response(prompt):
-    model = configure_llm()
-    response = model.generate_content(prompt)
-    return response.text 
\ No newline at end of file
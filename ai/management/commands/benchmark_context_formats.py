@@ -0,0 +1,86 @@
+import random
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import (Project, Character, CharacterRelationship, Place, Organization,
+                         Chapter, PlotPoint, ResearchNote)
+from ai.budget import estimate_tokens
+from ai.context_formats import CONTEXT_FORMATS, serialize_context
+from ai.context_utils import get_project_context
+
+WORDS = ('storm harbor lantern oath silver forest whisper ember crown river shadow '
+         'letter bridge market tower winter debt ghost garden blade').split()
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _keywords(rng, count):
+    return '; '.join(_text(rng, 2) for _ in range(count))
+
+
+def create_synthetic_project(user, size, seed=0):
+    """A project with `size` entities of each kind, linked like a real manuscript."""
+    rng = random.Random(seed)
+    project = Project.objects.create(user=user, name=f'Synthetic {size}', description=_text(rng, 60),
+                                     core_premise=_text(rng, 40), key_themes='loyalty, loss, power',
+                                     genre='Fantasy', style='Literary')
+    characters = [Character.objects.create(
+        project=project, name=f'Character {i}', role=rng.choice(['protagonist', 'antagonist', 'ally']),
+        description=_text(rng, 80), traits=_keywords(rng, 4), primary_goal=_text(rng, 8),
+        key_motivations=_keywords(rng, 3), strengths=_keywords(rng, 3), weaknesses=_keywords(rng, 3),
+    ) for i in range(size)]
+    for character in characters:
+        for other in rng.sample(characters, min(2, size)):
+            if other != character:
+                CharacterRelationship.objects.get_or_create(from_character=character, to_character=other,
+                                                            defaults={'description': _text(rng, 12)})
+    places = [Place.objects.create(project=project, name=f'Place {i}', type='city', description=_text(rng, 60),
+                                   atmosphere_keywords=_keywords(rng, 3)) for i in range(size)]
+    organizations = [Organization.objects.create(project=project, name=f'Organization {i}', type='guild',
+                                                 description=_text(rng, 50), goals_and_objectives=_keywords(rng, 3))
+                     for i in range(size)]
+    for place in places:
+        place.characters.set(rng.sample(characters, min(3, size)))
+    for organization in organizations:
+        organization.characters.set(rng.sample(characters, min(4, size)))
+        organization.places.set(rng.sample(places, min(2, size)))
+    for i in range(size):
+        chapter = Chapter.objects.create(project=project, title=f'Chapter {i + 1}', chapter_number=i + 1,
+                                         notes=_text(rng, 30), content=_text(rng, 1500),
+                                         point_of_view=rng.choice(characters))
+        chapter.characters.set(rng.sample(characters, min(4, size)))
+        chapter.places.set(rng.sample(places, min(2, size)))
+        plot_point = PlotPoint.objects.create(project=project, title=f'Plot point {i + 1}', order=i,
+                                              narrative_function=_keywords(rng, 2), key_events=_keywords(rng, 3),
+                                              information_revealed_to_reader=_keywords(rng, 2), chapter=chapter)
+        plot_point.characters.set(rng.sample(characters, min(3, size)))
+        ResearchNote.objects.create(project=project, title=f'Note {i + 1}', content=_text(rng, 200), tags='lore')
+    return project
+
+
+class Command(BaseCommand):
+    help = 'Report size in bytes and estimated tokens of each context format over synthetic projects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200],
+                            help='Number of entities of each kind in the synthetic projects')
+
+    def handle(self, *args, **options):
+        header = f"{'entities':>8}  {'format':<10} {'bytes':>12} {'est. tokens':>12} {'vs json':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        with transaction.atomic():
+            user = User.objects.create(username='context-format-benchmark')
+            for size in options['sizes']:
+                context_data, _ = get_project_context(create_synthetic_project(user, size))
+                baseline = None
+                for context_format in CONTEXT_FORMATS:
+                    text = serialize_context(context_data['project'], context_format)
+                    size_bytes = len(text.encode())
+                    baseline = baseline or size_bytes
+                    self.stdout.write(f'{size:>8}  {context_format:<10} {size_bytes:>12,} '
+                                      f'{estimate_tokens(text):>12,} {size_bytes / baseline:>8.0%}')
+            # Leave no synthetic data behind
+            transaction.set_rollback(True)
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from core.models import Project
+from ai.models import TextChunk
+from ai.retrieval import index_project
+
+
+class Command(BaseCommand):
+    help = 'Index the chapters, research notes and research files of projects for retrieval (see AI_RETRIEVAL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Only index this project id')
+        parser.add_argument('--rebuild', action='store_true', help='Drop and rebuild the index instead of updating it')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['project']:
+            projects = projects.filter(pk=options['project'])
+        for project in projects:
+            start = time.perf_counter()
+            changed = index_project(project, rebuild=options['rebuild'])
+            self.stdout.write(f'{project.name}: {changed} sources indexed, '
+                              f'{TextChunk.objects.filter(project=project).count()} passages '
+                              f'({time.perf_counter() - start:.2f}s)')
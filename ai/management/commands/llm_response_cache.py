@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from ai.models import CachedLLMResponse
+from ai.response_cache import cache_stats, clear, evict
+
+
+class Command(BaseCommand):
+    help = 'Show LLM response cache statistics, evict expired responses or clear the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Delete expired and least recently used responses')
+        parser.add_argument('--clear', action='store_true', help='Delete every cached response')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear()
+            self.stdout.write(self.style.SUCCESS('Cleared the response cache'))
+        elif options['evict']:
+            evict()
+
+        stats = cache_stats()
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        hits = stats['memory_hits'] + stats['db_hits']
+        self.stdout.write(f'stored responses: {CachedLLMResponse.objects.count()}')
+        for counter, value in stats.items():
+            self.stdout.write(f'{counter}: {value}')
+        if lookups:
+            self.stdout.write(f'hit rate: {hits / lookups:.0%}')
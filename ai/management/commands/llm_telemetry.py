@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from ai.telemetry import WINDOWS, prune, telemetry_summary
+
+
+class Command(BaseCommand):
+    help = 'Show LLM call latency percentiles and token usage, or delete old telemetry records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', choices=list(WINDOWS), default='24h')
+        parser.add_argument('--project', type=int, help='Only calls for this project id')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete records older than AI_LLM_TELEMETRY_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        if options['prune']:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {prune()} telemetry records'))
+
+        summary = telemetry_summary(options['window'], options['project'])
+        self.stdout.write(f"window: {summary['window']} (since {summary['since']})")
+        for name, value in summary['totals'].items():
+            self.stdout.write(f'{name}: {value}')
+        for field, values in summary['percentiles'].items():
+            if values:
+                self.stdout.write(f"{field}: " + ' '.join(f'{p}={v}' for p, v in values.items()))
+        for row in summary['projects']:
+            self.stdout.write(f"project {row['project_id']} {row['project__name']}: {row['calls']} calls, "
+                              f"{row['input_tokens']} in / {row['output_tokens']} out tokens")
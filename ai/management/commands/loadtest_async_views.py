@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, override_settings
+from ai import async_views
+from .benchmark_context_formats import create_synthetic_project
+
+
+class Command(BaseCommand):
+    help = ('Fire concurrent "improve" POSTs at the async view with a stub LLM that just sleeps, '
+            'and report how many generations were in flight at once in this process')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Total number of requests')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at most')
+        parser.add_argument('--latency', type=float, default=1.0, help='Seconds the stub LLM takes per response')
+
+    def handle(self, *args, **options):
+        # No summaries for the synthetic chapters: they would call the real LLM
+        with override_settings(AI_CHAPTER_SUMMARIES=False):
+            user = User.objects.create(username=f'async-loadtest-{time.time_ns()}')
+            project = create_synthetic_project(user, 5)
+        chapter = project.chapters.first()
+        try:
+            with mock.patch.dict(os.environ, {'GOOGLE_API_KEY': os.getenv('GOOGLE_API_KEY') or 'stub'}):
+                stats = asyncio.run(self._run(project, chapter, options))
+        finally:
+            project.delete()
+            user.delete()
+
+        sequential = options['requests'] * options['latency']
+        self.stdout.write(f"requests:           {options['requests']} ({stats['failed']} failed)")
+        self.stdout.write(f"stub LLM latency:   {options['latency']:.2f}s")
+        self.stdout.write(f"peak in flight:     {stats['peak']}")
+        self.stdout.write(f"wall time:          {stats['elapsed']:.2f}s (one at a time: {sequential:.2f}s)")
+        self.stdout.write(f"throughput:         {options['requests'] / stats['elapsed']:.1f} req/s")
+
+    async def _run(self, project, chapter, options):
+        stats = {'in_flight': 0, 'peak': 0, 'failed': 0}
+
+        async def stub_llm(prompt, *args, **kwargs):
+            stats['in_flight'] += 1
+            stats['peak'] = max(stats['peak'], stats['in_flight'])
+            try:
+                await asyncio.sleep(options['latency'])
+                return f'Stub response to {len(prompt)} characters'
+            finally:
+                stats['in_flight'] -= 1
+
+        async def async_user():
+            return project.user
+
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        body = json.dumps({'prompt': 'Write the chapter.'})
+
+        async def one_request():
+            async with semaphore:
+                request = factory.post('/', data=body, content_type='application/json')
+                # What AuthenticationMiddleware would attach
+                request.user = project.user
+                request.auser = async_user
+                response = await async_views.improve_entity_description(
+                    request, project_id=project.pk, entity_type='chapter', entity_id=chapter.pk)
+                if response.status_code != 200:
+                    stats['failed'] += 1
+
+        # Every request sends the same prompt, so keep the response cache out of it,
+        # and lift the rate limits, which would otherwise be what's measured
+        with mock.patch('ai.response_cache.agenerate_llm_response', stub_llm), \
+                override_settings(AI_RESPONSE_CACHE=False, AI_RATE_LIMITS={}):
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request() for _ in range(options['requests'])))
+            stats['elapsed'] = time.perf_counter() - start
+        return stats
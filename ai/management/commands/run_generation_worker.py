@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from ai.jobs import claim_jobs, requeue_stale_jobs, run_job, worker_name
+
+
+def _run(job):
+    close_old_connections()
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Run queued LLM generation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'AI_JOB_WORKER_CONCURRENCY', 4),
+                            help='Jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before checking an empty queue again')
+        parser.add_argument('--once', action='store_true', help='Exit once no queued job is ready to run (jobs waiting to retry stay queued)')
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        concurrency = options['concurrency']
+        self.stdout.write(f'Worker {worker} running up to {concurrency} jobs at a time')
+        running = set()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ai-job') as executor:
+            try:
+                while True:
+                    requeue_stale_jobs()
+                    if len(running) < concurrency:
+                        for job in claim_jobs(concurrency - len(running), worker):
+                            running.add(executor.submit(_run, job))
+                    if running:
+                        running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED).not_done
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping: waiting for running jobs to finish')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Project
+from ai.summaries import act_size, refresh_chapter_summary, refresh_act_summary
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated chapter and act summaries for a project'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_id', type=int)
+        parser.add_argument('--force', action='store_true', help='Regenerate summaries even if content barely changed')
+
+    def handle(self, *args, **options):
+        project = Project.objects.filter(pk=options['project_id']).first()
+        if project is None:
+            raise CommandError(f"Project {options['project_id']} does not exist")
+
+        chapters = list(project.chapters.all())
+        for chapter in chapters:
+            if refresh_chapter_summary(chapter, force=options['force']):
+                self.stdout.write(f'Summarized {chapter}')
+        # The first chapter of each act stands for the whole act
+        for chapter in chapters[::act_size()]:
+            if refresh_act_summary(chapter, force=options['force']):
+                self.stdout.write(f'Summarized the act starting at {chapter}')
+        self.stdout.write(self.style.SUCCESS('Summaries are up to date'))
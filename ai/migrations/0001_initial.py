@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('core', '0021_character_updated_at_chapter_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChapterSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField()),
+                ('content_fingerprint', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chapter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='core.chapter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ActSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('act_number', models.IntegerField()),
+                ('first_chapter_number', models.IntegerField()),
+                ('last_chapter_number', models.IntegerField()),
+                ('summary', models.TextField()),
+                ('source_hash', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='act_summaries', to='core.project')),
+            ],
+            options={
+                'ordering': ['act_number'],
+                'unique_together': {('project', 'act_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0003_generationjob'),
+        ('core', '0021_character_updated_at_chapter_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(blank=True, max_length=20)),
+                ('provider', models.CharField(max_length=20)),
+                ('model_name', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('success', 'Success'), ('error', 'Error'), ('cancelled', 'Cancelled')], max_length=10)),
+                ('streamed', models.BooleanField(default=False)),
+                ('prompt_bytes', models.PositiveIntegerField()),
+                ('estimated_input_tokens', models.PositiveIntegerField()),
+                ('estimated_output_tokens', models.PositiveIntegerField(default=0)),
+                ('input_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('output_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('cached_input_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('queue_ms', models.PositiveIntegerField(default=0)),
+                ('first_token_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='core.project')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['project', 'created_at'], name='ai_llmcallr_project_3a82b0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0004_llmcallrecord'),
+        ('core', '0021_character_updated_at_chapter_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=20)),
+                ('source_id', models.IntegerField()),
+                ('position', models.IntegerField()),
+                ('text', models.TextField()),
+                ('source_hash', models.CharField(max_length=16)),
+                ('terms', models.BinaryField()),
+                ('weights', models.BinaryField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='text_chunks', to='core.project')),
+            ],
+            options={
+                'ordering': ['source', 'source_id', 'position'],
+                'indexes': [models.Index(fields=['project', 'source', 'source_id'], name='ai_textchun_project_bf9ffa_idx')],
+            },
+        ),
+    ]
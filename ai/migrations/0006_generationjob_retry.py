@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0005_textchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='retries',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.core.management import call_command
+from django.db import migrations
+
+TABLE = 'ai_rate_limit_cache'
+
+
+def create_cache_table(apps, schema_editor):
+    # The table of the 'ai_rate_limit' DatabaseCache (see writing/settings.py)
+    call_command('createcachetable', TABLE, database=schema_editor.connection.alias, verbosity=0)
+
+
+def drop_cache_table(apps, schema_editor):
+    schema_editor.execute(f'DROP TABLE IF EXISTS {schema_editor.quote_name(TABLE)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0006_generationjob_retry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, drop_cache_table),
+    ]
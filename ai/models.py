@@ -1,3 +1,134 @@
 from django.db import models
+from core.models import Project, Chapter
 
-# Create your models here.
+
+class ChapterSummary(models.Model):
+    chapter = models.OneToOneField(Chapter, on_delete=models.CASCADE, related_name='summary')
+    summary = models.TextField()
+    # Short hashes of the summarized content's paragraphs, to measure how much it changed since
+    content_fingerprint = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.chapter}"
+
+
+class ActSummary(models.Model):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='act_summaries')
+    act_number = models.IntegerField()
+    first_chapter_number = models.IntegerField()
+    last_chapter_number = models.IntegerField()
+    summary = models.TextField()
+    # Hash of the chapter summaries the act summary was written from
+    source_hash = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Act {self.act_number} of {self.project}"
+
+    class Meta:
+        ordering = ['act_number']
+        unique_together = ['project', 'act_number']
+
+
+class CachedLLMResponse(models.Model):
+    # sha256 of the model name, generation config and prompt (see ai.response_cache)
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=100)
+    response = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Cached {self.model_name} response {self.key[:12]}"
+
+
+class GenerationJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='generation_jobs')
+    entity_type = models.CharField(max_length=20)
+    entity_id = models.IntegerField()
+    prompt = models.TextField()
+    bypass_cache = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Put back after a rate limit or provider outage: retried no earlier than this
+    retries = models.PositiveIntegerField(default=0)
+    not_before = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.entity_type.capitalize()} generation job {self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+
+class LLMCallRecord(models.Model):
+    """One LLM call made through ai.llm_utils (see ai.telemetry)."""
+    STATUS_CHOICES = [
+        ('success', 'Success'),
+        ('error', 'Error'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    # Kept when the project is deleted, so past usage still adds up
+    project = models.ForeignKey(Project, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+    entity_type = models.CharField(max_length=20, blank=True)
+    provider = models.CharField(max_length=20)
+    model_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    streamed = models.BooleanField(default=False)
+    prompt_bytes = models.PositiveIntegerField()
+    # Estimates at about 4 characters per token, as used by the rate limits
+    estimated_input_tokens = models.PositiveIntegerField()
+    estimated_output_tokens = models.PositiveIntegerField(default=0)
+    # As reported by the provider; null when it doesn't report usage
+    input_tokens = models.PositiveIntegerField(null=True, blank=True)
+    output_tokens = models.PositiveIntegerField(null=True, blank=True)
+    cached_input_tokens = models.PositiveIntegerField(null=True, blank=True)
+    # Time spent waiting for a job worker or the rate limits before the call
+    queue_ms = models.PositiveIntegerField(default=0)
+    first_token_ms = models.PositiveIntegerField(null=True, blank=True)
+    latency_ms = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.model_name} call {self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['project', 'created_at'])]
+
+
+class TextChunk(models.Model):
+    """A passage of a chapter, research note or research file with its hashed term vector (see ai.retrieval)."""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='text_chunks')
+    # Key of the source in ai.retrieval.SOURCES: 'chapters', 'research_notes' or 'research_files'
+    source = models.CharField(max_length=20)
+    source_id = models.IntegerField()
+    position = models.IntegerField()
+    text = models.TextField()
+    # Hash of the whole indexed source text, to skip re-indexing unchanged sources
+    source_hash = models.CharField(max_length=16)
+    # Sparse vector: uint16 term buckets and float16 term weights
+    terms = models.BinaryField()
+    weights = models.BinaryField()
+
+    def __str__(self):
+        return f"Chunk {self.position} of {self.source} {self.source_id}"
+
+    class Meta:
+        ordering = ['source', 'source_id', 'position']
+        indexes = [models.Index(fields=['project', 'source', 'source_id'])]
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .fragments import get_cache
+from .prompts import CONTEXT_END_MARKER
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ['context_caches_created', 'context_cache_reuses', 'context_cache_fallbacks', 'prefix_bytes_reused']
+
+_lock = threading.Lock()
+_stats = {counter: 0 for counter in COUNTERS}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _count(counter, amount=1):
+    with _lock:
+        _stats[counter] += amount
+
+
+def prompt_cache_stats():
+    with _lock:
+        return dict(_stats)
+
+
+def split_prompt(prompt):
+    """Split a prompt into its project context prefix and the rest, or (None, prompt).
+
+    prefix + rest is always the original prompt.
+    """
+    index = prompt.find(CONTEXT_END_MARKER)
+    if index == -1:
+        return None, prompt
+    end = index + len(CONTEXT_END_MARKER)
+    return prompt[:end], prompt[end:]
+
+
+def _ttl():
+    return _setting('AI_PROVIDER_CONTEXT_CACHE_TTL', 60 * 60)
+
+
+def _prefix_key(provider, prefix, model_name):
+    digest = hashlib.sha256(prefix.encode()).hexdigest()
+    return f"ai:prompt-prefix:{type(provider).__name__}:{model_name or ''}:{digest}"
+
+
+def _context_cache_for(provider, key, prefix, model_name):
+    """Name of a provider-side cache holding the prefix, created on first use."""
+    cache = get_cache()
+    name = cache.get(key)
+    if name is not None:
+        return name, False
+    name = provider.create_context_cache(prefix, model_name, _ttl())
+    # Forget the name a little before the provider does
+    cache.set(key, name, timeout=max(1, _ttl() - 60))
+    return name, True
+
+
+def prepare_prompt(provider, prompt, model_name=None):
+    """What to send for a prompt: (prompt, cached_context, prefix_key).
+
+    With provider context caching on and a project context prefix of at least
+    AI_PROVIDER_CONTEXT_CACHE_MIN_TOKENS, the prefix lives in a provider-side
+    cache and only the rest of the prompt is sent. Otherwise the prompt is sent
+    as it is, with cached_context and prefix_key None.
+    """
+    if not _setting('AI_PROVIDER_CONTEXT_CACHE', False) or not provider.supports_context_cache:
+        return prompt, None, None
+    prefix, rest = split_prompt(prompt)
+    if prefix is None or len(prefix) < _setting('AI_PROVIDER_CONTEXT_CACHE_MIN_TOKENS', 4096) * 4:
+        return prompt, None, None
+    key = _prefix_key(provider, prefix, model_name)
+    try:
+        name, created = _context_cache_for(provider, key, prefix, model_name)
+    except Exception:
+        # e.g. a model without context caching support: fall back to the plain prompt
+        logger.exception('Could not create a provider context cache')
+        _count('context_cache_fallbacks')
+        return prompt, None, None
+    if created:
+        _count('context_caches_created')
+    else:
+        _count('context_cache_reuses')
+        _count('prefix_bytes_reused', len(prefix.encode()))
+    return rest, name, key
+
+
+def _forget(key):
+    # The provider lost the cache (expired early or deleted); the next call creates a new one
+    logger.warning('Provider context cache for %s failed, sending the full prompt', key)
+    get_cache().delete(key)
+    _count('context_cache_fallbacks')
+
+
+def generate(provider, prompt, model_name=None, generation_config=None, usage=None):
+    sent, cached_context, key = prepare_prompt(provider, prompt, model_name)
+    if cached_context is None:
+        return provider.generate(prompt, model_name, generation_config, usage=usage)
+    try:
+        return provider.generate(sent, model_name, generation_config, cached_context, usage)
+    except Exception:
+        _forget(key)
+        return provider.generate(prompt, model_name, generation_config, usage=usage)
+
+
+def stream(provider, prompt, model_name=None, generation_config=None, usage=None):
+    sent, cached_context, _ = prepare_prompt(provider, prompt, model_name)
+    return provider.stream(sent, model_name, generation_config, cached_context, usage)
+
+
+async def agenerate(provider, prompt, model_name=None, generation_config=None, usage=None):
+    sent, cached_context, key = await sync_to_async(prepare_prompt)(provider, prompt, model_name)
+    if cached_context is None:
+        return await provider.agenerate(prompt, model_name, generation_config, usage=usage)
+    try:
+        return await provider.agenerate(sent, model_name, generation_config, cached_context, usage)
+    except Exception:
+        await sync_to_async(_forget)(key)
+        return await provider.agenerate(prompt, model_name, generation_config, usage=usage)
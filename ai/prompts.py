@@ -1,14 +1,23 @@
-BASE_PROMPT = '''Improve the following {entity_type} for this writing project.
+# The project context leads every prompt that uses it, so the large part of the
+# prompt is an identical prefix across improve calls (see ai.prompt_cache).
+CONTEXT_END_MARKER = '=== End of project context ==='
+
+PROJECT_CONTEXT_PREFIX = '''Project context for this writing project:
+{llm_context}
+
+''' + CONTEXT_END_MARKER + '''
+
+'''
+
+BASE_PROMPT = PROJECT_CONTEXT_PREFIX + '''Improve the following {entity_type} for this writing project.
 Be consistent with existing information and maintain a literary quality.
 Write plain text with no comments, explanations, or JSON formatting.
+Use the project context above, focusing only on information relevant to this {entity_type}.
 
 Current {entity_type}:
 {description}
 
-{additional_context}
-
-Project context will follow. Focus only on information relevant to this {entity_type}:
-{llm_context}'''
+{additional_context}'''
 
 # Character-specific prompt
 CHARACTER_BIO_PROMPT = BASE_PROMPT.format(
@@ -57,7 +66,7 @@ Please provide an improved organization description that:
 )
 
 # Chapter content prompt
-CHAPTER_CONTENT_PROMPT = '''Write the content for Chapter {chapter_number}: {chapter_title}
+CHAPTER_CONTENT_PROMPT = PROJECT_CONTEXT_PREFIX + '''Write the content for Chapter {chapter_number}: {chapter_title}
 Be consistent with existing information and maintain a literary quality.
 Write plain text with no comments, explanations, or JSON formatting.
 
@@ -65,8 +74,22 @@ POV Character: {point_of_view_character}
 Chapter Notes: {chapter_notes}
 
 Write narrative fiction with dialogue and description appropriate to the story.
-Be consistent with existing characters, plot progression, and tone.
-Provide only the chapter content without comments or explanations. No chapter title, chapter number, or chapter notes.
+Be consistent with the project context above: existing characters, plot progression, and tone.
+Provide only the chapter content without comments or explanations. No chapter title, chapter number, or chapter notes.'''
+
+# Chapter summary prompt, used to keep old chapters out of the prompt context
+CHAPTER_SUMMARY_PROMPT = '''Summarize Chapter {chapter_number}: {chapter_title} of this writing project.
+Write plain text with no comments, explanations, or JSON formatting.
+In at most {max_words} words, cover the key events, which characters appear and how they change,
+where the chapter takes place, and any information revealed to the reader.
+
+Chapter content:
+{content}'''
+
+# Act summary prompt, condensing the summaries of consecutive chapters
+ACT_SUMMARY_PROMPT = '''Summarize chapters {first_chapter_number} to {last_chapter_number} of this writing project as one act.
+Write plain text with no comments, explanations, or JSON formatting.
+In at most {max_words} words, cover the main plot developments, character arcs and open threads.
 
-Relevant project context:
-{llm_context}'''
\ No newline at end of file
+Chapter summaries:
+{chapter_summaries}'''
@@ -0,0 +1,315 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Rough characters-per-token ratio, as in ai.budget
+CHARS_PER_TOKEN = 4
+# Models bound to a context cache kept per process; each cached prefix gets its
+# own, and they outlive the caches themselves, so the least recently used go
+MAX_CACHED_CONTENT_MODELS = 64
+
+
+def default_model_name():
+    return getattr(settings, 'AI_LLM_MODEL', 'gemini-2.0-flash')
+
+
+class LLMProvider(abc.ABC):
+    """What the AI features need from an LLM backend.
+
+    model_name and generation_config are optional everywhere; providers fall back
+    to AI_LLM_MODEL and their own defaults.
+    """
+    # Environment variable holding the API key, if the provider needs one
+    api_key_env = None
+    # Whether the provider can keep a prompt prefix on its side (create_context_cache)
+    supports_context_cache = False
+
+    @abc.abstractmethod
+    def generate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        """Generate a response. With cached_context (a name from create_context_cache)
+        the prompt is only what follows the cached prefix.
+
+        Providers that report token usage fill the `usage` dict with input_tokens,
+        output_tokens and cached_input_tokens.
+        """
+
+    def stream(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        """Yield the response text in chunks as it is produced."""
+        yield self.generate(prompt, model_name, generation_config, cached_context, usage)
+
+    async def agenerate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        return await sync_to_async(self.generate, thread_sensitive=False)(
+            prompt, model_name, generation_config, cached_context, usage)
+
+    @abc.abstractmethod
+    def create_context_cache(self, prefix, model_name, ttl):
+        """Store a prompt prefix with the provider for `ttl` seconds and return its name."""
+
+    def count_tokens(self, text, model_name=None):
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def warm_up(self, model_names=None):
+        pass
+
+
+class GeminiClientManager:
+    """Process-wide Gemini setup: configures the client once and reuses model objects.
+
+    genai.configure() throws away the underlying API clients (and their open
+    connections), so it runs only on first use, or again after reset().
+    GenerativeModel objects are cached per model name and generation settings;
+    each keeps its API client, so later calls reuse its connection.
+
+    The SDK itself is imported on first use: it takes a noticeable part of a
+    second, which every manage.py command would otherwise pay.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._genai = None
+        self._models = {}
+        self._cached_content_models = OrderedDict()
+
+    @property
+    def genai(self):
+        self.configure()
+        return self._genai
+
+    def configure(self):
+        if self._genai is not None:
+            return
+        with self._lock:
+            if self._genai is not None:
+                return
+            api_key = os.getenv('GOOGLE_API_KEY')
+            if not api_key:
+                raise ValueError("Google API key not found in environment variables")
+            import google.generativeai as genai
+            # AI_LLM_TRANSPORT picks 'grpc' (the default) or 'rest'
+            genai.configure(api_key=api_key, transport=getattr(settings, 'AI_LLM_TRANSPORT', None))
+            self._genai = genai
+
+    def get_model(self, model_name=None, generation_config=None):
+        genai = self.genai
+        model_name = model_name or default_model_name()
+        key = (model_name, json.dumps(generation_config, sort_keys=True) if generation_config else None)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = genai.GenerativeModel(model_name, generation_config=generation_config)
+                    self._models[key] = model
+        return model
+
+    def get_cached_model(self, cached_context, generation_config=None):
+        """A model bound to a cached content (context cache) by name."""
+        genai = self.genai
+        key = (cached_context, json.dumps(generation_config, sort_keys=True) if generation_config else None)
+        with self._lock:
+            model = self._cached_content_models.get(key)
+            if model is not None:
+                self._cached_content_models.move_to_end(key)
+                return model
+        model = genai.GenerativeModel.from_cached_content(cached_context, generation_config=generation_config)
+        with self._lock:
+            self._cached_content_models[key] = model
+            while len(self._cached_content_models) > MAX_CACHED_CONTENT_MODELS:
+                self._cached_content_models.popitem(last=False)
+        return model
+
+    def warm_up(self, model_names=None, connect=True):
+        """Build the model objects up front and, with connect, open the API connection."""
+        for model_name in model_names or [default_model_name()]:
+            self.get_model(model_name)
+            if connect:
+                # A cheap metadata request that sets up the shared client and its channel
+                self.genai.get_model(f'models/{model_name}')
+
+    def reset(self):
+        """Forget the configuration and cached models, e.g. after rotating the API key."""
+        with self._lock:
+            self._genai = None
+            self._models.clear()
+            self._cached_content_models.clear()
+
+
+class GeminiProvider(LLMProvider):
+    api_key_env = 'GOOGLE_API_KEY'
+    supports_context_cache = True
+
+    def __init__(self):
+        self.client = GeminiClientManager()
+
+    def _request_options(self):
+        # Lets the SDK drop a call that outlived the policy deadline (ai.resilience)
+        return {'timeout': getattr(settings, 'AI_LLM_TIMEOUT', 60)}
+
+    def _model(self, model_name, generation_config, cached_context):
+        if cached_context:
+            return self.client.get_cached_model(cached_context, generation_config)
+        return self.client.get_model(model_name, generation_config)
+
+    def _record_usage(self, response, usage):
+        metadata = getattr(response, 'usage_metadata', None)
+        if usage is None or not metadata or not metadata.prompt_token_count:
+            return
+        usage.update({
+            'input_tokens': metadata.prompt_token_count,
+            'output_tokens': metadata.candidates_token_count,
+            'cached_input_tokens': metadata.cached_content_token_count,
+        })
+
+    def generate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        response = self._model(model_name, generation_config, cached_context).generate_content(
+            prompt, request_options=self._request_options())
+        self._record_usage(response, usage)
+        return response.text
+
+    def stream(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        model = self._model(model_name, generation_config, cached_context)
+        for chunk in model.generate_content(prompt, stream=True, request_options=self._request_options()):
+            # The last chunk carries the usage of the whole response
+            self._record_usage(chunk, usage)
+            # Chunks without parts (e.g. a final safety/finish chunk) have no text
+            if chunk.parts:
+                yield chunk.text
+
+    async def agenerate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        response = await self._model(model_name, generation_config, cached_context).generate_content_async(
+            prompt, request_options=self._request_options())
+        self._record_usage(response, usage)
+        return response.text
+
+    def create_context_cache(self, prefix, model_name, ttl):
+        from google.generativeai import caching
+        self.client.configure()
+        cached_content = caching.CachedContent.create(
+            model=f'models/{model_name or default_model_name()}', contents=[prefix],
+            ttl=timedelta(seconds=ttl))
+        return cached_content.name
+
+    def count_tokens(self, text, model_name=None):
+        return self.client.get_model(model_name).count_tokens(text).total_tokens
+
+    def warm_up(self, model_names=None):
+        self.client.warm_up(model_names)
+
+
+class LocalProvider(LLMProvider):
+    """Deterministic offline stand-in for benchmarks and tests.
+
+    Answers with a fixed header and the end of the prompt, after waiting
+    AI_LOCAL_LLM_LATENCY seconds for the first token and then producing
+    AI_LOCAL_LLM_TOKENS_PER_SECOND tokens per second (None for no limit).
+    Context caches are kept in memory until their TTL passes, at most
+    MAX_CACHED_CONTENT_MODELS of them, and answers are the same as for the full prompt.
+    """
+
+    supports_context_cache = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (prefix, expiry on the monotonic clock), least recently used first
+        self._context_caches = OrderedDict()
+
+    def _full_prompt(self, prompt, cached_context):
+        if not cached_context:
+            return prompt
+        with self._lock:
+            prefix, expires = self._context_caches.get(cached_context, (None, 0))
+            if expires <= time.monotonic():
+                self._context_caches.pop(cached_context, None)
+                # Like a provider's error for an expired cache; the caller sends the full prompt
+                raise LookupError(f'Context cache {cached_context} not found')
+            self._context_caches.move_to_end(cached_context)
+        return prefix + prompt
+
+    def create_context_cache(self, prefix, model_name, ttl):
+        name = f'cachedContents/local-{hashlib.sha256(prefix.encode()).hexdigest()[:16]}'
+        with self._lock:
+            self._context_caches[name] = (prefix, time.monotonic() + ttl)
+            self._context_caches.move_to_end(name)
+            while len(self._context_caches) > MAX_CACHED_CONTENT_MODELS:
+                self._context_caches.popitem(last=False)
+        return name
+
+    def _settings(self):
+        return (getattr(settings, 'AI_LOCAL_LLM_LATENCY', 0.5),
+                getattr(settings, 'AI_LOCAL_LLM_TOKENS_PER_SECOND', None))
+
+    def respond(self, prompt, model_name=None):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        echo = ' '.join(prompt.split()[-getattr(settings, 'AI_LOCAL_LLM_ECHO_WORDS', 50):])
+        return f'[{model_name or default_model_name()} local response {digest}] {echo}'
+
+    def _chunks(self, text):
+        words = text.split(' ')
+        for start in range(0, len(words), 8):
+            chunk = ' '.join(words[start:start + 8])
+            yield chunk if start + 8 >= len(words) else f'{chunk} '
+
+    def _delay(self, text):
+        _, tokens_per_second = self._settings()
+        return self.count_tokens(text) / tokens_per_second if tokens_per_second else 0
+
+    def _answer(self, prompt, model_name, cached_context, usage):
+        full_prompt = self._full_prompt(prompt, cached_context)
+        text = self.respond(full_prompt, model_name)
+        if usage is not None:
+            usage.update({
+                'input_tokens': self.count_tokens(full_prompt),
+                'output_tokens': self.count_tokens(text),
+                'cached_input_tokens': self.count_tokens(full_prompt) - self.count_tokens(prompt) if cached_context else 0,
+            })
+        return text
+
+    def generate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        text = self._answer(prompt, model_name, cached_context, usage)
+        latency, _ = self._settings()
+        time.sleep(latency + self._delay(text))
+        return text
+
+    def stream(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        latency, _ = self._settings()
+        time.sleep(latency)
+        for chunk in self._chunks(self._answer(prompt, model_name, cached_context, usage)):
+            time.sleep(self._delay(chunk))
+            yield chunk
+
+    async def agenerate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+        text = self._answer(prompt, model_name, cached_context, usage)
+        latency, _ = self._settings()
+        await asyncio.sleep(latency + self._delay(text))
+        return text
+
+
+PROVIDERS = {
+    'gemini': GeminiProvider,
+    'local': LocalProvider,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name=None):
+    """The provider instance selected by AI_LLM_PROVIDER (one per process)."""
+    name = name or getattr(settings, 'AI_LLM_PROVIDER', 'gemini')
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                if name not in PROVIDERS:
+                    raise ValueError(f'Unknown LLM provider: {name}')
+                provider = _providers[name] = PROVIDERS[name]()
+    return provider
@@ -0,0 +1,212 @@
+import asyncio
+import math
+import time
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Bucket updates happen under one lock entry in the shared cache, so limits hold
+# across worker processes. The critical section is a few cache round trips.
+LOCK_KEY = 'ai:ratelimit:lock'
+LOCK_TIMEOUT = 5
+LOCK_POLL_INTERVAL = 0.005
+WAITERS_KEY = 'ai:ratelimit:waiting'
+
+DEFAULT_LIMITS = {
+    'user': {'requests_per_minute': 10, 'tokens_per_minute': 250_000},
+    'global': {'requests_per_minute': 60, 'tokens_per_minute': 1_000_000},
+}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(RateLimitExceeded):
+    """Needs more tokens than a bucket holds, so waiting would never admit it."""
+
+    def __init__(self, tokens, capacity):
+        super().__init__(f'This needs about {tokens} tokens, more than the {capacity} a minute '
+                         'the AI rate limits allow; try a smaller request', None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_cache():
+    """The cache holding the buckets, shared by all worker processes."""
+    return caches[_setting('AI_RATE_LIMIT_CACHE_ALIAS', 'ai_rate_limit')]
+
+
+def process_local(cache):
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def limits():
+    return _setting('AI_RATE_LIMITS', DEFAULT_LIMITS)
+
+
+def estimate_request_tokens(prompt):
+    """Prompt tokens (at about 4 characters each) plus the expected response length."""
+    return (len(prompt) + 3) // 4 + _setting('AI_RATE_LIMIT_RESPONSE_TOKENS', 1000)
+
+
+def client_key(request, user=None):
+    """Who a request is limited as: the signed-in user, else the client address.
+
+    Async views pass the user from `await request.auser()`.
+    """
+    user = user or getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def _buckets(client, tokens):
+    """(cache key, capacity per minute, amount to take) for every bucket a request draws from.
+
+    Raises RequestTooLarge if the amount is more than a bucket's capacity.
+    """
+    buckets = []
+    for scope, scope_key in (('user', client), ('global', 'all')):
+        if scope == 'user' and client is None:
+            continue
+        for resource, amount in (('requests_per_minute', 1), ('tokens_per_minute', tokens)):
+            capacity = (limits().get(scope) or {}).get(resource)
+            if capacity and amount > capacity:
+                raise RequestTooLarge(amount, capacity)
+            if capacity:
+                buckets.append((f'ai:ratelimit:{scope_key}:{resource}', capacity, amount))
+    return buckets
+
+
+def _lock(cache):
+    """Take the lock; returns the token that releases it."""
+    token = uuid.uuid4().hex
+    holder = None
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(LOCK_KEY, token, timeout=LOCK_TIMEOUT):
+        current = cache.get(LOCK_KEY)
+        if current != holder:
+            # Another holder (or none): give it the full timeout from now
+            holder = current
+            deadline = time.monotonic() + LOCK_TIMEOUT
+        elif time.monotonic() > deadline:
+            # The same holder for LOCK_TIMEOUT, so it died without releasing
+            cache.delete(LOCK_KEY)
+            holder = None
+            continue
+        time.sleep(LOCK_POLL_INTERVAL)
+    return token
+
+
+def _unlock(cache, token):
+    # A lock broken as stale may since belong to another worker
+    if cache.get(LOCK_KEY) == token:
+        cache.delete(LOCK_KEY)
+
+
+def try_acquire(client, tokens):
+    """Take from every bucket if all have enough; otherwise return the seconds until they will."""
+    buckets = _buckets(client, tokens)
+    if not buckets:
+        return 0
+    cache = get_cache()
+    token = _lock(cache)
+    try:
+        now = time.time()
+        levels = {}
+        wait = 0
+        for key, capacity, amount in buckets:
+            level, updated = cache.get(key) or (capacity, now)
+            level = min(capacity, level + (now - updated) * capacity / 60)
+            levels[key] = level
+            if level < amount:
+                wait = max(wait, (amount - level) * 60 / capacity)
+        if wait:
+            return wait
+        cache.set_many({key: (levels[key] - amount, now) for key, _, amount in buckets}, timeout=120)
+        return 0
+    finally:
+        _unlock(cache, token)
+
+
+def _enter_queue(cache):
+    cache.add(WAITERS_KEY, 0, timeout=None)
+    waiting = cache.incr(WAITERS_KEY)
+    if waiting > _setting('AI_RATE_LIMIT_MAX_WAITERS', 20):
+        cache.decr(WAITERS_KEY)
+        return False
+    return True
+
+
+def _check_wait(wait, waited):
+    if waited + wait > _setting('AI_RATE_LIMIT_WAIT_TIMEOUT', 10):
+        raise RateLimitExceeded('Too many AI requests right now, please try again shortly', math.ceil(wait))
+
+
+def admit(client, prompt):
+    """Block until the request fits the rate limits, or raise RateLimitExceeded.
+
+    Requests wait at most AI_RATE_LIMIT_WAIT_TIMEOUT seconds, and only
+    AI_RATE_LIMIT_MAX_WAITERS of them at a time; the rest are rejected straight away.
+    """
+    _wait_for(client, estimate_request_tokens(prompt))
+
+
+def admit_batch(client, prompts):
+    """Admit a bulk run once for all its prompts, which then skip admit.
+
+    The batch is one user action, so it takes one request, instead of failing
+    part-way through when it has more prompts than the per-minute request
+    limit, but the tokens of all its prompts; a batch needing more tokens than
+    a bucket holds raises RequestTooLarge.
+    """
+    if prompts:
+        _wait_for(client, sum(estimate_request_tokens(prompt) for prompt in prompts))
+
+
+def _wait_for(client, tokens):
+    wait = try_acquire(client, tokens)
+    if not wait:
+        return
+    _check_wait(wait, 0)
+    cache = get_cache()
+    if not _enter_queue(cache):
+        raise RateLimitExceeded('Too many AI requests are waiting, please try again shortly', math.ceil(wait))
+    try:
+        started = time.monotonic()
+        while wait:
+            time.sleep(wait)
+            wait = try_acquire(client, tokens)
+            if wait:
+                _check_wait(wait, time.monotonic() - started)
+    finally:
+        cache.decr(WAITERS_KEY)
+
+
+async def aadmit(client, prompt):
+    """Async version of admit; waits on the event loop instead of a thread."""
+    tokens = estimate_request_tokens(prompt)
+    wait = await sync_to_async(try_acquire)(client, tokens)
+    if not wait:
+        return
+    _check_wait(wait, 0)
+    cache = get_cache()
+    if not await sync_to_async(_enter_queue)(cache):
+        raise RateLimitExceeded('Too many AI requests are waiting, please try again shortly', math.ceil(wait))
+    try:
+        started = time.monotonic()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = await sync_to_async(try_acquire)(client, tokens)
+            if wait:
+                _check_wait(wait, time.monotonic() - started)
+    finally:
+        await sync_to_async(cache.decr)(WAITERS_KEY)
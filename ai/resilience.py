@@ -0,0 +1,308 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+
+# Provider errors worth another attempt, matched by class name so the provider
+# SDKs don't have to be imported (google.api_core's are the ones seen in practice).
+RETRYABLE_ERRORS = {
+    'ServiceUnavailable', 'InternalServerError', 'TooManyRequests', 'ResourceExhausted',
+    'DeadlineExceeded', 'GatewayTimeout', 'BadGateway', 'ConnectionError', 'TimeoutError',
+}
+
+# Successful call latencies kept to estimate the p95 that triggers a hedged request
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__('The AI provider is unavailable at the moment, please try again shortly')
+        self.retry_after = retry_after
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_retryable(error):
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """Fails calls fast after AI_LLM_BREAKER_FAILURES failures in a row.
+
+    After AI_LLM_BREAKER_RESET seconds one trial call is let through
+    ("half open"); its outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self._trial_running = False
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call may not go ahead; returns True if it is the half-open trial."""
+        with self._lock:
+            if self.state == 'closed':
+                return False
+            remaining = self.opened_at + _setting('AI_LLM_BREAKER_RESET', 30) - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            metrics.count('breaker_rejections')
+            raise CircuitOpenError(max(1, math.ceil(remaining)))
+
+    def release_trial(self):
+        """Let another call be the trial when one ended without an outcome (abandoned or cancelled)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= _setting('AI_LLM_BREAKER_FAILURES', 5):
+                if self.state != 'open':
+                    metrics.count('breaker_opened')
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            if len(self.latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, 'p95_seconds': self.p95(), 'breaker_state': breaker.state}
+
+
+breaker = CircuitBreaker()
+metrics = Metrics()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_setting('AI_LLM_CALL_THREADS', 32), thread_name_prefix='ai-llm')
+    return _executor
+
+
+def _hedge_delay():
+    if not _setting('AI_LLM_HEDGE', False):
+        return None
+    return _setting('AI_LLM_HEDGE_DELAY', None) or metrics.p95()
+
+
+def _backoff(attempt):
+    # "Full jitter": a random wait up to the exponential backoff cap
+    cap = min(_setting('AI_LLM_BACKOFF_MAX', 8), _setting('AI_LLM_BACKOFF_BASE', 0.5) * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def _timed(fn):
+    start = time.monotonic()
+    result = fn()
+    metrics.record_latency(time.monotonic() - start)
+    return result
+
+
+def _attempt(fn, deadline):
+    """One attempt, plus a hedged duplicate if it is slower than the hedge delay."""
+    executor = _get_executor()
+    futures = [executor.submit(_timed, fn)]
+    hedge_delay = _hedge_delay()
+    if hedge_delay is not None and time.monotonic() + hedge_delay < deadline:
+        if not wait(futures, timeout=hedge_delay).done:
+            futures.append(executor.submit(_timed, fn))
+            metrics.count('hedges')
+    hedge = futures[-1] if len(futures) > 1 else None
+
+    error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            metrics.count('timeouts')
+            raise LLMTimeoutError('The AI provider did not answer in time')
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    metrics.count('hedge_wins')
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _handle_failure(error, attempt, deadline):
+    """Return the backoff before the next attempt, or re-raise when giving up."""
+    metrics.count('failures')
+    if not is_retryable(error):
+        # The provider answered (e.g. rejected the prompt), so it isn't degraded
+        breaker.record_success()
+        raise error
+    breaker.record_failure()
+    if attempt >= _setting('AI_LLM_RETRIES', 2):
+        raise error
+    delay = _backoff(attempt)
+    if time.monotonic() + delay >= deadline:
+        raise error
+    metrics.count('retries')
+    return delay
+
+
+def call_with_policy(fn):
+    """Run a provider call under the resilience policy.
+
+    - the whole call, retries included, has AI_LLM_TIMEOUT seconds
+    - retryable errors are retried up to AI_LLM_RETRIES times, with exponential
+      backoff and jitter
+    - with AI_LLM_HEDGE, an attempt still running after the p95 latency (or
+      AI_LLM_HEDGE_DELAY) gets a duplicate, and the first answer wins
+    - the circuit breaker rejects calls outright while the provider is failing
+    """
+    trial = breaker.before_call()
+    metrics.count('calls')
+    deadline = time.monotonic() + _setting('AI_LLM_TIMEOUT', 60)
+    attempt = 0
+    try:
+        while True:
+            try:
+                result = _attempt(fn, deadline)
+            except Exception as e:
+                time.sleep(_handle_failure(e, attempt, deadline))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+    finally:
+        if trial:
+            breaker.release_trial()
+
+
+async def _atimed(coroutine_fn):
+    start = time.monotonic()
+    result = await coroutine_fn()
+    metrics.record_latency(time.monotonic() - start)
+    return result
+
+
+async def _aattempt(coroutine_fn, deadline):
+    tasks = [asyncio.ensure_future(_atimed(coroutine_fn))]
+    hedge_delay = _hedge_delay()
+    try:
+        if hedge_delay is not None and time.monotonic() + hedge_delay < deadline:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                tasks.append(asyncio.ensure_future(_atimed(coroutine_fn)))
+                metrics.count('hedges')
+        hedge = tasks[-1] if len(tasks) > 1 else None
+
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                metrics.count('timeouts')
+                raise LLMTimeoutError('The AI provider did not answer in time')
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        metrics.count('hedge_wins')
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def acall_with_policy(coroutine_fn):
+    """Async version of call_with_policy; coroutine_fn() returns a fresh awaitable per attempt."""
+    trial = breaker.before_call()
+    metrics.count('calls')
+    deadline = time.monotonic() + _setting('AI_LLM_TIMEOUT', 60)
+    attempt = 0
+    try:
+        while True:
+            try:
+                result = await _aattempt(coroutine_fn, deadline)
+            except Exception as e:
+                await asyncio.sleep(_handle_failure(e, attempt, deadline))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+    finally:
+        # Also reached on CancelledError, which isn't an Exception
+        if trial:
+            breaker.release_trial()
+
+
+def stream_with_policy(stream_fn):
+    """Pass a streamed response through, guarded by the circuit breaker.
+
+    Chunks already sent can't be taken back, so streams are not retried or hedged.
+    """
+    trial = breaker.before_call()
+    metrics.count('calls')
+    try:
+        yield from stream_fn()
+    except Exception as e:
+        metrics.count('failures')
+        if is_retryable(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        # Also reached on GeneratorExit, when the client drops the stream
+        if trial:
+            breaker.release_trial()
+
+
+def resilience_stats():
+    return metrics.snapshot()
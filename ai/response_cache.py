@@ -0,0 +1,167 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .fragments import get_cache
+from .llm_utils import default_model_name, generate_llm_response, agenerate_llm_response
+from .models import CachedLLMResponse
+from .rate_limit import admit, aadmit
+from .telemetry import with_queue_time
+
+COUNTERS = ['memory_hits', 'db_hits', 'misses', 'bypassed']
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cache_enabled():
+    return _setting('AI_RESPONSE_CACHE', False)
+
+
+def _ttl():
+    return _setting('AI_RESPONSE_CACHE_TTL', 7 * 24 * 60 * 60)
+
+
+def response_key(prompt, model_name=None, generation_config=None):
+    # The provider is part of the key: the same model name can answer differently elsewhere
+    provider = _setting('AI_LLM_PROVIDER', 'gemini')
+    payload = json.dumps([provider, model_name or default_model_name(), generation_config or {}, prompt],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _count(counter):
+    # Kept in the shared AI cache so every worker process adds to the same numbers
+    cache = get_cache()
+    key = f'ai:response-cache:{counter}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def cache_stats():
+    cache = get_cache()
+    return {counter: cache.get(f'ai:response-cache:{counter}', 0) for counter in COUNTERS}
+
+
+def _memory_get(key):
+    with _memory_lock:
+        item = _memory.get(key)
+        if item is None:
+            return None
+        expires, text = item
+        if expires < timezone.now():
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return text
+
+
+def _memory_put(key, text, expires):
+    with _memory_lock:
+        _memory[key] = (expires, text)
+        _memory.move_to_end(key)
+        while len(_memory) > _setting('AI_RESPONSE_CACHE_MEMORY_ENTRIES', 256):
+            _memory.popitem(last=False)
+
+
+def lookup(key):
+    """Return the cached response for a key, from memory or the database, or None."""
+    text = _memory_get(key)
+    if text is not None:
+        _count('memory_hits')
+        return text
+
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=_ttl())
+    entry = CachedLLMResponse.objects.filter(key=key, created_at__gte=cutoff).only('response', 'created_at').first()
+    if entry is None:
+        _count('misses')
+        return None
+    CachedLLMResponse.objects.filter(pk=entry.pk).update(last_used_at=now)
+    _memory_put(key, entry.response, entry.created_at + timedelta(seconds=_ttl()))
+    _count('db_hits')
+    return entry.response
+
+
+def evict():
+    """Delete expired responses, then the least recently used beyond AI_RESPONSE_CACHE_MAX_ENTRIES."""
+    CachedLLMResponse.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=_ttl())).delete()
+    stale = CachedLLMResponse.objects.order_by('-last_used_at').values_list('pk', flat=True)[
+        _setting('AI_RESPONSE_CACHE_MAX_ENTRIES', 5000):]
+    CachedLLMResponse.objects.filter(pk__in=list(stale)).delete()
+
+
+def store(key, model_name, text):
+    now = timezone.now()
+    _memory_put(key, text, now + timedelta(seconds=_ttl()))
+    updated = CachedLLMResponse.objects.filter(key=key).update(response=text, created_at=now, last_used_at=now)
+    if not updated:
+        CachedLLMResponse.objects.get_or_create(key=key, defaults={'model_name': model_name, 'response': text})
+        evict()
+
+
+def clear():
+    with _memory_lock:
+        _memory.clear()
+    CachedLLMResponse.objects.all().delete()
+
+
+def generate_cached_response(prompt, bypass=False, model_name=None, generation_config=None, client=None,
+                             telemetry=None, rate_limited=True):
+    """generate_llm_response behind the response cache (when AI_RESPONSE_CACHE is on).
+
+    With bypass the cache isn't read, but the fresh response replaces the cached
+    one. Calls that reach the LLM first pass the rate limits of `client` (see
+    ai.rate_limit.client_key) and the global ones, and may raise RateLimitExceeded;
+    the time spent waiting is recorded as queue time in the call's telemetry.
+    rate_limited=False skips them, for batches admitted as a whole.
+    Returns (text, served_from_cache).
+    """
+    if cache_enabled():
+        key = response_key(prompt, model_name, generation_config)
+        if bypass:
+            _count('bypassed')
+        else:
+            text = lookup(key)
+            if text is not None:
+                return text, True
+    started = time.monotonic()
+    if rate_limited:
+        admit(client, prompt)
+    text = generate_llm_response(prompt, model_name, generation_config,
+                                 telemetry=with_queue_time(telemetry, time.monotonic() - started))
+    if cache_enabled():
+        store(key, model_name or default_model_name(), text)
+    return text, False
+
+
+async def agenerate_cached_response(prompt, bypass=False, model_name=None, generation_config=None, client=None,
+                                    telemetry=None):
+    """Async version of generate_cached_response."""
+    if cache_enabled():
+        key = response_key(prompt, model_name, generation_config)
+        if bypass:
+            await sync_to_async(_count)('bypassed')
+        else:
+            text = await sync_to_async(lookup)(key)
+            if text is not None:
+                return text, True
+    started = time.monotonic()
+    await aadmit(client, prompt)
+    text = await agenerate_llm_response(prompt, model_name, generation_config,
+                                        telemetry=with_queue_time(telemetry, time.monotonic() - started))
+    if cache_enabled():
+        await sync_to_async(store)(key, model_name or default_model_name(), text)
+    return text, False
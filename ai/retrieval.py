@@ -0,0 +1,267 @@
+import hashlib
+import logging
+import math
+import re
+import threading
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max
+from core.models import Chapter, ResearchNote
+from .fragments import render_fragment
+from .models import TextChunk
+
+logger = logging.getLogger(__name__)
+
+# Terms are hashed into this many buckets (the "hashing trick"), so the index
+# needs no vocabulary and a bucket fits in a uint16.
+DIMENSIONS = 2 ** 16
+
+WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+STOP_WORDS = frozenset('''
+the and for are but not you all any can had her was one our out his has him how its may new now see two who
+did get let she too use that with have this will your from they been were said each which their them then
+there these some what when where would could should into than other about over only very just also more most
+such after before while through again once here both same own off down further because under until being
+'''.split())
+
+_executor = None
+_executor_lock = threading.Lock()
+# Loaded project indexes kept per process
+MAX_LOADED_PROJECTS = 32
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def retrieval_enabled():
+    return _setting('AI_RETRIEVAL', False)
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(text.lower()) if len(word) > 2 and word not in STOP_WORDS]
+
+
+def vectorize(text):
+    """Sparse hashed term vector of a text: (uint16 buckets, float16 1 + log(count) weights)."""
+    counts = Counter(zlib.crc32(word.encode()) % DIMENSIONS for word in tokenize(text))
+    buckets = sorted(counts)
+    return (np.array(buckets, dtype=np.uint16),
+            np.array([1 + math.log(counts[bucket]) for bucket in buckets], dtype=np.float16))
+
+
+def split_chunks(text, words=None):
+    """Split text into passages of about `words` words, keeping paragraphs together where they fit."""
+    words = words or _setting('AI_RETRIEVAL_CHUNK_WORDS', 200)
+    chunks, current = [], []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph_words = paragraph.split()
+        if current and len(current) + len(paragraph_words) > words:
+            chunks.append(' '.join(current))
+            current = []
+        while len(paragraph_words) > words:
+            chunks.append(' '.join(paragraph_words[:words]))
+            paragraph_words = paragraph_words[words:]
+        current.extend(paragraph_words)
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+# Indexed sources: section -> (model, text to index, label shown with a passage)
+SOURCES = {
+    'chapters': (Chapter, lambda chapter: chapter.content,
+                 lambda chapter: f'Chapter {chapter.chapter_number}: {chapter.title}'),
+    'research_notes': (ResearchNote, lambda note: '\n\n'.join(part for part in (note.tags, note.content) if part),
+                       lambda note: f'Research note: {note.title}'),
+    # Text extracted from a note's file (core.extraction), its chunks as paragraphs
+    'research_files': (ResearchNote, lambda note: '\n\n'.join(chunk.text for chunk in note.file_chunks.filter(position__gte=0)),
+                       lambda note: f'Research file: {note.title}'),
+}
+
+
+def index_source(source, obj):
+    """(Re)index one chapter, research note or research file; returns False if its text hasn't changed."""
+    text = SOURCES[source][1](obj)
+    source_hash = hashlib.sha256(text.encode()).hexdigest()[:16]
+    existing = TextChunk.objects.filter(source=source, source_id=obj.pk)
+    if existing.filter(source_hash=source_hash).exists() or (not text.strip() and not existing.exists()):
+        return False
+    chunks = []
+    for position, passage in enumerate(split_chunks(text)):
+        buckets, weights = vectorize(passage)
+        chunks.append(TextChunk(project_id=obj.project_id, source=source, source_id=obj.pk, position=position,
+                                text=passage, source_hash=source_hash,
+                                terms=buckets.tobytes(), weights=weights.tobytes()))
+    with transaction.atomic():
+        existing.delete()
+        TextChunk.objects.bulk_create(chunks)
+    return True
+
+
+def remove_source(source, source_id):
+    TextChunk.objects.filter(source=source, source_id=source_id).delete()
+
+
+def index_project(project, rebuild=False):
+    """Index every chapter, research note and research file of a project; returns how many sources changed."""
+    if rebuild:
+        TextChunk.objects.filter(project=project).delete()
+    changed = 0
+    for source, (model, _, _) in SOURCES.items():
+        objects = list(model.objects.filter(project=project))
+        TextChunk.objects.filter(project=project, source=source) \
+            .exclude(source_id__in=[obj.pk for obj in objects]).delete()
+        changed += sum(index_source(source, obj) for obj in objects)
+    return changed
+
+
+def _run_index(source, source_id):
+    close_old_connections()
+    try:
+        obj = SOURCES[source][0].objects.filter(pk=source_id).first()
+        if obj is not None:
+            index_source(source, obj)
+    except Exception:
+        logger.exception('Could not index %s %s', source, source_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_index_update(source, source_id):
+    """Re-index a saved chapter, research note or research file on a background thread, off the request path."""
+    global _executor
+    if not retrieval_enabled():
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ai-retrieval')
+    _executor.submit(_run_index, source, source_id)
+
+
+def _load_index(project_id):
+    """The project's chunks as flat arrays, reloaded only when its chunks changed.
+
+    Re-indexing replaces a source's rows, so the highest chunk id and the chunk
+    count together identify the index contents.
+    """
+    state = TextChunk.objects.filter(project_id=project_id).aggregate(last=Max('id'), count=Count('id'))
+    version = (state['last'], state['count'])
+    with _loaded_lock:
+        loaded = _loaded.get(project_id)
+    if loaded is not None and loaded['version'] == version:
+        return loaded
+
+    rows = list(TextChunk.objects.filter(project_id=project_id)
+                .values_list('source', 'source_id', 'position', 'terms', 'weights'))
+    terms = [np.frombuffer(bytes(row[3]), dtype=np.uint16) for row in rows]
+    weights = [np.frombuffer(bytes(row[4]), dtype=np.float16) for row in rows]
+    loaded = {
+        'version': version,
+        'chunks': [row[:3] for row in rows],
+        'terms': np.concatenate(terms or [np.zeros(0, dtype=np.uint16)]),
+        'weights': np.concatenate(weights or [np.zeros(0, dtype=np.float16)]).astype(np.float32),
+        # The chunk each term belongs to
+        'owners': np.repeat(np.arange(len(rows)), [len(t) for t in terms]),
+    }
+    with _loaded_lock:
+        _loaded.pop(project_id, None)
+        while len(_loaded) >= MAX_LOADED_PROJECTS:
+            _loaded.pop(next(iter(_loaded)))
+        _loaded[project_id] = loaded
+    return loaded
+
+
+def search(project_id, query, k=None, exclude=()):
+    """The k passages most similar to `query` by TF-IDF cosine, as (source, source_id, position, score).
+
+    `exclude` holds (source, source_id) pairs to leave out.
+    """
+    k = k or _setting('AI_RETRIEVAL_TOP_K', 8)
+    index = _load_index(project_id)
+    chunk_count = len(index['chunks'])
+    query_terms, query_weights = vectorize(query)
+    if not chunk_count or not len(query_terms):
+        return []
+
+    # Inverse document frequency of every bucket over the project's chunks
+    document_frequency = np.bincount(index['terms'], minlength=DIMENSIONS)
+    idf = np.log((1 + chunk_count) / (1 + document_frequency)) + 1
+    weights = index['weights'] * idf[index['terms']]
+    norms = np.sqrt(np.bincount(index['owners'], weights=weights ** 2, minlength=chunk_count))
+
+    query_vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    query_vector[query_terms] = query_weights.astype(np.float32) * idf[query_terms]
+    scores = np.bincount(index['owners'], weights=weights * query_vector[index['terms']], minlength=chunk_count)
+    scores /= np.maximum(norms, 1e-9) * np.linalg.norm(query_vector)
+
+    results = []
+    for position in np.argsort(-scores):
+        if scores[position] <= 0 or len(results) == k:
+            break
+        source, source_id, chunk_position = index['chunks'][position]
+        if (source, source_id) not in exclude:
+            results.append((source, source_id, chunk_position, float(scores[position])))
+    return results
+
+
+def retrieval_query(entity_type, entity):
+    """What to look for: a chapter's title, notes, point of view and linked names, or an entity's description."""
+    if entity_type != 'chapter':
+        return '\n'.join(filter(None, [getattr(entity, 'name', ''), getattr(entity, 'description', '')]))
+    parts = [entity.title, entity.notes]
+    if entity.point_of_view:
+        parts += [entity.point_of_view.name, entity.point_of_view.description]
+    for related in (entity.characters, entity.places, entity.organizations):
+        parts += [obj.name for obj in related.all()]
+    return '\n'.join(filter(None, parts))
+
+
+def apply_retrieval(project, fragments, entity_type, entity):
+    """Replace research note bodies and old chapter texts with the passages most relevant to an entity.
+
+    Research notes keep their title and tags. When writing a chapter, it and its
+    neighbours keep their full content; every other chapter loses its content
+    (summaries added by apply_chapter_summaries stay). The top
+    AI_RETRIEVAL_TOP_K passages go in a "relevant_passages" section.
+    """
+    kept = set()
+    if entity_type == 'chapter':
+        chapter_ids = list(project.chapters.values_list('pk', flat=True))
+        if entity.pk in chapter_ids:
+            current = chapter_ids.index(entity.pk)
+            kept = {('chapters', pk) for pk in chapter_ids[max(0, current - 1):current + 2]}
+
+    fragments = dict(fragments)
+    for section in SOURCES:
+        if section not in fragments:
+            continue
+        items = []
+        for pk, entry, text in fragments.get(section, []):
+            if (section, pk) not in kept and entry.get('content'):
+                entry = {key: value for key, value in entry.items() if key != 'content'}
+                text = render_fragment(entry)
+            items.append((pk, entry, text))
+        fragments[section] = items
+
+    hits = search(project.pk, retrieval_query(entity_type, entity), exclude=kept)
+    chunks = {(chunk.source, chunk.source_id, chunk.position): chunk.text for chunk in TextChunk.objects.filter(
+        project=project, source__in=SOURCES, source_id__in=[hit[1] for hit in hits])}
+    labels = {}
+    for source, (model, _, label_fn) in SOURCES.items():
+        ids = [hit[1] for hit in hits if hit[0] == source]
+        labels.update({(source, obj.pk): label_fn(obj) for obj in model.objects.filter(project=project, pk__in=ids).defer('content')})
+
+    passages = []
+    for source, source_id, position, _ in hits:
+        if (source, source_id, position) in chunks and (source, source_id) in labels:
+            entry = {'source': labels[(source, source_id)], 'text': chunks[(source, source_id, position)]}
+            passages.append((f'{source}:{source_id}:{position}', entry, render_fragment(entry)))
+    fragments['relevant_passages'] = passages
+    return fragments
@@ -0,0 +1,105 @@
+from collections import defaultdict, deque
+from django.conf import settings
+from core.models import Place, Organization, Chapter, PlotPoint, CharacterRelationship
+from .context_cache import cache_timeout, get_context_version
+from .fragments import get_cache, get_project_fragments
+
+# Context section of each entity type used by the improve endpoints
+ENTITY_SECTIONS = {
+    'character': 'characters',
+    'place': 'places',
+    'organization': 'organizations',
+    'chapter': 'chapters',
+    'plot_point': 'plot_points',
+}
+
+# (through model, section of the source end, section of the target end)
+M2M_EDGES = [
+    (Place.characters.through, 'places', 'characters'),
+    (Organization.characters.through, 'organizations', 'characters'),
+    (Organization.places.through, 'organizations', 'places'),
+    (Chapter.characters.through, 'chapters', 'characters'),
+    (Chapter.places.through, 'chapters', 'places'),
+    (Chapter.organizations.through, 'chapters', 'organizations'),
+    (PlotPoint.characters.through, 'plot_points', 'characters'),
+    (PlotPoint.places.through, 'plot_points', 'places'),
+    (PlotPoint.organizations.through, 'plot_points', 'organizations'),
+]
+
+# (model, section, foreign key to another entity, section of that entity)
+FK_EDGES = [
+    (Chapter, 'chapters', 'point_of_view_id', 'characters'),
+    (PlotPoint, 'plot_points', 'chapter_id', 'chapters'),
+]
+
+
+def default_scope_depth():
+    return getattr(settings, 'AI_CONTEXT_SCOPE_DEPTH', 2)
+
+
+def _build_project_graph(project):
+    graph = defaultdict(set)
+
+    def link(a, b):
+        graph[a].add(b)
+        graph[b].add(a)
+
+    for through, source_section, target_section in M2M_EDGES:
+        source, target = [f for f in through._meta.fields if f.is_relation]
+        rows = through.objects.filter(**{f'{source.name}__project': project}).values_list(source.attname, target.attname)
+        for source_pk, target_pk in rows:
+            link((source_section, source_pk), (target_section, target_pk))
+
+    for model, section, fk, target_section in FK_EDGES:
+        rows = model.objects.filter(project=project, **{f'{fk}__isnull': False}).values_list('pk', fk)
+        for pk, target_pk in rows:
+            link((section, pk), (target_section, target_pk))
+
+    rows = CharacterRelationship.objects.filter(from_character__project=project).values_list('from_character_id', 'to_character_id')
+    for from_pk, to_pk in rows:
+        link(('characters', from_pk), ('characters', to_pk))
+
+    return dict(graph)
+
+
+def get_project_graph(project):
+    """Adjacency sets between (section, pk) nodes, cached per project content version."""
+    cache = get_cache()
+    key = f'ai:graph:{project.pk}:{get_context_version(project.pk)}'
+    graph = cache.get(key)
+    if graph is None:
+        graph = _build_project_graph(project)
+        cache.set(key, graph, timeout=cache_timeout())
+    return graph
+
+
+def neighbourhood(project, section, pk, depth):
+    """Breadth-first distances from an entity to everything within `depth` links."""
+    graph = get_project_graph(project)
+    distances = {(section, pk): 0}
+    queue = deque([(section, pk)])
+    while queue:
+        node = queue.popleft()
+        if distances[node] >= depth:
+            continue
+        for neighbour in graph.get(node, ()):
+            if neighbour not in distances:
+                distances[neighbour] = distances[node] + 1
+                queue.append(neighbour)
+    return distances
+
+
+def get_scoped_fragments(project, section, pk, depth=None):
+    """Fragments of the entities within `depth` links of one entity, and their distances.
+
+    Research notes are not linked to anything and are left out.
+    """
+    if depth is None:
+        depth = default_scope_depth()
+    distances = neighbourhood(project, section, pk, depth)
+    fragments = {
+        name: [item for item in items if (name, item[0]) in distances]
+        for name, items in get_project_fragments(project).items()
+    }
+    return fragments, distances
+
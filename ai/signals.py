@@ -0,0 +1,133 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.utils import timezone
+from core.models import (Project, Character, CharacterRelationship, Place, Organization,
+                         Chapter, PlotPoint, ResearchNote)
+from .context_cache import bump_context_version
+from .retrieval import SOURCES as RETRIEVAL_SOURCES, remove_source, schedule_index_update
+from .summaries import schedule_summary_refresh
+
+PROJECT_MODELS = [Character, Place, Organization, Chapter, PlotPoint, ResearchNote]
+
+M2M_THROUGH_MODELS = [
+    Place.characters.through,
+    Organization.characters.through,
+    Organization.places.through,
+    Chapter.characters.through,
+    Chapter.places.through,
+    Chapter.organizations.through,
+    PlotPoint.characters.through,
+    PlotPoint.places.through,
+    PlotPoint.organizations.through,
+]
+
+# Context fragments of other entities that show an entity's name (or title), as
+# (model, lookup). Saving or deleting the entity marks those fragments stale.
+FRAGMENT_DEPENDENTS = {
+    Character: [
+        (Character, 'relationships_from__to_character'),
+        (Place, 'characters'),
+        (Organization, 'characters'),
+        (Chapter, 'characters'),
+        (Chapter, 'point_of_view'),
+        (PlotPoint, 'characters'),
+    ],
+    Place: [
+        (Organization, 'places'),
+        (Chapter, 'places'),
+        (PlotPoint, 'places'),
+    ],
+    Organization: [
+        (Chapter, 'organizations'),
+        (PlotPoint, 'organizations'),
+    ],
+    Chapter: [
+        (PlotPoint, 'chapter'),
+    ],
+}
+
+
+def _project_id_for(instance):
+    if isinstance(instance, Project):
+        return instance.pk
+    if isinstance(instance, CharacterRelationship):
+        # Avoid touching instance.from_character: during a cascade delete the
+        # character row may already be gone.
+        return Character.objects.filter(pk=instance.from_character_id).values_list('project_id', flat=True).first()
+    return instance.project_id
+
+
+def touch(model, **filters):
+    """Bump updated_at without sending signals, marking context fragments stale."""
+    model.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+def invalidate_project_context(sender, instance, **kwargs):
+    project_id = _project_id_for(instance)
+    if project_id is not None:
+        bump_context_version(project_id)
+
+
+def invalidate_dependent_fragments(sender, instance, **kwargs):
+    for model, lookup in FRAGMENT_DEPENDENTS.get(sender, []):
+        touch(model, **{lookup: instance.pk})
+
+
+def invalidate_relationship_fragment(sender, instance, **kwargs):
+    touch(Character, pk=instance.from_character_id)
+
+
+def _linked_pks(through, instance, model):
+    instance_field = next(f for f in through._meta.fields if f.related_model is type(instance))
+    model_field = next(f for f in through._meta.fields if f.related_model is model)
+    return list(through.objects.filter(**{instance_field.attname: instance.pk})
+                .values_list(model_field.attname, flat=True))
+
+
+def invalidate_project_context_m2m(sender, instance, action, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The links are gone by post_clear, so remember who is about to lose one
+        instance._ai_cleared_pks = _linked_pks(sender, instance, model)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_ai_cleared_pks', [])
+        touch(type(instance), pk=instance.pk)
+        if pk_set:
+            touch(model, pk__in=pk_set)
+        invalidate_project_context(sender, instance)
+
+
+def refresh_chapter_summaries(sender, instance, **kwargs):
+    transaction.on_commit(lambda: schedule_summary_refresh(instance.pk))
+
+
+def _retrieval_sources(sender):
+    return [source for source, (model, _, _) in RETRIEVAL_SOURCES.items() if model is sender]
+
+
+def update_retrieval_index(sender, instance, **kwargs):
+    for source in _retrieval_sources(sender):
+        transaction.on_commit(lambda source=source: schedule_index_update(source, instance.pk))
+
+
+def remove_from_retrieval_index(sender, instance, **kwargs):
+    for source in _retrieval_sources(sender):
+        remove_source(source, instance.pk)
+
+
+def connect_signals():
+    for model in [Project, CharacterRelationship, *PROJECT_MODELS]:
+        post_save.connect(invalidate_project_context, sender=model, dispatch_uid=f'ai_context_save_{model.__name__}')
+        post_delete.connect(invalidate_project_context, sender=model, dispatch_uid=f'ai_context_delete_{model.__name__}')
+    for model in FRAGMENT_DEPENDENTS:
+        post_save.connect(invalidate_dependent_fragments, sender=model, dispatch_uid=f'ai_fragment_save_{model.__name__}')
+        # Links to a deleted entity disappear without m2m_changed, so look them up first
+        pre_delete.connect(invalidate_dependent_fragments, sender=model, dispatch_uid=f'ai_fragment_delete_{model.__name__}')
+    post_save.connect(invalidate_relationship_fragment, sender=CharacterRelationship, dispatch_uid='ai_fragment_save_relationship')
+    post_delete.connect(invalidate_relationship_fragment, sender=CharacterRelationship, dispatch_uid='ai_fragment_delete_relationship')
+    post_save.connect(refresh_chapter_summaries, sender=Chapter, dispatch_uid='ai_chapter_summaries')
+    for model in (Chapter, ResearchNote):
+        post_save.connect(update_retrieval_index, sender=model, dispatch_uid=f'ai_retrieval_save_{model.__name__}')
+        post_delete.connect(remove_from_retrieval_index, sender=model, dispatch_uid=f'ai_retrieval_delete_{model.__name__}')
+    for through in M2M_THROUGH_MODELS:
+        m2m_changed.connect(invalidate_project_context_m2m, sender=through, dispatch_uid=f'ai_context_m2m_{through.__name__}')
@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from core.models import Chapter
+from .fragments import render_fragment
+from .llm_utils import generate_llm_response
+from .models import ChapterSummary, ActSummary
+from .prompts import CHAPTER_SUMMARY_PROMPT, ACT_SUMMARY_PROMPT
+from .rate_limit import admit
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def act_size():
+    return _setting('AI_ACT_SIZE', 5)
+
+
+def _short_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:10]
+
+
+def content_fingerprint(content):
+    return ' '.join(_short_hash(p.strip()) for p in content.split('\n\n') if p.strip())
+
+
+def content_change(old_fingerprint, content):
+    """Fraction (0 to 1) of paragraphs that differ between a fingerprint and new content."""
+    old = old_fingerprint.split()
+    new = content_fingerprint(content).split()
+    if not old and not new:
+        return 0.0
+    unchanged = len(set(old) & set(new))
+    return 1 - unchanged / max(len(old), len(new))
+
+
+def summary_source_hash(summaries):
+    return hashlib.sha256('\n\n'.join(summaries).encode()).hexdigest()
+
+
+def act_chapters(chapters, chapter):
+    """(act_number, chapters of that act) for a chapter, given the project's chapters in order."""
+    position = next(i for i, c in enumerate(chapters) if c.pk == chapter.pk)
+    act_number = position // act_size()
+    return act_number, chapters[act_number * act_size():(act_number + 1) * act_size()]
+
+
+def _store(model, lookup, values):
+    # Plain UPDATE-then-INSERT rather than update_or_create: its SELECT ... FOR
+    # UPDATE transaction fails straight away on a busy SQLite database.
+    if model.objects.filter(**lookup).update(**values, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **values)
+    except IntegrityError:
+        # Another worker created it first
+        model.objects.filter(**lookup).update(**values, updated_at=timezone.now())
+
+
+def refresh_chapter_summary(chapter, force=False):
+    """Regenerate a chapter's summary if its content changed beyond AI_SUMMARY_CHANGE_THRESHOLD.
+
+    Returns True when a new summary was written.
+    """
+    existing = ChapterSummary.objects.filter(chapter=chapter).first()
+    if not chapter.content.strip():
+        if existing:
+            existing.delete()
+        return False
+    if existing and not force:
+        if content_change(existing.content_fingerprint, chapter.content) < _setting('AI_SUMMARY_CHANGE_THRESHOLD', 0.2):
+            return False
+
+    prompt = CHAPTER_SUMMARY_PROMPT.format(
+        chapter_number=chapter.chapter_number,
+        chapter_title=chapter.title,
+        max_words=_setting('AI_CHAPTER_SUMMARY_WORDS', 200),
+        content=chapter.content,
+    )
+    # Background summaries count against the global rate limits only
+    started = time.monotonic()
+    admit(None, prompt)
+    summary = generate_llm_response(prompt, telemetry={
+        'project_id': chapter.project_id, 'entity_type': 'chapter_summary', 'queue_seconds': time.monotonic() - started})
+    _store(ChapterSummary, {'chapter': chapter}, {
+        'summary': summary.strip(),
+        'content_fingerprint': content_fingerprint(chapter.content),
+    })
+    return True
+
+
+def refresh_act_summary(chapter, force=False):
+    """Regenerate the summary of the act containing a chapter once its chapter summaries changed."""
+    chapters = list(chapter.project.chapters.select_related('summary'))
+    act_number, members = act_chapters(chapters, chapter)
+    summaries = [getattr(c, 'summary', None) for c in members]
+    if any(s is None for s in summaries):
+        return False
+    source_hash = summary_source_hash([s.summary for s in summaries])
+    existing = ActSummary.objects.filter(project=chapter.project, act_number=act_number).first()
+    if existing and existing.source_hash == source_hash and not force:
+        return False
+
+    chapter_summaries = '\n\n'.join(f'Chapter {c.chapter_number}: {c.title}\n{s.summary}' for c, s in zip(members, summaries))
+    prompt = ACT_SUMMARY_PROMPT.format(
+        first_chapter_number=members[0].chapter_number,
+        last_chapter_number=members[-1].chapter_number,
+        max_words=_setting('AI_ACT_SUMMARY_WORDS', 300),
+        chapter_summaries=chapter_summaries,
+    )
+    started = time.monotonic()
+    admit(None, prompt)
+    summary = generate_llm_response(prompt, telemetry={
+        'project_id': chapter.project_id, 'entity_type': 'act_summary', 'queue_seconds': time.monotonic() - started})
+    _store(ActSummary, {'project': chapter.project, 'act_number': act_number}, {
+        'first_chapter_number': members[0].chapter_number,
+        'last_chapter_number': members[-1].chapter_number,
+        'summary': summary.strip(),
+        'source_hash': source_hash,
+    })
+    return True
+
+
+def refresh_summaries(chapter_id, force=False):
+    chapter = Chapter.objects.select_related('project').filter(pk=chapter_id).first()
+    if chapter is None:
+        return
+    refresh_chapter_summary(chapter, force=force)
+    refresh_act_summary(chapter, force=force)
+
+
+def _run_refresh(chapter_id):
+    close_old_connections()
+    try:
+        refresh_summaries(chapter_id)
+    except Exception:
+        logger.exception('Could not refresh summaries for chapter %s', chapter_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_summary_refresh(chapter_id):
+    """Refresh a chapter's summaries on a background thread, off the request path."""
+    global _executor
+    if not _setting('AI_CHAPTER_SUMMARIES', False):
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_setting('AI_SUMMARY_WORKERS', 2), thread_name_prefix='ai-summary')
+    _executor.submit(_run_refresh, chapter_id)
+
+
+def apply_chapter_summaries(project, fragments, chapter):
+    """Swap chapter content for summaries everywhere except next to the chapter being written.
+
+    The chapter itself and its neighbours keep their full content. Other chapters
+    of its act use their chapter summary; chapters of other acts are replaced by
+    an up to date act summary (added as an "act_summaries" section) or, failing
+    that, their own summaries. Chapters without any summary keep their content.
+    """
+    chapter_ids = list(project.chapters.values_list('pk', flat=True))
+    if chapter.pk not in chapter_ids:
+        return fragments
+    position = {pk: index for index, pk in enumerate(chapter_ids)}
+    current = position[chapter.pk]
+    summaries = dict(ChapterSummary.objects.filter(chapter__project=project).values_list('chapter_id', 'summary'))
+
+    usable_acts = {}
+    for act in project.act_summaries.all():
+        if act.act_number == current // act_size():
+            continue
+        members = chapter_ids[act.act_number * act_size():(act.act_number + 1) * act_size()]
+        if members and all(pk in summaries for pk in members) \
+                and summary_source_hash([summaries[pk] for pk in members]) == act.source_hash:
+            usable_acts[act.act_number] = act
+
+    items = []
+    for pk, entry, text in fragments.get('chapters', []):
+        index = position.get(pk, current)
+        if abs(index - current) <= 1 or not entry.get('content'):
+            items.append((pk, entry, text))
+        elif index // act_size() in usable_acts:
+            entry = {key: value for key, value in entry.items() if key != 'content'}
+            items.append((pk, entry, render_fragment(entry)))
+        elif pk in summaries:
+            entry = {key: value for key, value in entry.items() if key != 'content'}
+            entry['summary'] = summaries[pk]
+            items.append((pk, entry, render_fragment(entry)))
+        else:
+            items.append((pk, entry, text))
+
+    fragments = dict(fragments)
+    fragments['chapters'] = items
+    if usable_acts:
+        acts = []
+        for act in usable_acts.values():
+            entry = {
+                'act': act.act_number + 1,
+                'chapters': f'{act.first_chapter_number}-{act.last_chapter_number}',
+                'summary': act.summary,
+            }
+            acts.append((act.pk, entry, render_fragment(entry)))
+        fragments['act_summaries'] = acts
+    return fragments
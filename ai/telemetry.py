@@ -0,0 +1,158 @@
+import logging
+import math
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Avg, Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import LLMCallRecord
+from .providers import CHARS_PER_TOKEN, default_model_name
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+PERCENTILES = [50, 90, 95, 99]
+TIMING_FIELDS = ['queue_ms', 'first_token_ms', 'latency_ms', 'prompt_bytes']
+
+# Provider-reported token counts where known, the estimates otherwise
+INPUT_TOKENS = Coalesce('input_tokens', 'estimated_input_tokens')
+OUTPUT_TOKENS = Coalesce('output_tokens', 'estimated_output_tokens')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def telemetry_enabled():
+    return _setting('AI_LLM_TELEMETRY', True)
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _ms(seconds):
+    return max(0, round(seconds * 1000))
+
+
+def with_queue_time(telemetry, seconds):
+    """A copy of a telemetry dict with `seconds` more time spent queued."""
+    telemetry = dict(telemetry or {})
+    telemetry['queue_seconds'] = telemetry.get('queue_seconds', 0) + seconds
+    return telemetry
+
+
+class LLMCall:
+    """Times one LLM call and saves it as an LLMCallRecord.
+
+    `telemetry` is an optional dict with the project_id and entity_type the
+    call is for, and the queue_seconds it waited before being made. Providers
+    fill `usage` with the token counts they report.
+    """
+
+    def __init__(self, prompt, model_name=None, streamed=False, telemetry=None):
+        telemetry = telemetry or {}
+        self.usage = {}
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.fields = {
+            'project_id': telemetry.get('project_id'),
+            'entity_type': telemetry.get('entity_type', ''),
+            'provider': _setting('AI_LLM_PROVIDER', 'gemini'),
+            'model_name': model_name or default_model_name(),
+            'streamed': streamed,
+            'prompt_bytes': len(prompt.encode()),
+            'estimated_input_tokens': estimate_tokens(prompt),
+            'queue_ms': _ms(telemetry.get('queue_seconds', 0)),
+        }
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def record(self, status, text=''):
+        """Save the call; telemetry failures are logged, never raised to the caller."""
+        if not telemetry_enabled():
+            return None
+        finished = time.monotonic()
+        if self.first_token_at is None and status == 'success':
+            # Not streamed: the first token arrives with the whole response
+            self.first_token_at = finished
+        try:
+            return LLMCallRecord.objects.create(
+                **self.fields,
+                status=status,
+                estimated_output_tokens=estimate_tokens(text),
+                input_tokens=self.usage.get('input_tokens'),
+                output_tokens=self.usage.get('output_tokens'),
+                cached_input_tokens=self.usage.get('cached_input_tokens'),
+                first_token_ms=_ms(self.first_token_at - self.started) if self.first_token_at else None,
+                latency_ms=_ms(finished - self.started),
+            )
+        except Exception:
+            logger.exception('Could not record LLM call telemetry')
+            return None
+
+
+def _percentiles(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {f'p{p}': values[max(0, math.ceil(len(values) * p / 100) - 1)] for p in PERCENTILES}
+
+
+def _totals(calls):
+    return calls.aggregate(
+        calls=Count('id'),
+        errors=Count('id', filter=Q(status='error')),
+        prompt_bytes=Coalesce(Sum('prompt_bytes'), 0),
+        input_tokens=Coalesce(Sum(INPUT_TOKENS), 0),
+        output_tokens=Coalesce(Sum(OUTPUT_TOKENS), 0),
+        cached_input_tokens=Coalesce(Sum('cached_input_tokens'), 0),
+        estimated_input_tokens=Coalesce(Sum('estimated_input_tokens'), 0),
+    )
+
+
+def _grouped(calls, fields, limit):
+    rows = calls.values(*fields).annotate(
+        calls=Count('id'),
+        errors=Count('id', filter=Q(status='error')),
+        input_tokens=Coalesce(Sum(INPUT_TOKENS), 0),
+        output_tokens=Coalesce(Sum(OUTPUT_TOKENS), 0),
+        avg_latency_ms=Avg('latency_ms'),
+    ).annotate(total_tokens=F('input_tokens') + F('output_tokens')).order_by('-total_tokens')[:limit]
+    return [{**row, 'avg_latency_ms': round(row['avg_latency_ms'] or 0)} for row in rows]
+
+
+def telemetry_summary(window='24h', project_id=None, limit=20):
+    """Totals, percentiles and per-project and per-model usage of the LLM calls in a window.
+
+    Percentiles are over the latest AI_LLM_TELEMETRY_SAMPLE calls of the window.
+    """
+    since = timezone.now() - WINDOWS[window]
+    calls = LLMCallRecord.objects.filter(created_at__gte=since)
+    if project_id is not None:
+        calls = calls.filter(project_id=project_id)
+    sample = list(calls.order_by('-created_at').values_list(*TIMING_FIELDS)[:_setting('AI_LLM_TELEMETRY_SAMPLE', 10000)])
+    return {
+        'window': window,
+        'since': since.isoformat(),
+        'totals': _totals(calls),
+        'percentiles': {field: _percentiles(row[i] for row in sample) for i, field in enumerate(TIMING_FIELDS)},
+        'projects': _grouped(calls, ['project_id', 'project__name'], limit),
+        'models': _grouped(calls, ['provider', 'model_name'], limit),
+        'entity_types': _grouped(calls, ['entity_type'], limit),
+    }
+
+
+def prune():
+    """Delete records older than AI_LLM_TELEMETRY_RETENTION_DAYS; returns how many."""
+    cutoff = timezone.now() - timedelta(days=_setting('AI_LLM_TELEMETRY_RETENTION_DAYS', 90))
+    deleted, _ = LLMCallRecord.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
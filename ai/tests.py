@@ -0,0 +1,576 @@
+import asyncio
+import json
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from core.models import Chapter, Character, CharacterRelationship, Place, PlotPoint, Project, ResearchNote
+from core.testing import make_project
+from . import prompt_cache, providers, rate_limit, resilience, response_cache, retrieval
+from .budget import apply_token_budget, build_budgeted_context, estimate_tokens
+from .bulk import run_bulk_generation
+from .checks import check_rate_limit_cache
+from .context_cache import get_cached_project_context, get_context_version
+from .context_formats import serialize_context
+from .context_utils import get_project_context
+from .fragments import assemble_project_context, build_context, get_cache, get_project_fragments
+from .jobs import claim_jobs, requeue_stale_jobs, run_job
+from .models import CachedLLMResponse, GenerationJob
+from .prompts import CONTEXT_END_MARKER
+from .rate_limit import RateLimitExceeded
+from .resilience import CircuitBreaker, CircuitOpenError
+from .scope import get_scoped_fragments
+
+
+class HalfOpenTrialTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker()
+        patcher = mock.patch.object(resilience, 'breaker', self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Opened long enough ago that the next call is the half-open trial
+        self.breaker.state = 'open'
+        self.breaker.opened_at = -10 ** 6
+
+    def test_abandoned_stream_releases_trial(self):
+        stream = resilience.stream_with_policy(lambda: iter(['a', 'b', 'c']))
+        self.assertEqual(next(stream), 'a')
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        stream.close()
+
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertEqual(list(resilience.stream_with_policy(lambda: iter(['a']))), ['a'])
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_cancelled_call_releases_trial(self):
+        async def cancelled():
+            task = asyncio.ensure_future(resilience.acall_with_policy(lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancelled())
+        self.assertEqual(resilience.call_with_policy(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+class BulkRateLimitTests(TestCase):
+    def setUp(self):
+        self.cache = rate_limit.get_cache()
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    @mock.patch('ai.response_cache.generate_llm_response', return_value='better')
+    def test_batch_larger_than_request_limit(self, generate):
+        # More prompts than the default 10 requests a minute per user
+        prompts = [(mock.Mock(pk=pk, name=f'Character {pk}'), f'Improve {pk}') for pk in range(13)]
+        results, report = run_bulk_generation(prompts, 'improved', client='user:1')
+        self.assertEqual(report['succeeded'], 13)
+        self.assertEqual(generate.call_count, 13)
+
+    def test_batch_is_charged_its_tokens(self):
+        prompts = ['x' * 40_000] * 5
+        rate_limit.admit_batch('user:1', prompts)
+        level, _ = self.cache.get('ai:ratelimit:user:1:tokens_per_minute')
+        self.assertAlmostEqual(level, 250_000 - 5 * rate_limit.estimate_request_tokens(prompts[0]), delta=100)
+
+    def test_batch_larger_than_token_limit_is_refused(self):
+        # 150 prompts of about 11k tokens each, far over 250k a minute
+        with self.assertRaises(rate_limit.RequestTooLarge):
+            rate_limit.admit_batch('user:1', ['x' * 40_000] * 150)
+        self.assertIsNone(self.cache.get('ai:ratelimit:user:1:requests_per_minute'))
+
+
+class RateLimitLockTests(TestCase):
+    def setUp(self):
+        self.cache = rate_limit.get_cache()
+        self.addCleanup(self.cache.delete, rate_limit.LOCK_KEY)
+
+    def test_stale_lock_is_broken(self):
+        self.cache.set(rate_limit.LOCK_KEY, 'dead worker', timeout=None)
+        with mock.patch.object(rate_limit, 'LOCK_TIMEOUT', 0.05):
+            rate_limit._lock(self.cache)
+        # The database cache keeps whole-second expiry times, so the new lock may already have lapsed
+        self.assertNotEqual(self.cache.get(rate_limit.LOCK_KEY), 'dead worker')
+
+    def test_buckets_are_shared_by_default(self):
+        self.assertFalse(rate_limit.process_local(self.cache))
+
+    @override_settings(AI_RATE_LIMIT_CACHE_ALIAS='ai_context')
+    def test_process_local_cache_is_reported(self):
+        self.assertEqual([warning.id for warning in check_rate_limit_cache(None)], ['ai.W001'])
+
+    def test_unlock_leaves_another_workers_lock(self):
+        token = rate_limit._lock(self.cache)
+        # Broken as stale and taken by another worker meanwhile
+        self.cache.set(rate_limit.LOCK_KEY, 'other worker')
+        rate_limit._unlock(self.cache, token)
+        self.assertEqual(self.cache.get(rate_limit.LOCK_KEY), 'other worker')
+
+
+class GenerationJobStatusTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='secret')
+        project = Project.objects.create(name='Novel', description='', user=self.owner)
+        job = GenerationJob.objects.create(project=project, entity_type='character', entity_id=1, prompt='Improve')
+        self.url = reverse('ai:generation_job', args=[job.pk])
+
+    def test_owner_sees_job(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['job']['state'], 'queued')
+
+    def test_other_users_get_404(self):
+        self.client.force_login(User.objects.create_user('other', password='secret'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_anonymous_is_sent_to_login(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class GenerationJobRetryTests(TestCase):
+    def setUp(self):
+        project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('owner'))
+        self.job = GenerationJob.objects.create(project=project, entity_type='character', entity_id=1, prompt='Improve')
+
+    def _run_rate_limited(self):
+        job, = claim_jobs(1)
+        error = RateLimitExceeded('Too many AI requests right now', 1)
+        with mock.patch('ai.jobs.generate_cached_response', side_effect=error):
+            self.assertFalse(run_job(job))
+        self.job.refresh_from_db()
+
+    def test_rate_limited_job_waits_before_retry(self):
+        self._run_rate_limited()
+        self.assertEqual(self.job.status, 'queued')
+        self.assertEqual(self.job.retries, 1)
+        self.assertGreater(self.job.not_before, timezone.now())
+        self.assertEqual(claim_jobs(1), [])
+
+        GenerationJob.objects.filter(pk=self.job.pk).update(not_before=timezone.now() - timedelta(seconds=1))
+        self._run_rate_limited()
+        # Backs off further with each retry
+        self.assertGreater(self.job.not_before, timezone.now() + timedelta(seconds=8))
+
+    @override_settings(AI_JOB_MAX_RETRIES=1)
+    def test_job_fails_when_out_of_retries(self):
+        self._run_rate_limited()
+        GenerationJob.objects.filter(pk=self.job.pk).update(not_before=None)
+        self._run_rate_limited()
+        self.assertEqual(self.job.status, 'failed')
+        self.assertIn('gave up after 2 attempts', self.job.error)
+
+    @override_settings(AI_JOB_MAX_RETRIES=1)
+    def test_timed_out_job_fails_when_out_of_retries(self):
+        long_ago = timezone.now() - timedelta(days=1)
+        GenerationJob.objects.filter(pk=self.job.pk).update(status='running', started_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        GenerationJob.objects.filter(pk=self.job.pk).update(status='running', started_at=long_ago)
+        requeue_stale_jobs()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'failed')
+
+    def test_worker_once_exits_with_only_waiting_jobs(self):
+        self._run_rate_limited()
+        with mock.patch('ai.jobs.generate_cached_response') as generate:
+            call_command('run_generation_worker', '--once', stdout=mock.Mock())
+        generate.assert_not_called()
+
+
+class ProjectContextQueryTests(TestCase):
+    """Building a project's context takes the same number of queries however many entities it has."""
+
+    def setUp(self):
+        user = User.objects.create_user('writer')
+        self.small = make_project(user, 3)
+        self.large = make_project(user, 10)
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+
+    def test_get_project_context(self):
+        for project in (self.small, self.large):
+            with self.assertNumQueries(17):
+                get_project_context(project)
+
+    def test_assemble_project_context(self):
+        for project in (self.small, self.large):
+            with self.assertNumQueries(23):
+                assemble_project_context(project)
+
+
+@override_settings(AI_LLM_PROVIDER='local')
+class ProjectOwnerViewTests(TestCase):
+    """Views that spend LLM calls on a project are only for its owner."""
+
+    def setUp(self):
+        project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('owner'))
+        self.project_id = project.pk
+        self.character_id = Character.objects.create(project=project, name='Ada', role='Lead').pk
+
+    def _post(self, url):
+        return self.client.post(url, {'prompt': 'Improve'}, content_type='application/json')
+
+    def _assert_owner_only(self, url):
+        self.assertEqual(self._post(url).status_code, 302)
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self._post(url).status_code, 404)
+
+    def test_stream(self):
+        self._assert_owner_only(reverse('ai:stream_character', args=[self.project_id, self.character_id]))
+
+    def test_submit_job(self):
+        self._assert_owner_only(reverse('ai:job_character', args=[self.project_id, self.character_id]))
+        self.assertFalse(GenerationJob.objects.exists())
+
+    @mock.patch('ai.response_cache.generate_llm_response')
+    def test_improve_all(self, generate):
+        self._assert_owner_only(reverse('ai:improve_all', args=['character', self.project_id]))
+        generate.assert_not_called()
+
+
+class ContextVersionTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+        self.project = make_project(User.objects.create_user('writer'), 2)
+
+    def _assert_bumps(self, change):
+        version = get_context_version(self.project.pk)
+        change()
+        self.assertNotEqual(get_context_version(self.project.pk), version)
+
+    def test_save_delete_and_links_bump_version(self):
+        character = self.project.characters.first()
+        place = self.project.places.first()
+        character.name = 'Ada'
+        self._assert_bumps(character.save)
+        self._assert_bumps(lambda: place.characters.add(self.project.characters.last()))
+        self._assert_bumps(place.characters.clear)
+        self._assert_bumps(self.project.plot_points.first().delete)
+
+    def test_cached_context_follows_edits(self):
+        # Warm the cache first
+        get_cached_project_context(self.project)
+        character = self.project.characters.first()
+        character.name = 'Ada'
+        character.save()
+        context, _ = get_cached_project_context(self.project)
+        self.assertIn('Ada', [item['name'] for item in context['project']['characters']])
+
+
+class ContextFragmentTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+        self.project = make_project(User.objects.create_user('writer'), 2)
+
+    def _place_names(self):
+        return [entry['name'] for _, entry, _ in get_project_fragments(self.project)['places']]
+
+    def test_stale_fragment_is_rebuilt(self):
+        self.assertEqual(self._place_names(), ['Place 0', 'Place 1'])
+        # Without signals updated_at stays put, so the cached fragment is still served
+        Place.objects.filter(name='Place 0').update(name='Harbour')
+        self.assertEqual(self._place_names(), ['Place 0', 'Place 1'])
+
+        Place.objects.filter(name='Harbour').update(updated_at=timezone.now())
+        self.assertEqual(self._place_names(), ['Harbour', 'Place 1'])
+
+    def test_renamed_character_rebuilds_fragments_showing_it(self):
+        get_project_fragments(self.project)
+        character = self.project.characters.get(name='Character 0')
+        character.name = 'Ada'
+        character.save()
+        place = next(entry for _, entry, _ in get_project_fragments(self.project)['places'] if entry['name'] == 'Place 0')
+        self.assertIn('Ada', place['characters'])
+
+
+class ScopeTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+        self.project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('writer'))
+        # Ada - Bo (relationship), Ada - Harbour (place), Bo - Chapter 1 (point of view), Chapter 1 - Plot point
+        self.ada = Character.objects.create(project=self.project, name='Ada', role='Lead')
+        bo = Character.objects.create(project=self.project, name='Bo', role='Friend')
+        CharacterRelationship.objects.create(from_character=self.ada, to_character=bo, description='Friends')
+        Place.objects.create(project=self.project, name='Harbour', type='Town').characters.add(self.ada)
+        chapter = Chapter.objects.create(project=self.project, title='Chapter 1', chapter_number=1, point_of_view=bo)
+        PlotPoint.objects.create(project=self.project, title='Plot point', order=1, chapter=chapter)
+
+    def _names(self, depth):
+        fragments, _ = get_scoped_fragments(self.project, 'characters', self.ada.pk, depth)
+        return sorted(entry.get('name') or entry['title'] for items in fragments.values() for _, entry, _ in items)
+
+    def test_depths(self):
+        self.assertEqual(self._names(0), ['Ada'])
+        self.assertEqual(self._names(1), ['Ada', 'Bo', 'Harbour'])
+        self.assertEqual(self._names(2), ['Ada', 'Bo', 'Chapter 1', 'Harbour'])
+        self.assertEqual(self._names(3), ['Ada', 'Bo', 'Chapter 1', 'Harbour', 'Plot point'])
+
+    def test_distances(self):
+        _, distances = get_scoped_fragments(self.project, 'characters', self.ada.pk, 3)
+        self.assertEqual(sorted(distances.values()), [0, 1, 1, 2, 3])
+
+
+class TokenBudgetTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+        self.project = make_project(User.objects.create_user('writer'), 6)
+        self.fragments = get_project_fragments(self.project)
+
+    def _entities(self, context_data):
+        return sum(len(items) for key, items in context_data['project'].items() if isinstance(items, list))
+
+    def _long_texts(self):
+        ResearchNote.objects.filter(project=self.project).update(content='note ' * 400, updated_at=timezone.now())
+        Chapter.objects.filter(project=self.project).update(content='word ' * 400, updated_at=timezone.now())
+        return get_project_fragments(self.project)
+
+    def test_tiers(self):
+        fragments = self._long_texts()
+        full = estimate_tokens(build_context(self.project, fragments)[1])
+        notes = sum(len(text) for _, _, text in fragments['research_notes']) // 4
+        chapters = sum(len(text) for _, _, text in fragments['chapters']) // 4
+
+        _, report = apply_token_budget(self.project, fragments, full + 100)
+        self.assertEqual(report['tiers_applied'], [])
+
+        _, report = apply_token_budget(self.project, fragments, full - 100)
+        self.assertEqual(report['tiers_applied'], ['strip_research_notes'])
+        self.assertEqual(report['research_notes_stripped'], 6)
+
+        _, report = apply_token_budget(self.project, fragments, full - notes - 100)
+        self.assertEqual(report['tiers_applied'], ['strip_research_notes', 'excerpt_chapters'])
+        self.assertEqual(report['chapters_excerpted'], 6)
+        self.assertTrue(report['fits'])
+
+        trimmed, report = apply_token_budget(self.project, fragments, full - notes - chapters,
+                                             distances={('characters', self.project.characters.first().pk): 0})
+        self.assertEqual(report['tiers_applied'], ['strip_research_notes', 'excerpt_chapters', 'trim_entities'])
+        self.assertTrue(report['fits'])
+        # Sections earlier in TRIM_ORDER go first; the focus entity is never dropped
+        self.assertEqual(report['entities_dropped'][0]['section'], 'research_notes')
+        self.assertIn(self.project.characters.first().pk, [pk for pk, _, _ in trimmed['characters']])
+
+    @override_settings(AI_LLM_PROVIDER='local')
+    def test_context_report(self):
+        self._long_texts()
+        character = self.project.characters.first()
+        url = reverse('ai:improve_character', args=[self.project.pk, character.pk])
+        report = self.client.get(url, {'budget': 2000}).json()['context_report']
+        self.assertEqual(report['budget'], 2000)
+        self.assertTrue(report['fits'])
+        self.assertLessEqual(report['estimated_tokens'], 2000)
+        self.assertGreater(report['estimated_tokens_before'], 2000)
+        self.assertEqual(report['tiers_applied'][:2], ['strip_research_notes', 'excerpt_chapters'])
+        self.assertEqual(set(report), {'budget', 'estimated_tokens_before', 'tiers_applied', 'research_notes_stripped',
+                                       'chapters_excerpted', 'entities_dropped', 'estimated_tokens', 'fits'})
+
+    def test_budget_is_measured_in_the_selected_format(self):
+        budget = estimate_tokens(build_context(self.project, self.fragments)[1]) // 2
+        json_data, _, json_report = build_budgeted_context(self.project, self.fragments, budget)
+        outline_data, outline, report = build_budgeted_context(self.project, self.fragments, budget,
+                                                               context_format='outline')
+        self.assertEqual(outline, serialize_context(outline_data['project'], 'outline'))
+        self.assertEqual(report['estimated_tokens'], estimate_tokens(outline))
+        self.assertTrue(report['fits'])
+        self.assertEqual(report['budget'], budget)
+        # The outline is smaller than JSON, so fewer entities are dropped to fit
+        self.assertGreater(self._entities(outline_data), self._entities(json_data))
+
+
+class ContextFormatTests(SimpleTestCase):
+    PROJECT = {
+        'name': 'Novel',
+        'description': '',
+        'characters': [{'name': 'Ada', 'role': 'Lead', 'traits': ['brave', 'kind'], 'notes': None}],
+        'places': [],
+    }
+
+    def test_json(self):
+        self.assertEqual(json.loads(serialize_context(self.PROJECT)), self.PROJECT)
+
+    def test_minified_json_drops_empty_values(self):
+        self.assertEqual(serialize_context(self.PROJECT, 'json-min'),
+                         '{"name":"Novel","characters":[{"name":"Ada","role":"Lead","traits":["brave","kind"]}]}')
+
+    def test_outline(self):
+        self.assertEqual(serialize_context(self.PROJECT, 'outline'),
+                         'name: Novel\ncharacters:\n- name: Ada\n  role: Lead\n  traits: brave; kind')
+
+    def test_abbreviated_json_lists_the_keys_used(self):
+        self.assertEqual(serialize_context(self.PROJECT, 'abbrev'),
+                         'Key legend: n=name, C=characters, r=role, tr=traits\n'
+                         '{"n":"Novel","C":[{"n":"Ada","r":"Lead","tr":["brave","kind"]}]}')
+
+
+class RetrievalTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('writer'))
+        self.lighthouse = ResearchNote.objects.create(project=self.project, title='Lighthouses',
+                                                      content='The lighthouse keeper trims the lamp wick at dusk.')
+        self.caravan = ResearchNote.objects.create(project=self.project, title='Caravans',
+                                                   content='A desert caravan rests at the oasis at noon.')
+        retrieval.index_project(self.project)
+
+    def test_most_similar_passage_first(self):
+        hits = retrieval.search(self.project.pk, 'Who keeps the lighthouse lamp?')
+        self.assertEqual([(source, source_id) for source, source_id, _, _ in hits],
+                         [('research_notes', self.lighthouse.pk)])
+        self.assertEqual(retrieval.search(self.project.pk, 'lighthouse',
+                                          exclude={('research_notes', self.lighthouse.pk)}), [])
+
+    @override_settings(AI_RETRIEVAL=True)
+    def test_index_follows_saves(self):
+        def index_now(source, source_id):
+            retrieval.index_source(source, retrieval.SOURCES[source][0].objects.get(pk=source_id))
+
+        self.assertEqual(retrieval.search(self.project.pk, 'oil'), [])
+        # Indexed right away instead of on the background thread
+        with mock.patch('ai.signals.schedule_index_update', side_effect=index_now):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.caravan.content = 'A caravan carries oil for the lighthouse lamp.'
+                self.caravan.save()
+        self.assertEqual([hit[1] for hit in retrieval.search(self.project.pk, 'oil')], [self.caravan.pk])
+
+        self.caravan.delete()
+        self.assertEqual([hit[1] for hit in retrieval.search(self.project.pk, 'lighthouse lamp')], [self.lighthouse.pk])
+
+
+class ApiKeyViewTests(SimpleTestCase):
+    @override_settings(AI_LLM_PROVIDER='local')
+    def test_provider_without_key(self):
+        with mock.patch.dict('os.environ', clear=True):
+            response = self.client.get(reverse('ai:test_api_key'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['key_length'], 0)
+
+    @override_settings(AI_LLM_PROVIDER='gemini')
+    def test_gemini_key(self):
+        with mock.patch.dict('os.environ', {'GOOGLE_API_KEY': 'secret'}):
+            response = self.client.get(reverse('ai:test_api_key'))
+        self.assertEqual(response.json()['key_length'], 6)
+
+
+@override_settings(AI_RESPONSE_CACHE=True)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+        self.addCleanup(response_cache.clear)
+        patcher = mock.patch('ai.response_cache.generate_llm_response', return_value='better')
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(response_cache.generate_cached_response('Improve', rate_limited=False), ('better', False))
+        self.assertEqual(response_cache.generate_cached_response('Improve', rate_limited=False), ('better', True))
+        # Another process: not in its memory, but in the database
+        response_cache._memory.clear()
+        self.assertEqual(response_cache.generate_cached_response('Improve', rate_limited=False), ('better', True))
+        self.assertEqual(response_cache.generate_cached_response('Improve', bypass=True, rate_limited=False),
+                         ('better', False))
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(response_cache.cache_stats(), {'memory_hits': 1, 'db_hits': 1, 'misses': 1, 'bypassed': 1})
+
+    def test_expired_response_is_a_miss(self):
+        response_cache.generate_cached_response('Improve', rate_limited=False)
+        response_cache._memory.clear()
+        CachedLLMResponse.objects.update(created_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(response_cache.generate_cached_response('Improve', rate_limited=False), ('better', False))
+        self.assertEqual(self.generate.call_count, 2)
+
+
+class ResponseKeyTests(SimpleTestCase):
+    def test_provider_is_part_of_the_key(self):
+        with override_settings(AI_LLM_PROVIDER='gemini'):
+            gemini = response_cache.response_key('Improve', 'gemini-2.0-flash')
+        with override_settings(AI_LLM_PROVIDER='local'):
+            local = response_cache.response_key('Improve', 'gemini-2.0-flash')
+        self.assertNotEqual(gemini, local)
+
+
+@override_settings(AI_PROVIDER_CONTEXT_CACHE=True, AI_PROVIDER_CONTEXT_CACHE_MIN_TOKENS=1, AI_LOCAL_LLM_LATENCY=0)
+class PromptCacheTests(SimpleTestCase):
+    PROMPT = f'The project context {CONTEXT_END_MARKER} Improve Ada'
+
+    def setUp(self):
+        get_cache().clear()
+        self.addCleanup(get_cache().clear)
+        self.provider = providers.LocalProvider()
+
+    def _generate(self):
+        usage = {}
+        return prompt_cache.generate(self.provider, self.PROMPT, usage=usage), usage
+
+    def test_prefix_cache_is_reused(self):
+        before = prompt_cache.prompt_cache_stats()
+        with mock.patch.object(self.provider, 'create_context_cache',
+                               wraps=self.provider.create_context_cache) as create:
+            first, _ = self._generate()
+            second, usage = self._generate()
+        stats = prompt_cache.prompt_cache_stats()
+
+        create.assert_called_once()
+        self.assertEqual(first, second)
+        self.assertEqual(second, self.provider.respond(self.PROMPT))
+        self.assertGreater(usage['cached_input_tokens'], 0)
+        self.assertEqual(stats['context_cache_reuses'] - before['context_cache_reuses'], 1)
+        self.assertEqual(stats['prefix_bytes_reused'] - before['prefix_bytes_reused'],
+                         len(prompt_cache.split_prompt(self.PROMPT)[0].encode()))
+
+    def test_lost_cache_falls_back_to_full_prompt(self):
+        self._generate()
+        self.provider._context_caches.clear()
+        with self.assertLogs('ai.prompt_cache', 'WARNING'):
+            text, usage = self._generate()
+        self.assertEqual(text, self.provider.respond(self.PROMPT))
+        self.assertEqual(usage['cached_input_tokens'], 0)
+        # Forgotten, so the next call creates a new cache
+        self._generate()
+        self.assertEqual(len(self.provider._context_caches), 1)
+
+
+class ProviderTests(SimpleTestCase):
+    def test_provider_must_implement_generate_and_context_cache(self):
+        class GenerateOnly(providers.LLMProvider):
+            def generate(self, prompt, model_name=None, generation_config=None, cached_context=None, usage=None):
+                return prompt
+
+        with self.assertRaises(TypeError):
+            GenerateOnly()
+
+    def test_cached_content_models_are_bounded(self):
+        manager = providers.GeminiClientManager()
+        manager._genai = mock.Mock()
+        with mock.patch.object(providers, 'MAX_CACHED_CONTENT_MODELS', 2):
+            first = manager.get_cached_model('cachedContents/1')
+            manager.get_cached_model('cachedContents/2')
+            # Used again, so the next one evicts cachedContents/2 instead
+            self.assertIs(manager.get_cached_model('cachedContents/1'), first)
+            manager.get_cached_model('cachedContents/3')
+        self.assertEqual([key[0] for key in manager._cached_content_models],
+                         ['cachedContents/1', 'cachedContents/3'])
+
+    def test_local_context_caches_are_bounded_and_expire(self):
+        provider = providers.LocalProvider()
+        with mock.patch.object(providers, 'MAX_CACHED_CONTENT_MODELS', 2):
+            first = provider.create_context_cache('first ', 'local', 3600)
+            provider.create_context_cache('second ', 'local', 3600)
+            provider.create_context_cache('third ', 'local', 3600)
+        self.assertEqual(len(provider._context_caches), 2)
+        with self.assertRaises(LookupError):
+            provider.generate('prompt', cached_context=first)
+
+        expired = provider.create_context_cache('fourth ', 'local', 0)
+        with self.assertRaises(LookupError):
+            provider.generate('prompt', cached_context=expired)
+        self.assertNotIn(expired, provider._context_caches)
@@ -1,14 +1,32 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 
 app_name = 'ai'
 
+# With AI_ASYNC_VIEWS (for ASGI deployments) the context and improve pages are
+# served by async views that await the LLM instead of blocking a worker thread.
+llm_views = async_views if getattr(settings, 'AI_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
     path('test-api-key/', views.test_api_key, name='test_api_key'),
-    path('project-context/<int:project_id>/', views.view_project_context_html, name='view_project_context_html'),
-    path('project-context-llm/<int:project_id>/', views.view_project_context_llm, name='view_project_context_llm'),
-    path('improve/character/<int:project_id>/<int:entity_id>/', views.improve_entity_description, {'entity_type': 'character'}, name='improve_character'),
-    path('improve/place/<int:project_id>/<int:entity_id>/', views.improve_entity_description, {'entity_type': 'place'}, name='improve_place'),
-    path('improve/organization/<int:project_id>/<int:entity_id>/', views.improve_entity_description, {'entity_type': 'organization'}, name='improve_organization'),
-    path('improve/chapter/<int:project_id>/<int:entity_id>/', views.improve_entity_description, {'entity_type': 'chapter'}, name='improve_chapter'),
+    path('project-context/<int:project_id>/', llm_views.view_project_context_html, name='view_project_context_html'),
+    path('project-context-llm/<int:project_id>/', llm_views.view_project_context_llm, name='view_project_context_llm'),
+    path('improve/character/<int:project_id>/<int:entity_id>/', llm_views.improve_entity_description, {'entity_type': 'character'}, name='improve_character'),
+    path('improve/place/<int:project_id>/<int:entity_id>/', llm_views.improve_entity_description, {'entity_type': 'place'}, name='improve_place'),
+    path('improve/organization/<int:project_id>/<int:entity_id>/', llm_views.improve_entity_description, {'entity_type': 'organization'}, name='improve_organization'),
+    path('improve/chapter/<int:project_id>/<int:entity_id>/', llm_views.improve_entity_description, {'entity_type': 'chapter'}, name='improve_chapter'),
+    path('improve/character/<int:project_id>/<int:entity_id>/stream/', views.stream_entity_description, {'entity_type': 'character'}, name='stream_character'),
+    path('improve/place/<int:project_id>/<int:entity_id>/stream/', views.stream_entity_description, {'entity_type': 'place'}, name='stream_place'),
+    path('improve/organization/<int:project_id>/<int:entity_id>/stream/', views.stream_entity_description, {'entity_type': 'organization'}, name='stream_organization'),
+    path('improve/chapter/<int:project_id>/<int:entity_id>/stream/', views.stream_entity_description, {'entity_type': 'chapter'}, name='stream_chapter'),
+    path('improve/character/<int:project_id>/<int:entity_id>/jobs/', views.submit_generation_job, {'entity_type': 'character'}, name='job_character'),
+    path('improve/place/<int:project_id>/<int:entity_id>/jobs/', views.submit_generation_job, {'entity_type': 'place'}, name='job_place'),
+    path('improve/organization/<int:project_id>/<int:entity_id>/jobs/', views.submit_generation_job, {'entity_type': 'organization'}, name='job_organization'),
+    path('improve/chapter/<int:project_id>/<int:entity_id>/jobs/', views.submit_generation_job, {'entity_type': 'chapter'}, name='job_chapter'),
+    path('improve-all/<str:entity_type>/<int:project_id>/', views.improve_all_entities, name='improve_all'),
+    path('jobs/<int:job_id>/', views.generation_job_status, name='generation_job'),
+    path('llm-health/', views.llm_health, name='llm_health'),
+    path('llm-telemetry/', views.llm_telemetry, name='llm_telemetry'),
+    path('llm-telemetry/page/', views.llm_telemetry_page, name='llm_telemetry_page'),
 ] 
\ No newline at end of file
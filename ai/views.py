@@ -1,12 +1,33 @@
 from django.shortcuts import get_object_or_404, render
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
 import os
-from django.http import JsonResponse
+import time
+from asgiref.sync import iscoroutinefunction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from core.models import Project, Character, PlotPoint, Place, Organization, Chapter, ResearchNote
-from .llm_utils import generate_llm_response
+from .llm_utils import stream_llm_response
+from .providers import get_provider
+from .rate_limit import RateLimitExceeded, RequestTooLarge, admit, client_key
+from .resilience import CircuitOpenError, resilience_stats
+from .prompt_cache import prompt_cache_stats
+from .response_cache import generate_cached_response
+from .retrieval import apply_retrieval, retrieval_enabled
+from .telemetry import WINDOWS, telemetry_summary
 from .prompts import (CHARACTER_BIO_PROMPT, PLACE_DESCRIPTION_PROMPT, 
                     ORG_DESCRIPTION_PROMPT, 
                     CHAPTER_CONTENT_PROMPT)
-from .context_utils import get_project_context
+from .context_cache import get_cached_project_context
+from .fragments import get_project_fragments, build_context
+from .scope import ENTITY_SECTIONS, default_scope_depth, neighbourhood, get_scoped_fragments
+from .budget import default_token_budget, build_budgeted_context
+from .summaries import apply_chapter_summaries
+from .context_formats import CONTEXT_FORMATS, DEFAULT_FORMAT, serialize_context
+from .jobs import jobs_enabled, enqueue_generation, job_payload
+from .models import GenerationJob
+from .bulk import default_bulk_concurrency, run_bulk_generation
 import json
 
 ENTITY_CONFIGURATIONS = {
@@ -53,26 +74,120 @@ def _get_entity_config_and_instance(entity_type, entity_id, project):
     
     return entity, prompt_template, prompt_args, response_key, None
 
+def _parse_int_param(request, name, default, minimum):
+    value = request.GET.get(name)
+    if value is None:
+        return default, None
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        message = f'{name.capitalize()} must be an integer of at least {minimum}'
+        return None, JsonResponse({'status': 'error', 'message': message}, status=400)
+    return number, None
+
+def _get_context_format(request):
+    context_format = request.GET.get('format', DEFAULT_FORMAT)
+    if context_format not in CONTEXT_FORMATS:
+        return None, JsonResponse({'status': 'error', 'message': f'Invalid context format: {context_format}'}, status=400)
+    return context_format, None
+
+def _get_llm_context(request, project, entity_type, entity):
+    """Build the prompt context selected by the ?scope=, ?depth=, ?budget= and ?format= query parameters.
+
+    Returns (llm_context, budget_report, error_response); budget_report is None
+    when no token budget applies.
+    """
+    context_format, error_response = _get_context_format(request)
+    if error_response:
+        return None, None, error_response
+    scope = request.GET.get('scope', 'full')
+    if scope not in ('full', 'neighbourhood'):
+        return None, None, JsonResponse({'status': 'error', 'message': f'Invalid context scope: {scope}'}, status=400)
+    depth, error_response = _parse_int_param(request, 'depth', default_scope_depth(), 0)
+    if error_response:
+        return None, None, error_response
+    budget, error_response = _parse_int_param(request, 'budget', default_token_budget(), 1)
+    if error_response:
+        return None, None, error_response
+
+    section = ENTITY_SECTIONS[entity_type]
+    use_summaries = entity_type == 'chapter' and getattr(settings, 'AI_CHAPTER_SUMMARIES', False)
+    if budget is None and not use_summaries and not retrieval_enabled() and scope == 'full':
+        _, llm_context = get_cached_project_context(project, context_format)
+        return llm_context, None, None
+
+    distances = None
+    if scope == 'full':
+        fragments = get_project_fragments(project)
+        if budget is not None:
+            distances = neighbourhood(project, section, entity.pk, float('inf'))
+    else:
+        fragments, distances = get_scoped_fragments(project, section, entity.pk, depth)
+    if use_summaries:
+        fragments = apply_chapter_summaries(project, fragments, entity)
+    if retrieval_enabled():
+        fragments = apply_retrieval(project, fragments, entity_type, entity)
+
+    if budget is not None:
+        _, llm_context, report = build_budgeted_context(project, fragments, budget, distances, context_format)
+        return llm_context, report, None
+    context_data, llm_context = build_context(project, fragments)
+    if context_format != DEFAULT_FORMAT:
+        llm_context = serialize_context(context_data['project'], context_format)
+    return llm_context, None, None
+
+def _missing_api_key_response():
+    api_key_env = get_provider().api_key_env
+    if api_key_env and not os.getenv(api_key_env):
+        return JsonResponse({'status': 'error', 'message': 'Google API key not found in environment variables'}, status=400)
+    return None
+
+def _enqueue_job_response(project, entity_type, entity, prompt, data):
+    job = enqueue_generation(project, entity_type, entity.pk, prompt, bypass_cache=bool(data.get('bypass_cache')))
+    return JsonResponse({
+        'status': 'queued',
+        'job_id': job.pk,
+        'job_url': reverse('ai:generation_job', args=[job.pk])
+    }, status=202)
+
+def _rate_limited_response(error):
+    if isinstance(error, RequestTooLarge):
+        return JsonResponse({'status': 'error', 'message': str(error)}, status=413)
+    response = JsonResponse({'status': 'error', 'message': str(error)}, status=429)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def _unavailable_response(error):
+    response = JsonResponse({'status': 'error', 'message': str(error)}, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
 def require_api_key(view_func):
+    if iscoroutinefunction(view_func):
+        async def async_wrapper(request, *args, **kwargs):
+            return _missing_api_key_response() or await view_func(request, *args, **kwargs)
+        return async_wrapper
+
     def wrapper(request, *args, **kwargs):
-        if not os.getenv('GOOGLE_API_KEY'):
-            return JsonResponse({'status': 'error', 'message': 'Google API key not found in environment variables'}, status=400)
-        return view_func(request, *args, **kwargs)
+        return _missing_api_key_response() or view_func(request, *args, **kwargs)
     return wrapper
 
 @require_api_key
 def test_api_key(request):
-    api_key = os.getenv('GOOGLE_API_KEY')
+    api_key_env = get_provider().api_key_env
+    api_key = os.getenv(api_key_env) if api_key_env else None
     return JsonResponse({
         'status': 'success',
-        'message': 'API key is accessible',
-        'key_length': len(api_key)
+        'message': 'API key is accessible' if api_key else 'The AI provider needs no API key',
+        'key_length': len(api_key) if api_key else 0
     })
 
 @require_api_key
 def view_project_context_html(request, project_id):
     project = get_object_or_404(Project, pk=project_id)
-    context_data, _ = get_project_context(project) # We only need raw_data for this view
+    context_data, _ = get_cached_project_context(project) # We only need raw_data for this view
     return render(request, 'ai/project_context_display.html', {
         'project_name': project.name, # Pass project name for the title or breadcrumbs
         'raw_data': context_data
@@ -81,16 +196,20 @@ def view_project_context_html(request, project_id):
 @require_api_key
 def view_project_context_llm(request, project_id):
     project = get_object_or_404(Project, pk=project_id)
-    _, llm_context = get_project_context(project) # We only need llm_context for this view
+    context_format, error_response = _get_context_format(request)
+    if error_response:
+        return error_response
+    _, llm_context = get_cached_project_context(project, context_format) # We only need llm_context for this view
     return render(request, 'ai/project_context_llm.html', {
         'project_name': project.name, # Pass project name for the title or breadcrumbs
-        'llm_context': llm_context
+        'llm_context': llm_context,
+        'context_format': context_format,
+        'context_format_label': CONTEXT_FORMATS[context_format][1],
     })
 
 @require_api_key
 def improve_entity_description(request, project_id, entity_type, entity_id):
     project = get_object_or_404(Project, pk=project_id)
-    _, llm_context = get_project_context(project)
 
     entity, prompt_template, prompt_args, response_key, error_response = \
         _get_entity_config_and_instance(entity_type, entity_id, project)
@@ -102,12 +221,18 @@ def improve_entity_description(request, project_id, entity_type, entity_id):
         return JsonResponse({'status': 'error', 'message': f'{entity_type.capitalize()} not found.'}, status=404)
 
     if request.method == 'GET':
+        llm_context, budget_report, error_response = _get_llm_context(request, project, entity_type, entity)
+        if error_response:
+            return error_response
         final_prompt_args = {**prompt_args, 'llm_context': llm_context}
         initial_prompt = prompt_template.format(**final_prompt_args)
-        return JsonResponse({
+        response_data = {
             'status': 'success',
             'prompt': initial_prompt
-        })
+        }
+        if budget_report:
+            response_data['context_report'] = budget_report
+        return JsonResponse(response_data)
 
     elif request.method == 'POST':
         try:
@@ -116,14 +241,24 @@ def improve_entity_description(request, project_id, entity_type, entity_id):
             if not user_provided_prompt:
                 return JsonResponse({'status': 'error', 'message': 'Prompt not provided in POST request'}, status=400)
 
-            improved_text = generate_llm_response(user_provided_prompt)
+            if jobs_enabled():
+                return _enqueue_job_response(project, entity_type, entity, user_provided_prompt, data)
+
+            improved_text, cached = generate_cached_response(user_provided_prompt, bypass=bool(data.get('bypass_cache')),
+                                                             client=client_key(request),
+                                                             telemetry={'project_id': project.pk, 'entity_type': entity_type})
             
             return JsonResponse({
                 'status': 'success',
-                response_key: improved_text
+                response_key: improved_text,
+                'cached': cached
             })
         except json.JSONDecodeError:
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON in request body'}, status=400)
+        except RateLimitExceeded as e:
+            return _rate_limited_response(e)
+        except CircuitOpenError as e:
+            return _unavailable_response(e)
         except Exception as e:
             return JsonResponse({
                 'status': 'error',
@@ -131,3 +266,161 @@ def improve_entity_description(request, project_id, entity_type, entity_id):
             }, status=500)
     
     return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+
+def _sse_event(data, event=None):
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'
+
+def _stream_events(prompt, entity_type, telemetry):
+    try:
+        for text in stream_llm_response(prompt, telemetry=telemetry):
+            yield _sse_event({'text': text})
+    except Exception as e:
+        yield _sse_event({'message': f'Error improving {entity_type} description: {str(e)}'}, event='error')
+        return
+    yield _sse_event({}, event='done')
+
+@login_required
+@require_api_key
+def stream_entity_description(request, project_id, entity_type, entity_id):
+    """Streaming variant of the improve POST: sends the generated text as Server-Sent Events."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    entity, _, _, _, error_response = _get_entity_config_and_instance(entity_type, entity_id, project)
+    if error_response:
+        return error_response
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON in request body'}, status=400)
+    prompt = data.get('prompt')
+    if not prompt:
+        return JsonResponse({'status': 'error', 'message': 'Prompt not provided in POST request'}, status=400)
+    started = time.monotonic()
+    try:
+        admit(client_key(request), prompt)
+    except RateLimitExceeded as e:
+        return _rate_limited_response(e)
+
+    telemetry = {'project_id': project.pk, 'entity_type': entity_type, 'queue_seconds': time.monotonic() - started}
+    response = StreamingHttpResponse(_stream_events(prompt, entity_type, telemetry), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_api_key
+def submit_generation_job(request, project_id, entity_type, entity_id):
+    """Queue a generation for the worker (manage.py run_generation_worker) and return its poll URL."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    entity, _, _, _, error_response = _get_entity_config_and_instance(entity_type, entity_id, project)
+    if error_response:
+        return error_response
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON in request body'}, status=400)
+    prompt = data.get('prompt')
+    if not prompt:
+        return JsonResponse({'status': 'error', 'message': 'Prompt not provided in POST request'}, status=400)
+    return _enqueue_job_response(project, entity_type, entity, prompt, data)
+
+@login_required
+def generation_job_status(request, job_id):
+    job = get_object_or_404(GenerationJob, pk=job_id, project__user=request.user)
+    response_key = ENTITY_CONFIGURATIONS[job.entity_type]['response_key']
+    return JsonResponse({'status': 'success', 'job': job_payload(job, response_key)})
+
+@login_required
+@require_api_key
+def improve_all_entities(request, project_id, entity_type):
+    """Improve every entity of a type (or the listed "ids") in one request, with concurrent LLM calls.
+
+    All prompts share one project context build. Results are proposals, reported
+    per entity; nothing is saved.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    config = ENTITY_CONFIGURATIONS.get(entity_type)
+    if not config:
+        return JsonResponse({'status': 'error', 'message': 'Invalid entity type'}, status=400)
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON in request body'}, status=400)
+    ids = data.get('ids')
+    if ids is not None and not (isinstance(ids, list) and all(isinstance(pk, int) for pk in ids)):
+        return JsonResponse({'status': 'error', 'message': 'ids must be a list of integers'}, status=400)
+    max_concurrency = data.get('max_concurrency', default_bulk_concurrency())
+    if not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return JsonResponse({'status': 'error', 'message': 'max_concurrency must be a positive integer'}, status=400)
+    max_concurrency = min(max_concurrency, default_bulk_concurrency())
+
+    entities = config['model'].objects.filter(project=project)
+    if entity_type == 'chapter':
+        entities = entities.select_related('point_of_view')
+    if ids is not None:
+        entities = entities.filter(pk__in=ids)
+    _, llm_context = get_cached_project_context(project)
+    prompts = [(entity, config['prompt_template'].format(**config['prompt_args_fn'](entity), llm_context=llm_context))
+               for entity in entities]
+
+    if jobs_enabled():
+        jobs = [enqueue_generation(project, entity_type, entity.pk, prompt, bypass_cache=bool(data.get('bypass_cache')))
+                for entity, prompt in prompts]
+        return JsonResponse({
+            'status': 'queued',
+            'jobs': [{'id': entity.pk, 'job_id': job.pk, 'job_url': reverse('ai:generation_job', args=[job.pk])}
+                     for (entity, _), job in zip(prompts, jobs)]
+        }, status=202)
+
+    try:
+        results, report = run_bulk_generation(prompts, config['response_key'], max_concurrency,
+                                              bypass_cache=bool(data.get('bypass_cache')), client=client_key(request),
+                                              telemetry={'project_id': project.pk, 'entity_type': entity_type})
+    except RateLimitExceeded as e:
+        return _rate_limited_response(e)
+    return JsonResponse({'status': 'success', 'results': results, 'report': report})
+
+@staff_member_required
+def llm_health(request):
+    """Retry, hedge and timeout counters, the circuit breaker state and context cache reuse of this process."""
+    return JsonResponse({'status': 'success', 'resilience': resilience_stats(), 'context_cache': prompt_cache_stats()})
+
+def _telemetry_params(request):
+    window = request.GET.get('window', '24h')
+    if window not in WINDOWS:
+        return None, None, JsonResponse({'status': 'error', 'message': f"window must be one of {', '.join(WINDOWS)}"}, status=400)
+    project_id = request.GET.get('project')
+    if project_id is not None and not project_id.isdigit():
+        return None, None, JsonResponse({'status': 'error', 'message': 'project must be a project id'}, status=400)
+    return window, project_id and int(project_id), None
+
+@staff_member_required
+def llm_telemetry(request):
+    """Latency percentiles and token usage per project and model, over ?window= (1h, 24h, 7d or 30d)."""
+    window, project_id, error_response = _telemetry_params(request)
+    if error_response:
+        return error_response
+    return JsonResponse({'status': 'success', 'telemetry': telemetry_summary(window, project_id)})
+
+@staff_member_required
+def llm_telemetry_page(request):
+    window, project_id, error_response = _telemetry_params(request)
+    if error_response:
+        return error_response
+    return render(request, 'ai/llm_telemetry.html', {
+        'telemetry': telemetry_summary(window, project_id),
+        'windows': list(WINDOWS),
+        'project_id': project_id,
+    })
@@ -1,5 +1,14 @@
 from django.contrib import admin
-from .models import Project, Character, CharacterRelationship, Place, Organization, Chapter, PlotPoint, ResearchNote
+from .models import Project, Character, CharacterRelationship, Place, Organization, Chapter, PlotPoint, ResearchNote, FileBlob
+from .search import fts_available, matching_ids
+
+class FullTextSearchMixin:
+    """Search through the full-text index where there is one, instead of icontains scans of every text field."""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not fts_available():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=matching_ids(self.model, search_term)), False
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
@@ -17,7 +26,7 @@ class ProjectAdmin(admin.ModelAdmin):
     )
 
 @admin.register(Character)
-class CharacterAdmin(admin.ModelAdmin):
+class CharacterAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'project', 'role', 'age', 'gender')
     list_filter = ('project', 'role', 'gender')
     search_fields = ('name', 'description', 'role')
@@ -33,21 +42,21 @@ class CharacterRelationshipAdmin(admin.ModelAdmin):
     description_short.short_description = 'Description'
 
 @admin.register(Place)
-class PlaceAdmin(admin.ModelAdmin):
+class PlaceAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'project', 'type')
     list_filter = ('project', 'type')
     search_fields = ('name', 'description', 'type')
     autocomplete_fields = ['project', 'characters']
 
 @admin.register(Organization)
-class OrganizationAdmin(admin.ModelAdmin):
+class OrganizationAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'project', 'type')
     list_filter = ('project', 'type')
     search_fields = ('name', 'description', 'type')
     autocomplete_fields = ['project', 'characters', 'places']
 
 @admin.register(Chapter)
-class ChapterAdmin(admin.ModelAdmin):
+class ChapterAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'project', 'chapter_number', 'point_of_view')
     list_filter = ('project', 'point_of_view')
     search_fields = ('title', 'notes', 'content')
@@ -66,18 +75,25 @@ class ChapterAdmin(admin.ModelAdmin):
     )
 
 @admin.register(PlotPoint)
-class PlotPointAdmin(admin.ModelAdmin):
+class PlotPointAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'project', 'chapter', 'order')
     list_filter = ('project', 'chapter')
     search_fields = ('title', 'description')
     autocomplete_fields = ['project', 'chapter', 'characters', 'places', 'organizations']
 
 @admin.register(ResearchNote)
-class ResearchNoteAdmin(admin.ModelAdmin):
+class ResearchNoteAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'project', 'created_at', 'updated_at')
     list_filter = ('project', 'tags')
     search_fields = ('title', 'content', 'tags')
     autocomplete_fields = ['project']
 
+@admin.register(FileBlob)
+class FileBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at')
+    list_filter = ('ref_count',)
+    search_fields = ('name', 'sha256')
+    readonly_fields = ('name', 'sha256', 'size', 'ref_count', 'created_at', 'updated_at')
+
 
 # Register your models here.
@@ -0,0 +1,243 @@
+import codecs
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from .models import ResearchNote, ResearchFileChunk
+
+logger = logging.getLogger(__name__)
+
+# Files are read in blocks of this size, so memory use doesn't grow with the file
+READ_SIZE = 64 * 1024
+# Chunks are written in batches of this many rows
+CHUNK_BATCH = 100
+# A "word" longer than this (e.g. a file without whitespace) is cut into pieces
+MAX_WORD_CHARS = 1000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class UnsupportedFile(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _blocks(file):
+    while True:
+        block = file.read(READ_SIZE)
+        if not block:
+            return
+        yield block
+
+
+def plain_text(file):
+    """Decode a UTF-8 file block by block; invalid bytes become U+FFFD."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for block in _blocks(file):
+        yield decoder.decode(block)
+    yield decoder.decode(b'', final=True)
+
+
+class _HTMLText(HTMLParser):
+    SKIPPED_TAGS = {'script', 'style', 'noscript', 'template'}
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                  'section', 'article', 'blockquote', 'pre', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n\n')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+    def drain(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+
+def html_text(file):
+    """The visible text of an HTML file, parsed incrementally as it is read."""
+    parser = _HTMLText()
+    for text in plain_text(file):
+        parser.feed(text)
+        yield parser.drain()
+    parser.close()
+    yield parser.drain()
+
+
+def pdf_text(file):
+    """The text of a PDF, one page at a time (needs the pypdf package)."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedFile('Extracting text from PDF files needs the pypdf package')
+    # A PDF's cross-reference table is at its end, so the reader seeks around the
+    # file and parses each page only when it is asked for.
+    for page in PdfReader(file).pages:
+        yield (page.extract_text() or '') + '\n\n'
+
+
+EXTRACTORS = {
+    '.txt': plain_text,
+    '.text': plain_text,
+    '.md': plain_text,
+    '.markdown': plain_text,
+    '.html': html_text,
+    '.htm': html_text,
+    '.pdf': pdf_text,
+}
+
+
+def chunk_text(pieces, words=None):
+    """Group streamed text into passages of about `words` words.
+
+    Only the passage being built is held in memory, whatever the size of the input.
+    """
+    words = words or _setting('RESEARCH_FILE_CHUNK_WORDS', 200)
+    current = []
+    partial = ''
+    for piece in pieces:
+        text = partial + piece
+        tokens = text.split()
+        # The piece may end in the middle of a word; keep that part for the next one
+        partial = tokens.pop() if tokens and not text[-1].isspace() else ''
+        if len(partial) > MAX_WORD_CHARS:
+            tokens.append(partial)
+            partial = ''
+        for token in tokens:
+            current.append(token)
+            if len(current) >= words:
+                yield ' '.join(current)
+                current = []
+    if partial:
+        current.append(partial)
+    if current:
+        yield ' '.join(current)
+
+
+def extract_note_file(note):
+    """Replace a note's file chunks with freshly extracted ones; returns how many were stored."""
+    extractor = EXTRACTORS.get(os.path.splitext(note.file.name)[1].lower())
+    if extractor is None:
+        raise UnsupportedFile(f'No text extraction for {note.file.name}')
+    # The new chunks are written in batches as they are extracted, staged at
+    # negative positions (-1 - position) next to the current ones, then swapped
+    # in by one short transaction; a failure leaves the current ones in place.
+    staged = ResearchFileChunk.objects.filter(note=note, position__lt=0)
+    # Left behind by an extraction that died
+    staged.delete()
+    count = 0
+    try:
+        batch = []
+        with note.file.open('rb') as file:
+            for position, text in enumerate(chunk_text(extractor(file))):
+                batch.append(ResearchFileChunk(note=note, position=-1 - position, data=zlib.compress(text.encode())))
+                if len(batch) >= CHUNK_BATCH:
+                    ResearchFileChunk.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+        ResearchFileChunk.objects.bulk_create(batch)
+        count += len(batch)
+    except BaseException:
+        staged.delete()
+        raise
+    with transaction.atomic():
+        ResearchFileChunk.objects.filter(note=note, position__gte=0).delete()
+        staged.update(position=-1 - F('position'))
+    return count
+
+
+def _finish(note, status, file_name):
+    # Saved with signals, so search and the AI context pick up the new text
+    with transaction.atomic():
+        current = ResearchNote.objects.select_for_update().filter(pk=note.pk).first()
+        if current is None:
+            return True
+        if (current.file.name or '') != file_name:
+            # Given another file meanwhile, which needs extracting instead
+            return False
+        current.file_text_status = status
+        current.file_text_source = file_name
+        current.save(update_fields=['file_text_status', 'file_text_source', 'updated_at'])
+    return True
+
+
+FINAL_STATUSES = {'', 'done', 'failed', 'unsupported'}
+
+
+def needs_extraction(note):
+    return (note.file.name or '') != note.file_text_source or note.file_text_status not in FINAL_STATUSES
+
+
+def process_note_file(note_id):
+    """Extract the current file of a note, recording the outcome in file_text_status.
+
+    Returns False if the note got another file while this one was extracted.
+    """
+    from .search import index_file_chunks
+    note = ResearchNote.objects.filter(pk=note_id).first()
+    if note is None or not needs_extraction(note):
+        return True
+    file_name = note.file.name or ''
+    status = ''
+    if file_name:
+        try:
+            extract_note_file(note)
+            status = 'done'
+        except UnsupportedFile as e:
+            logger.info('%s', e)
+            status = 'unsupported'
+        except Exception:
+            logger.exception('Could not extract text from %s', file_name)
+            status = 'failed'
+    if status != 'done':
+        ResearchFileChunk.objects.filter(note=note).delete()
+    index_file_chunks(note)
+    return _finish(note, status, file_name)
+
+
+def _run(note_id):
+    close_old_connections()
+    try:
+        while not process_note_file(note_id):
+            pass
+    except Exception:
+        logger.exception('Could not process the file of research note %s', note_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_extraction(note):
+    """Mark a note's file pending and extract it on a background thread, off the request path."""
+    global _executor
+    note.file_text_status = 'pending'
+    ResearchNote.objects.filter(pk=note.pk).update(file_text_status='pending')
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_setting('RESEARCH_FILE_WORKERS', 1),
+                                           thread_name_prefix='research-files')
+    _executor.submit(_run, note.pk)
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from core.extraction import needs_extraction, process_note_file
+from core.models import ResearchNote
+
+
+class Command(BaseCommand):
+    help = 'Extract the text of research note files that have not been processed yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Only process this project id')
+        parser.add_argument('--all', action='store_true', help='Extract every file again, processed or not')
+
+    def handle(self, *args, **options):
+        notes = ResearchNote.objects.exclude(file='').exclude(file__isnull=True).order_by('pk')
+        if options['project']:
+            notes = notes.filter(project_id=options['project'])
+        processed = 0
+        for note in notes.iterator():
+            if options['all']:
+                ResearchNote.objects.filter(pk=note.pk).update(file_text_status='pending')
+            elif not needs_extraction(note):
+                continue
+            start = time.perf_counter()
+            while not process_note_file(note.pk):
+                pass
+            note.refresh_from_db()
+            self.stdout.write(f'{note.title}: {note.file_text_status} ({note.file_chunks.filter(position__gte=0).count()} chunks, '
+                              f'{time.perf_counter() - start:.2f}s)')
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} files'))
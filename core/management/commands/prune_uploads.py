@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from core.uploads import prune_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that were never finished and attached (see RESEARCH_UPLOAD_EXPIRY_HOURS)'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Deleted {prune_uploads()} uploads'))
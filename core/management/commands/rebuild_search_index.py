@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of all project entities'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            self.stdout.write('No full-text index on this database; search uses icontains queries instead')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Indexed {rebuild_index()} entities'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from core.signals import BLOB_MODELS
+from core.storage import convert_legacy_files, prune_unreferenced, recount_references, storage_report
+
+
+class Command(BaseCommand):
+    help = 'Report on the content-addressed research file storage and the disk deduplication saves'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Move files stored before deduplication into blobs')
+        parser.add_argument('--recount', action='store_true', help='Recount the references to every blob')
+        parser.add_argument('--prune', action='store_true', help='Delete blobs nothing has referred to for an hour')
+
+    def handle(self, *args, **options):
+        if options['convert']:
+            converted, freed = convert_legacy_files(BLOB_MODELS)
+            self.stdout.write(f'Converted {converted} files, freeing {freed} bytes')
+        if options['recount']:
+            self.stdout.write(f'Corrected {recount_references(BLOB_MODELS)} reference counts')
+        if options['prune']:
+            self.stdout.write(f'Deleted {prune_unreferenced()} unreferenced blobs')
+        report = storage_report()
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['blobs']} blobs ({report['stored_bytes']} bytes) for {report['references']} files; "
+            f"deduplication saves {report['saved_bytes']} bytes. {report['unreferenced']} blobs are unreferenced."))
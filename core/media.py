@@ -0,0 +1,134 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _RangeFile:
+    """A file limited to `length` bytes from its current position.
+
+    It keeps the file's descriptor, so a WSGI server's file_wrapper can still
+    send the range with sendfile() (bounded by Content-Length).
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(name, size, modified):
+    # Content-addressed names are the SHA-256 of the file (see core.storage)
+    digest = os.path.splitext(os.path.basename(name))[0]
+    if SHA256_RE.match(digest):
+        return quote_etag(digest)
+    return quote_etag(f'{size:x}-{int(modified.timestamp()):x}')
+
+
+def parse_range(header, size):
+    """(start, end) of a single "bytes=" range, inclusive; None for a missing or multi-range header.
+
+    Raises ValueError for a range outside the file.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last `last` bytes
+        length = int(last)
+        if not length:
+            raise ValueError
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _offload_response(storage, name):
+    mode = _setting('RESEARCH_MEDIA_OFFLOAD', None)
+    if mode == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = _setting('RESEARCH_MEDIA_OFFLOAD_PREFIX', '/protected-media/') + quote(name)
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = storage.path(name)
+        return response
+    return None
+
+
+def serve_file(request, storage, name, download_name):
+    """Serve a stored file with conditional GET and single byte-range support.
+
+    With RESEARCH_MEDIA_OFFLOAD set, the front proxy is told to send the file
+    itself (and handles ranges); otherwise it is streamed by FileResponse.
+    """
+    size = storage.size(name)
+    modified = storage.get_modified_time(name)
+    last_modified = int(modified.timestamp())
+    etag = file_etag(name, size, modified)
+    content_type = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _offload_response(storage, name)
+    if response is None:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        file = storage.open(name, 'rb')
+        if byte_range is None or not _if_range_matches(request, etag, last_modified):
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, end = byte_range
+            file.seek(start)
+            response = FileResponse(_RangeFile(file, end - start + 1), status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Type'] = content_type
+    response['Content-Disposition'] = content_disposition_header(False, download_name)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # The file behind a URL can change, so revalidate with the ETag every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
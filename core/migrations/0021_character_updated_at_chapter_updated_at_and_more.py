@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_organization_internal_dynamics_alter_project_style'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='plotpoint',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='character',
+            name='traits',
+            field=models.TextField(blank=True, help_text='Enter character traits, separated by semicolons', null=True),
+        ),
+    ]
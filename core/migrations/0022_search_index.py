@@ -0,0 +1,64 @@
+from django.db import migrations, models
+
+TABLE = 'core_search_index'
+# Searched entity types as in core.search.SEARCH_MODELS at the time of this migration
+SEARCH_MODELS = {
+    'character': 'Character',
+    'place': 'Place',
+    'organization': 'Organization',
+    'plot_point': 'PlotPoint',
+    'chapter': 'Chapter',
+    'research_note': 'ResearchNote',
+}
+
+
+def fts_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def _row(obj, entity_type, fields):
+    body = '\n\n'.join(value for value in (getattr(obj, name) for name in fields) if value)
+    return [getattr(obj, 'name', None) or getattr(obj, 'title', ''), body, entity_type, obj.pk, obj.project_id]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if not fts_available(connection):
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+        "title, body, entity_type UNINDEXED, entity_id UNINDEXED, project_id UNINDEXED, "
+        "tokenize = 'porter unicode61 remove_diacritics 2')")
+    db_alias = connection.alias
+    with connection.cursor() as cursor:
+        for entity_type, model_name in SEARCH_MODELS.items():
+            model = apps.get_model('core', model_name)
+            fields = [field.name for field in model._meta.fields
+                      if isinstance(field, (models.CharField, models.TextField)) and field.editable and not field.choices]
+            rows = [_row(obj, entity_type, fields) for obj in model.objects.using(db_alias).iterator()]
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (title, body, entity_type, entity_id, project_id) VALUES (%s, %s, %s, %s, %s)', rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_character_updated_at_chapter_updated_at_and_more'),
+    ]
+
+    # An SQLite FTS5 table over the text of every project entity (see core.search).
+    # Other databases, or SQLite built without FTS5, don't get one and search
+    # falls back to icontains queries. The DDL and the initial fill are written
+    # out here so the migration doesn't depend on the current models or code.
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
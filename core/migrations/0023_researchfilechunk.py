@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='researchnote',
+            name='file_text_source',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='researchnote',
+            name='file_text_status',
+            field=models.CharField(blank=True, choices=[('', 'No file'), ('pending', 'Pending'), ('done', 'Extracted'), ('failed', 'Failed'), ('unsupported', 'Unsupported file type')], editable=False, max_length=12),
+        ),
+        migrations.CreateModel(
+            name='ResearchFileChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_chunks', to='core.researchnote')),
+            ],
+            options={
+                'ordering': ['note', 'position'],
+                'unique_together': {('note', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:35
+
+import os
+import core.storage
+from django.db import migrations, models
+
+
+def set_original_filenames(apps, schema_editor):
+    ResearchNote = apps.get_model('core', 'ResearchNote')
+    for note in ResearchNote.objects.exclude(file='').exclude(file__isnull=True).only('file'):
+        ResearchNote.objects.filter(pk=note.pk).update(original_filename=os.path.basename(note.file.name)[:255])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='researchnote',
+            name='original_filename',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='researchnote',
+            name='file',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=core.storage.research_file_storage, upload_to='research_notes/'),
+        ),
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='file',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=core.storage.research_file_storage, upload_to='research_notes/'),
+        ),
+        # Existing files stay where they are; `manage.py research_blobs --convert` moves them into blobs
+        migrations.RunPython(set_original_filenames, migrations.RunPython.noop),
+    ]
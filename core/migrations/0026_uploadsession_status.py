@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+def mark_completed_uploads(apps, schema_editor):
+    UploadSession = apps.get_model('core', 'UploadSession')
+    UploadSession.objects.filter(completed_at__isnull=False).update(status='completed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_fileblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('receiving', 'Receiving chunks'), ('finishing', 'Joining chunks'), ('completed', 'Completed')], default='receiving', max_length=10),
+        ),
+        migrations.RunPython(mark_completed_uploads, migrations.RunPython.noop),
+    ]
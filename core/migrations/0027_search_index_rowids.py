@@ -0,0 +1,50 @@
+from django.db import migrations
+
+TABLE = 'core_search_index'
+# Rowid layout as in core.search at the time of this migration
+ROWID_TYPES = 8
+ENTITY_TYPE_CODES = {
+    'character': 0,
+    'place': 1,
+    'organization': 2,
+    'plot_point': 3,
+    'chapter': 4,
+    'research_note': 5,
+}
+FILE_ENTITY_TYPE = 'research_file'
+FILE_ROWID_SPAN = 2 ** 24
+
+
+def renumber_rows(apps, schema_editor):
+    connection = schema_editor.connection
+    if TABLE not in connection.introspection.table_names():
+        return
+    codes = ' '.join(f"WHEN '{entity_type}' THEN {code}" for entity_type, code in ENTITY_TYPE_CODES.items())
+    with connection.cursor() as cursor:
+        # Copied out first, as the new rowids can clash with the old ones. A file's
+        # chunks were inserted in order, so their old rowids give their positions.
+        cursor.execute(
+            f"CREATE TEMP TABLE {TABLE}_rows AS SELECT "
+            f"CASE WHEN entity_type = '{FILE_ENTITY_TYPE}' "
+            f"THEN -(entity_id + 1) * {FILE_ROWID_SPAN} "
+            f"+ ROW_NUMBER() OVER (PARTITION BY entity_type, entity_id ORDER BY rowid) - 1 "
+            f"ELSE entity_id * {ROWID_TYPES} + CASE entity_type {codes} END END AS new_rowid, "
+            f"title, body, entity_type, entity_id, project_id FROM {TABLE}")
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, title, body, entity_type, entity_id, project_id) '
+            f'SELECT new_rowid, title, body, entity_type, entity_id, project_id FROM {TABLE}_rows')
+        cursor.execute(f'DROP TABLE {TABLE}_rows')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_uploadsession_status'),
+    ]
+
+    # Gives existing index rows the rowids core.search now replaces and deletes
+    # them by. Going back keeps them; the earlier code doesn't mind.
+    operations = [
+        migrations.RunPython(renumber_rows, migrations.RunPython.noop),
+    ]
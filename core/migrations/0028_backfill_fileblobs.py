@@ -0,0 +1,47 @@
+import hashlib
+from collections import Counter
+from django.db import migrations
+
+# Models whose `file` is in the content-addressed storage, as in core.signals.BLOB_MODELS at the time
+BLOB_MODELS = ['ResearchNote', 'UploadSession']
+
+
+def create_blobs(apps, schema_editor):
+    """A FileBlob, with its reference count, for each stored file that has none.
+
+    Files saved before content-addressed storage (and any whose blob is
+    missing) were never counted, so releasing a reference could not tell
+    when they were unused. They keep their names; `manage.py research_blobs
+    --convert` still moves them into content-addressed blobs.
+    """
+    db_alias = schema_editor.connection.alias
+    FileBlob = apps.get_model('core', 'FileBlob')
+    counts = Counter()
+    storage = None
+    for model_name in BLOB_MODELS:
+        model = apps.get_model('core', model_name)
+        storage = model._meta.get_field('file').storage
+        counts.update(model.objects.using(db_alias).exclude(file='').exclude(file__isnull=True)
+                      .values_list('file', flat=True))
+    known = set(FileBlob.objects.using(db_alias).filter(name__in=list(counts)).values_list('name', flat=True))
+    for name, references in counts.items():
+        if name in known or not storage.exists(name):
+            continue
+        digest = hashlib.sha256()
+        size = 0
+        with storage.open(name, 'rb') as file:
+            for chunk in file.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+        FileBlob.objects.using(db_alias).create(name=name, sha256=digest.hexdigest(), size=size, ref_count=references)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_search_index_rowids'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_blobs, migrations.RunPython.noop),
+    ]
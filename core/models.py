@@ -1,5 +1,8 @@
+import os
+import zlib
 from django.db import models
 from django.contrib.auth.models import User
+from .storage import research_file_storage
 
 class Project(models.Model):
     name = models.CharField(max_length=200)
@@ -35,6 +38,7 @@ class Character(models.Model):
     external_conflict = models.TextField(blank=True, null=True, help_text="Describe external conflicts, separated by semicolons")
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='characters')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} ({self.role})"
@@ -66,6 +70,7 @@ class Place(models.Model):
     characters = models.ManyToManyField(Character, related_name='places', blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='places')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} ({self.type})"
@@ -86,6 +91,7 @@ class Organization(models.Model):
     places = models.ManyToManyField(Place, related_name='organizations', blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='organizations')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -104,6 +110,7 @@ class Chapter(models.Model):
     organizations = models.ManyToManyField(Organization, related_name='chapters', blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='chapters')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Chapter {self.chapter_number}: {self.title}"
@@ -125,6 +132,7 @@ class PlotPoint(models.Model):
     chapter = models.ForeignKey(Chapter, on_delete=models.SET_NULL, related_name='plot_points', null=True, blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='plot_points')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.order}. {self.title}"
@@ -136,7 +144,20 @@ class ResearchNote(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     tags = models.CharField(max_length=500, blank=True, help_text="Enter tags separated by commas")
-    file = models.FileField(upload_to='research_notes/', blank=True, null=True)
+    FILE_TEXT_STATUS_CHOICES = [
+        ('', 'No file'),
+        ('pending', 'Pending'),
+        ('done', 'Extracted'),
+        ('failed', 'Failed'),
+        ('unsupported', 'Unsupported file type'),
+    ]
+
+    # Stored once per distinct content, under a name derived from it (see core.storage)
+    file = models.FileField(upload_to='research_notes/', storage=research_file_storage, max_length=255, blank=True, null=True)
+    original_filename = models.CharField(max_length=255, blank=True, editable=False)
+    # Text extraction of the file into ResearchFileChunks (see core.extraction)
+    file_text_status = models.CharField(max_length=12, choices=FILE_TEXT_STATUS_CHOICES, blank=True, editable=False)
+    file_text_source = models.CharField(max_length=255, blank=True, editable=False)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='research_notes')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -144,5 +165,94 @@ class ResearchNote(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            # The storage renames the file after its content; keep the name it was uploaded with
+            self.original_filename = os.path.basename(self.file.name)[:255]
+        elif not self.file:
+            self.original_filename = ''
+        super().save(*args, **kwargs)
+
+    @property
+    def file_display_name(self):
+        return self.original_filename or (os.path.basename(self.file.name) if self.file else '')
+
     class Meta:
         ordering = ['-updated_at']
+
+class ResearchFileChunk(models.Model):
+    """A passage of text extracted from a research note's file, zlib-compressed."""
+    note = models.ForeignKey(ResearchNote, on_delete=models.CASCADE, related_name='file_chunks')
+    # Negative while a new extraction is being written (see core.extraction)
+    position = models.IntegerField()
+    data = models.BinaryField()
+
+    @property
+    def text(self):
+        return zlib.decompress(self.data).decode()
+
+    def __str__(self):
+        return f"Chunk {self.position} of {self.note}"
+
+    class Meta:
+        ordering = ['note', 'position']
+        unique_together = ['note', 'position']
+
+class UploadSession(models.Model):
+    """A resumable upload of a research note file, sent in chunks (see core.uploads)."""
+    STATUS_CHOICES = [
+        ('receiving', 'Receiving chunks'),
+        ('finishing', 'Joining chunks'),
+        ('completed', 'Completed'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='upload_sessions')
+    # Set when the upload is for an existing note, which gets the file once it is complete
+    note = models.ForeignKey(ResearchNote, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    # Optional SHA-256 (hex) of the whole file, checked when the upload is finished
+    checksum = models.CharField(max_length=64, blank=True)
+    # The assembled file, until it is attached to a note
+    file = models.FileField(upload_to='research_notes/', storage=research_file_storage, max_length=255, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='receiving')
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.file_name}"
+
+    class Meta:
+        ordering = ['-created_at']
+
+class UploadPart(models.Model):
+    """A received chunk of an upload, stored on its own until the upload is finished."""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='parts')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    # SHA-256 (hex) of the chunk as received, checked again when the parts are joined
+    checksum = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f"Part {self.index} of {self.session}"
+
+    class Meta:
+        ordering = ['session', 'index']
+        unique_together = ['session', 'index']
+
+class FileBlob(models.Model):
+    """A file stored by content in core.storage, with how many model fields refer to it."""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['name']
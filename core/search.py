@@ -0,0 +1,245 @@
+import re
+from django.db import connection, models
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import escape
+from .models import Character, Place, Organization, PlotPoint, Chapter, ResearchNote
+
+TABLE = 'core_search_index'
+
+# Searched entity types: type -> (model, edit view). Every CharField and TextField
+# of the model is indexed; its name or title field is the result title.
+SEARCH_MODELS = {
+    'character': (Character, 'character_edit'),
+    'place': (Place, 'place_edit'),
+    'organization': (Organization, 'organization_edit'),
+    'plot_point': (PlotPoint, 'plotpoint_edit'),
+    'chapter': (Chapter, 'chapter_edit'),
+    'research_note': (ResearchNote, 'researchnote_edit'),
+}
+# Text extracted from a research note's file (see core.extraction), one row per chunk
+FILE_ENTITY_TYPE = 'research_file'
+RESULT_TYPES = {
+    **{entity_type: (model._meta.verbose_name.capitalize(), url_name)
+       for entity_type, (model, url_name) in SEARCH_MODELS.items()},
+    FILE_ENTITY_TYPE: ('Research file', 'researchnote_edit'),
+}
+
+# Rows have rowids derived from what they index, so they are replaced and deleted
+# by rowid instead of scanning the UNINDEXED columns. An entity's is
+# entity_id * ROWID_TYPES + its type's code; new types go at the end so existing
+# codes keep their meaning. A research file's chunks take the negative range of
+# FILE_ROWID_SPAN rowids for the note, one per chunk position (see migration 0027).
+ROWID_TYPES = 8
+ENTITY_TYPE_CODES = {entity_type: code for code, entity_type in enumerate(SEARCH_MODELS)}
+FILE_ROWID_SPAN = 2 ** 24
+
+# Highlight markers, swapped for <mark> tags once the snippet is HTML-escaped
+MARK_START = '\x02'
+MARK_END = '\x03'
+SNIPPET_TOKENS = 16
+FALLBACK_SNIPPET_CHARS = 160
+
+WORD_RE = re.compile(r'\w+')
+
+
+def text_fields(model):
+    return [field.name for field in model._meta.fields
+            if isinstance(field, (models.CharField, models.TextField)) and field.editable and not field.choices]
+
+
+def entity_type_for(model):
+    return next((entity_type for entity_type, (search_model, _) in SEARCH_MODELS.items()
+                 if search_model._meta.label == model._meta.label), None)
+
+
+def _title(obj):
+    return getattr(obj, 'name', None) or getattr(obj, 'title', '')
+
+
+def _body(obj):
+    return '\n\n'.join(value for value in (getattr(obj, name) for name in text_fields(type(obj))) if value)
+
+
+def entity_rowid(entity_type, entity_id):
+    return entity_id * ROWID_TYPES + ENTITY_TYPE_CODES[entity_type]
+
+
+def file_rowids(note_id):
+    """The first and last rowid of a research note's file chunks."""
+    first = -(note_id + 1) * FILE_ROWID_SPAN
+    return first, first + FILE_ROWID_SPAN - 1
+
+
+def _row(obj, entity_type):
+    return [entity_rowid(entity_type, obj.pk), _title(obj), _body(obj), entity_type, obj.pk, obj.project_id]
+
+
+INSERT = f'INSERT INTO {TABLE} (rowid, title, body, entity_type, entity_id, project_id) VALUES (%s, %s, %s, %s, %s, %s)'
+
+
+_available = None
+
+
+def fts_available():
+    """Whether the FTS5 index exists (SQLite with FTS5; see migration 0022). Checked once per process."""
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and TABLE in connection.introspection.table_names()
+    return _available
+
+
+def index_entity(obj):
+    entity_type = entity_type_for(type(obj))
+    if entity_type is None or not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [entity_rowid(entity_type, obj.pk)])
+        cursor.execute(INSERT, _row(obj, entity_type))
+
+
+def remove_entity(obj):
+    entity_type = entity_type_for(type(obj))
+    if entity_type is None or not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [entity_rowid(entity_type, obj.pk)])
+        if entity_type == 'research_note':
+            cursor.execute(f'DELETE FROM {TABLE} WHERE rowid BETWEEN %s AND %s', file_rowids(obj.pk))
+
+
+def _insert_file_chunks(cursor, note):
+    first, last = file_rowids(note.pk)
+    rows = []
+    # Chunks past the note's rowid range (billions of words) are left out of the index
+    for chunk in note.file_chunks.filter(position__gte=0, position__lte=last - first).iterator():
+        rows.append([first + chunk.position, note.title, chunk.text, FILE_ENTITY_TYPE, note.pk, note.project_id])
+        if len(rows) >= 100:
+            cursor.executemany(INSERT, rows)
+            rows = []
+    cursor.executemany(INSERT, rows)
+
+
+def index_file_chunks(note):
+    """Replace the indexed text of a research note's file with its current chunks."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid BETWEEN %s AND %s', file_rowids(note.pk))
+        _insert_file_chunks(cursor, note)
+
+
+def rebuild_index():
+    """Re-index every entity, e.g. after changing the indexed fields."""
+    if not fts_available():
+        return 0
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        for entity_type, (model, _) in SEARCH_MODELS.items():
+            rows = [_row(obj, entity_type) for obj in model.objects.all().iterator()]
+            cursor.executemany(INSERT, rows)
+            count += len(rows)
+        for note in ResearchNote.objects.filter(file_chunks__isnull=False).distinct().iterator():
+            _insert_file_chunks(cursor, note)
+    return count
+
+
+def _terms(query):
+    return WORD_RE.findall(query)
+
+
+def _fts_query(terms):
+    # Every term must match; each is quoted so FTS5 operators in the input are
+    # plain words, and the last one matches as a prefix while typing.
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    """HTML for a snippet with MARK_START/MARK_END markers, the rest escaped."""
+    return escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def _fts_search(project, terms, limit):
+    # A file has a row per chunk; only its best chunk is kept, so fetch extra rows
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT entity_type, entity_id, title, "
+            f"snippet({TABLE}, 1, %s, %s, '…', {SNIPPET_TOKENS}), bm25({TABLE}, 10.0, 1.0) "
+            f"FROM {TABLE} WHERE {TABLE} MATCH %s AND project_id = %s ORDER BY bm25({TABLE}, 10.0, 1.0) LIMIT %s",
+            [MARK_START, MARK_END, _fts_query(terms), project.pk, limit * 4])
+        results, seen = [], set()
+        for entity_type, entity_id, title, snippet, rank in cursor.fetchall():
+            if (entity_type, entity_id) not in seen and len(results) < limit:
+                seen.add((entity_type, entity_id))
+                results.append((entity_type, int(entity_id), title, snippet, -rank))
+        return results
+
+
+def matching_ids(model, query):
+    """Ids of the entities of a model matching every word of `query`, from the FTS5 index."""
+    terms = _terms(query)
+    if not terms:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT entity_id FROM {TABLE} WHERE {TABLE} MATCH %s AND entity_type = %s',
+                       [_fts_query(terms), entity_type_for(model)])
+        return [int(entity_id) for entity_id, in cursor.fetchall()]
+
+
+def _mark_terms(text, terms):
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    return pattern.sub(lambda match: f'{MARK_START}{match.group(0)}{MARK_END}', text)
+
+
+def _fallback_snippet(body, terms):
+    lowered = body.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    start = min((position for position in positions if position >= 0), default=0)
+    start = max(0, start - FALLBACK_SNIPPET_CHARS // 4)
+    snippet = body[start:start + FALLBACK_SNIPPET_CHARS]
+    prefix = '…' if start else ''
+    suffix = '…' if start + FALLBACK_SNIPPET_CHARS < len(body) else ''
+    return prefix + _mark_terms(snippet, terms) + suffix
+
+
+def _fallback_search(project, terms, limit):
+    """icontains matching for databases without FTS5, ranked by how often the terms occur.
+
+    Text extracted from research files is only searched through FTS5.
+    """
+    results = []
+    for entity_type, (model, _) in SEARCH_MODELS.items():
+        fields = text_fields(model)
+        condition = Q()
+        for term in terms:
+            condition &= Q(*[Q(**{f'{name}__icontains': term}) for name in fields], _connector=Q.OR)
+        for obj in model.objects.filter(condition, project=project):
+            title, body = _title(obj), _body(obj)
+            score = sum(10 * title.lower().count(term.lower()) + body.lower().count(term.lower()) for term in terms)
+            results.append((entity_type, obj.pk, title, _fallback_snippet(body, terms), score))
+    results.sort(key=lambda result: -result[4])
+    return results[:limit]
+
+
+def search_project(project, query, limit=50):
+    """Entities of a project matching every word of `query`, best first.
+
+    Returns dicts with the entity type, id, title, edit URL and a snippet as
+    HTML, the matched words wrapped in <mark>.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    rows = _fts_search(project, terms, limit) if fts_available() else _fallback_search(project, terms, limit)
+    return [{
+        'entity_type': entity_type,
+        'label': RESULT_TYPES[entity_type][0],
+        'id': entity_id,
+        'title': title,
+        'url': reverse(RESULT_TYPES[entity_type][1], args=[project.pk, entity_id]),
+        'snippet': highlight(snippet),
+        'score': round(score, 3),
+    } for entity_type, entity_id, title, snippet, score in rows]
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from .extraction import needs_extraction, schedule_extraction
+from .models import ResearchNote, UploadSession
+from .search import SEARCH_MODELS, index_entity, remove_entity
+from .storage import add_reference, release_reference
+
+# Models whose `file` lives in the content-addressed storage, which counts references to each blob
+BLOB_MODELS = [ResearchNote, UploadSession]
+
+
+def update_search_index(sender, instance, **kwargs):
+    index_entity(instance)
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_entity(instance)
+
+
+def extract_research_file(sender, instance, **kwargs):
+    if needs_extraction(instance):
+        transaction.on_commit(lambda: schedule_extraction(instance))
+
+
+def _file_changes(instance, update_fields):
+    return instance.pk is not None and (update_fields is None or 'file' in update_fields)
+
+
+def remember_stored_file(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'file' in update_fields:
+        if instance.file and not instance.file._committed:
+            # The storage is about to save it, taking the field's reference itself
+            instance._file_reference_taken = True
+    if _file_changes(instance, update_fields):
+        instance._stored_file_name = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+
+
+def count_file_reference(sender, instance, created, update_fields=None, **kwargs):
+    if not created and not _file_changes(instance, update_fields):
+        return
+    taken = instance.__dict__.pop('_file_reference_taken', False)
+    old_name = getattr(instance, '_stored_file_name', None) or ''
+    new_name = instance.file.name or ''
+    instance._stored_file_name = new_name
+    if old_name == new_name:
+        if taken:
+            # The same content saved again; the field already held a reference
+            transaction.on_commit(lambda: release_reference(new_name))
+        return
+    if not taken:
+        add_reference(new_name)
+    # Released once committed, so a rolled back save can't lose a file still in use
+    transaction.on_commit(lambda: release_reference(old_name))
+
+
+def release_file_reference(sender, instance, **kwargs):
+    name = instance.file.name
+    transaction.on_commit(lambda: release_reference(name))
+
+
+def connect_signals():
+    for model, _ in SEARCH_MODELS.values():
+        post_save.connect(update_search_index, sender=model, dispatch_uid=f'core_search_save_{model.__name__}')
+        post_delete.connect(remove_from_search_index, sender=model, dispatch_uid=f'core_search_delete_{model.__name__}')
+    post_save.connect(extract_research_file, sender=ResearchNote, dispatch_uid='core_research_file_save')
+    for model in BLOB_MODELS:
+        pre_save.connect(remember_stored_file, sender=model, dispatch_uid=f'core_blob_pre_save_{model.__name__}')
+        post_save.connect(count_file_reference, sender=model, dispatch_uid=f'core_blob_save_{model.__name__}')
+        post_delete.connect(release_file_reference, sender=model, dispatch_uid=f'core_blob_delete_{model.__name__}')
@@ -47,8 +47,11 @@ document.addEventListener('DOMContentLoaded', function() {
         endpoint: '/ai/improve/chapter/',
         successProperty: 'generated_content',
         successMessage: 'Chapter content generated successfully!',
-        datasetKey: 'chapterId'
+        datasetKey: 'chapterId',
+        stream: true // Append generated text to the textarea as it arrives
     });
+
+    setupResumableUpload(document.querySelector('form[data-upload-url]'));
 });
 
 // Helper function to get CSRF token (needed for POST requests in Django)
@@ -67,6 +70,22 @@ function getCookie(name) {
     return cookieValue;
 }
 
+// Helper function to build the prompt context query (?scope=&depth=&budget=) from the button's data attributes
+function _contextQueryString(button) {
+    const params = new URLSearchParams();
+    if (button.dataset.contextScope) {
+        params.set('scope', button.dataset.contextScope);
+    }
+    if (button.dataset.contextDepth) {
+        params.set('depth', button.dataset.contextDepth);
+    }
+    if (button.dataset.contextBudget) {
+        params.set('budget', button.dataset.contextBudget);
+    }
+    const query = params.toString();
+    return query ? `?${query}` : '';
+}
+
 // Helper function to get or create the proposal container
 function _getOrCreateProposalContainer(statusId, statusDiv) {
     const proposalContainerId = statusId + '-proposal-container';
@@ -113,7 +132,7 @@ async function improveEntityDescription_Interactive(config) {
         statusDiv.className = 'improvement-status loading';
         improveButton.disabled = true;
 
-        const getPromptResponse = await fetch(`${config.endpoint}${projectId}/${itemId}/`);
+        const getPromptResponse = await fetch(`${config.endpoint}${projectId}/${itemId}/${_contextQueryString(improveButton)}`);
         const promptData = await getPromptResponse.json();
 
         if (promptData.status === 'success' && promptData.prompt) {
@@ -136,6 +155,11 @@ async function improveEntityDescription_Interactive(config) {
                 executeButton.disabled = true;
                 promptEditorTextarea.disabled = true;
 
+                if (config.stream) {
+                    await _streamIntoTextarea(config, projectId, itemId, editedPrompt, statusDiv, proposalContainer, originalTextarea, improveButton);
+                    return;
+                }
+
                 try {
                     const executeResponse = await fetch(`${config.endpoint}${projectId}/${itemId}/`, {
                         method: 'POST',
@@ -145,7 +169,12 @@ async function improveEntityDescription_Interactive(config) {
                         },
                         body: JSON.stringify({ prompt: editedPrompt })
                     });
-                    const improvementData = await executeResponse.json();
+                    let improvementData = await executeResponse.json();
+                    if (improvementData.status === 'queued') {
+                        // Generation runs as a background job; poll until it finishes
+                        statusDiv.textContent = 'Generation queued...';
+                        improvementData = await _pollGenerationJob(improvementData.job_url, statusDiv);
+                    }
 
                     if (improvementData.status === 'success') {
                         const proposedText = improvementData[config.successProperty];
@@ -160,6 +189,8 @@ async function improveEntityDescription_Interactive(config) {
 
             proposalContainer.appendChild(promptEditorTextarea);
             proposalContainer.appendChild(executeButton);
+            // The project context comes first; show the instructions at the end
+            promptEditorTextarea.scrollTop = promptEditorTextarea.scrollHeight;
 
         } else {
             throw new Error(promptData.message || 'Failed to fetch prompt');
@@ -169,6 +200,125 @@ async function improveEntityDescription_Interactive(config) {
     }
 }
 
+// Helper function to poll a generation job until it is done; resolves to the job's data
+async function _pollGenerationJob(jobUrl, statusDiv, interval = 1500) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, interval));
+        const response = await fetch(jobUrl);
+        const data = await response.json();
+        if (data.status !== 'success') {
+            throw new Error(data.message || 'Failed to check the generation job');
+        }
+        const job = data.job;
+        if (job.state === 'done') {
+            return { ...job, status: 'success' };
+        }
+        if (job.state === 'failed') {
+            throw new Error(job.message);
+        }
+        statusDiv.textContent = job.state === 'running' ? 'Generating...' : 'Generation queued...';
+    }
+}
+
+// Helper function to read a Server-Sent Events response, calling onEvent(eventName, data) per event
+async function _readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    eventName = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            onEvent(eventName, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
+// Streams generated text straight into the textarea, keeping the previous text so it can be restored
+async function _streamIntoTextarea(config, projectId, itemId, prompt, statusDiv, proposalContainer, textarea, improveButton) {
+    const previousText = textarea.value;
+    try {
+        const response = await fetch(`${config.endpoint}${projectId}/${itemId}/stream/`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': getCookie('csrftoken')
+            },
+            body: JSON.stringify({ prompt: prompt })
+        });
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.message || 'Failed to generate proposal');
+        }
+
+        proposalContainer.innerHTML = '';
+        textarea.value = '';
+        statusDiv.textContent = 'Writing...';
+        let streamError = null;
+        await _readEventStream(response, (eventName, data) => {
+            if (eventName === 'error') {
+                streamError = new Error(data.message);
+            } else if (data.text) {
+                textarea.value += data.text;
+                textarea.scrollTop = textarea.scrollHeight;
+            }
+        });
+        if (streamError) {
+            throw streamError;
+        }
+        _displayStreamedResultUI(statusDiv, proposalContainer, textarea, improveButton, previousText, config.successMessage);
+    } catch (error) {
+        textarea.value = previousText;
+        _handleRequestError(statusDiv, proposalContainer, improveButton, error, 'Error generating improvement');
+    }
+}
+
+function _displayStreamedResultUI(statusDiv, proposalContainer, textarea, improveButton, previousText, successMessage) {
+    statusDiv.textContent = 'Keep the generated text?';
+    statusDiv.className = 'improvement-status info';
+    proposalContainer.innerHTML = '';
+
+    const acceptButton = document.createElement('button');
+    acceptButton.textContent = 'Accept';
+    acceptButton.classList.add('btn', 'btn-success');
+    acceptButton.style.marginRight = '5px';
+    acceptButton.onclick = () => {
+        statusDiv.textContent = successMessage;
+        statusDiv.className = 'improvement-status success';
+        proposalContainer.innerHTML = '';
+        if (improveButton) improveButton.disabled = false;
+    };
+
+    const cancelButton = document.createElement('button');
+    cancelButton.textContent = 'Restore previous text';
+    cancelButton.classList.add('btn', 'btn-secondary');
+    cancelButton.onclick = () => {
+        textarea.value = previousText;
+        statusDiv.textContent = 'Improvement cancelled.';
+        statusDiv.className = 'improvement-status info';
+        proposalContainer.innerHTML = '';
+        if (improveButton) improveButton.disabled = false;
+    };
+
+    proposalContainer.appendChild(acceptButton);
+    proposalContainer.appendChild(cancelButton);
+}
+
 function _displayProposalUI(statusDiv, proposalContainer, originalTextarea, improveButton, proposedText, successMessage) {
     statusDiv.textContent = 'Proposal ready:';
     statusDiv.className = 'improvement-status info';
@@ -245,3 +395,145 @@ async function improve(config) {
         _handleRequestError(statusDiv, proposalContainer, improveButton, error, 'Error generating proposal');
     }
 }
+
+// Chunks sent at the same time by a resumable upload, and tries per chunk
+const UPLOAD_PARALLEL_CHUNKS = 3;
+const UPLOAD_CHUNK_ATTEMPTS = 5;
+
+// Send the form's file through the resumable upload API, then submit the form with the upload's id
+function setupResumableUpload(form) {
+    if (!form) {
+        return;
+    }
+    const fileInput = form.querySelector('input[type="file"]');
+    const uploadIdInput = form.querySelector('input[name="upload_id"]');
+    const statusElement = form.querySelector('.upload-status');
+    if (!fileInput || !uploadIdInput) {
+        return;
+    }
+    let uploading = false;
+    fileInput.addEventListener('change', function() {
+        uploadIdInput.value = '';
+    });
+
+    form.addEventListener('submit', async function(event) {
+        const file = fileInput.files[0];
+        if (!file || uploadIdInput.value) {
+            return;
+        }
+        event.preventDefault();
+        if (uploading) {
+            return;
+        }
+        uploading = true;
+        try {
+            const upload = await _resumableUpload(form.dataset.uploadUrl, file, function(done, total) {
+                statusElement.textContent = `Uploading ${file.name}: ${Math.floor(100 * done / total)}%`;
+            });
+            uploadIdInput.value = upload.id;
+            fileInput.value = '';
+            statusElement.textContent = `Uploaded ${file.name}`;
+            form.submit();
+        } catch (error) {
+            statusElement.textContent = `Upload failed: ${error.message}. Save again to resume.`;
+        } finally {
+            uploading = false;
+        }
+    });
+}
+
+async function _uploadRequest(url, options) {
+    const response = await fetch(url, {
+        ...options,
+        headers: { 'X-CSRFToken': getCookie('csrftoken'), ...(options && options.headers) }
+    });
+    const data = await response.json();
+    if (data.status !== 'success') {
+        throw new Error(data.message || `Request failed (${response.status})`);
+    }
+    return data;
+}
+
+async function _sha256Hex(blob) {
+    // crypto.subtle only exists on secure pages (https or localhost); the server hashes chunks either way
+    if (!window.crypto || !window.crypto.subtle) {
+        return '';
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// Upload a file in parallel chunks, resuming an earlier upload of the same file if the server still has it
+async function _resumableUpload(startUrl, file, onProgress) {
+    const resumeKey = `upload:${startUrl}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+    const previousUrl = localStorage.getItem(resumeKey);
+    if (previousUrl) {
+        try {
+            upload = (await _uploadRequest(previousUrl)).upload;
+        } catch (error) {
+            localStorage.removeItem(resumeKey);
+        }
+    }
+    if (!upload) {
+        upload = (await _uploadRequest(startUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ file_name: file.name, size: file.size })
+        })).upload;
+        localStorage.setItem(resumeKey, upload.url);
+    }
+
+    for (let attempt = 0; !upload.completed; attempt++) {
+        const received = new Set(upload.received);
+        const pending = [];
+        for (let index = 0; index < upload.chunks; index++) {
+            if (!received.has(index)) {
+                pending.push(index);
+            }
+        }
+        let done = upload.chunks - pending.length;
+        onProgress(done, upload.chunks);
+
+        const sendChunk = async function(index) {
+            const offset = index * upload.chunk_size;
+            const chunk = file.slice(offset, offset + upload.chunk_size);
+            const checksum = await _sha256Hex(chunk);
+            for (let tries = 1; ; tries++) {
+                try {
+                    await _uploadRequest(`${upload.url}?offset=${offset}`, {
+                        method: 'PUT',
+                        headers: checksum ? { 'X-Chunk-SHA256': checksum } : {},
+                        body: chunk
+                    });
+                    break;
+                } catch (error) {
+                    if (tries >= UPLOAD_CHUNK_ATTEMPTS) {
+                        throw error;
+                    }
+                    await new Promise(resolve => setTimeout(resolve, 500 * 2 ** tries));
+                }
+            }
+            onProgress(++done, upload.chunks);
+        };
+        const worker = async function() {
+            while (pending.length) {
+                await sendChunk(pending.shift());
+            }
+        };
+        await Promise.all(Array.from({ length: UPLOAD_PARALLEL_CHUNKS }, worker));
+
+        try {
+            upload = (await _uploadRequest(upload.finish_url, { method: 'POST' })).upload;
+        } catch (error) {
+            // A chunk that turned out corrupt is dropped by the server; send what is missing again
+            const state = (await _uploadRequest(upload.url)).upload;
+            if (attempt >= 1 || state.received.length === state.chunks) {
+                throw error;
+            }
+            upload = state;
+        }
+    }
+    localStorage.removeItem(resumeKey);
+    return upload;
+}
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+from datetime import timedelta
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Stores each distinct file once, named after the SHA-256 of its content.
+
+    `<upload_to>/<name>.pdf` is saved as `<upload_to>/ab/abcd....pdf`. A FileBlob
+    row per stored file counts the model fields referring to it (kept by
+    core.signals), and a blob is only deleted once nothing refers to it.
+
+    Saving takes a reference for the field the file is saved for, in the same
+    transaction that finds the blob, so a concurrent release of the last
+    reference can't delete the file in between. Code saving a file directly
+    owns that reference: it hands it to a field (see core.signals) or releases it.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content, so an existing file is reused, not renamed
+        return name
+
+    def _save(self, name, content):
+        from .models import FileBlob
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.path(directory or '.'), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        # Written and hashed in one pass, then moved to its content-addressed name
+        with tempfile.NamedTemporaryFile(dir=self.path(directory or '.'), prefix='.upload-', delete=False) as temp:
+            try:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    temp.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            except BaseException:
+                temp.close()
+                os.remove(temp.name)
+                raise
+        sha256 = digest.hexdigest()
+        stored_name = posixpath.join(directory, sha256[:2], sha256 + extension)
+        with transaction.atomic():
+            blob, _ = FileBlob.objects.select_for_update().get_or_create(
+                name=stored_name, defaults={'sha256': sha256, 'size': size})
+            path = self.path(stored_name)
+            if os.path.exists(path):
+                os.remove(temp.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp.name, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+            blob.ref_count = F('ref_count') + 1
+            blob.save(update_fields=['ref_count', 'updated_at'])
+        return stored_name
+
+    def delete(self, name):
+        """Delete a file unless something still refers to it."""
+        from .models import FileBlob
+        if not name:
+            return
+        with transaction.atomic():
+            blob = FileBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                if blob.ref_count > 0:
+                    return
+                blob.delete()
+            super().delete(name)
+
+
+_storage = ContentAddressedStorage()
+
+
+def research_file_storage():
+    return _storage
+
+
+def add_reference(name):
+    from .models import FileBlob
+    if name:
+        FileBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release_reference(name):
+    """Drop a reference to a stored file, deleting it when it was the last one."""
+    from .models import FileBlob
+    if not name:
+        return
+    with transaction.atomic():
+        blob = FileBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return
+        blob.ref_count = max(0, blob.ref_count - 1)
+        blob.save(update_fields=['ref_count', 'updated_at'])
+        if not blob.ref_count:
+            _storage.delete(name)
+
+
+def storage_report():
+    """Stored blobs, the bytes they take and the bytes deduplication saved."""
+    from .models import FileBlob
+    totals = FileBlob.objects.aggregate(blobs=Count('id'), references=Sum('ref_count'), stored_bytes=Sum('size'),
+                                        unreferenced=Count('id', filter=Q(ref_count=0)),
+                                        saved_bytes=Sum(F('size') * (F('ref_count') - 1), filter=Q(ref_count__gt=1)))
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def recount_references(models):
+    """Set every blob's count from the `file` fields of `models`; returns how many were wrong."""
+    from collections import Counter
+    from .models import FileBlob
+    counts = Counter()
+    for model in models:
+        counts.update(model.objects.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True))
+    wrong = 0
+    for blob in FileBlob.objects.all():
+        if blob.ref_count != counts[blob.name]:
+            FileBlob.objects.filter(pk=blob.pk).update(ref_count=counts[blob.name])
+            wrong += 1
+    return wrong
+
+
+def prune_unreferenced(age=timedelta(hours=1)):
+    """Delete blobs nothing has referred to for `age`, e.g. ones recount_references found unused; returns how many."""
+    from .models import FileBlob
+    names = list(FileBlob.objects.filter(ref_count=0, updated_at__lt=timezone.now() - age).values_list('name', flat=True))
+    for name in names:
+        _storage.delete(name)
+    return len(names)
+
+
+def _is_content_addressed(blob):
+    return os.path.splitext(posixpath.basename(blob.name))[0] == blob.sha256
+
+
+def convert_legacy_files(models):
+    """Move files saved before content-addressed storage into blobs; returns (files, bytes freed).
+
+    Migration 0028 gave every such file a FileBlob under its old name, so the
+    references move from the old blob to the new one like for any other change.
+    """
+    from .models import FileBlob
+    converted, freed = 0, 0
+    for model in models:
+        for obj in model.objects.exclude(file='').exclude(file__isnull=True).iterator():
+            old_name = obj.file.name
+            blob = FileBlob.objects.filter(name=old_name).first()
+            if (blob is not None and _is_content_addressed(blob)) or not _storage.exists(old_name):
+                continue
+            size = _storage.size(old_name)
+            with _storage.open(old_name, 'rb') as file:
+                # Takes the reference obj now holds
+                new_name = _storage.save(old_name, file)
+            fields = {'file': new_name}
+            if getattr(obj, 'file_text_source', None) == old_name:
+                # Same content, so its extracted text stays valid
+                fields['file_text_source'] = new_name
+            model.objects.filter(pk=obj.pk).update(**fields)
+            converted += 1
+            if blob is None:
+                # Nothing counts its references: delete it once no field refers to it
+                if not any(m.objects.filter(file=old_name).exists() for m in models):
+                    FileSystemStorage.delete(_storage, old_name)
+                    freed += size
+                continue
+            release_reference(old_name)
+            if not FileBlob.objects.filter(name=old_name).exists():
+                freed += size
+    return converted, freed
@@ -0,0 +1,28 @@
+from .models import (Chapter, Character, CharacterRelationship, Organization, Place, PlotPoint, Project,
+                     ResearchNote)
+
+
+def make_project(user, size):
+    """A project with `size` of every entity, linked to each other like a real one. For tests."""
+    project = Project.objects.create(name=f'Novel {size}', description='A story', key_themes='loss, hope', user=user)
+    characters = [Character.objects.create(project=project, name=f'Character {i}', role='Lead', description='Brave',
+                                           traits='brave; kind') for i in range(size)]
+    for first, second in zip(characters, characters[1:]):
+        CharacterRelationship.objects.create(from_character=first, to_character=second, description='Friends')
+    for i in range(size):
+        place = Place.objects.create(project=project, name=f'Place {i}', type='City', description='Old')
+        place.characters.set(characters[i:i + 2])
+        organization = Organization.objects.create(project=project, name=f'Organization {i}', type='Guild')
+        organization.characters.set(characters[i:i + 2])
+        organization.places.set([place])
+        chapter = Chapter.objects.create(project=project, title=f'Chapter {i}', chapter_number=i + 1,
+                                         content='Once upon a time', point_of_view=characters[i])
+        chapter.characters.set(characters[i:i + 3])
+        chapter.places.set([place])
+        chapter.organizations.set([organization])
+        plot_point = PlotPoint.objects.create(project=project, title=f'Plot point {i}', order=i, chapter=chapter)
+        plot_point.characters.set(characters[i:i + 2])
+        plot_point.places.set([place])
+        plot_point.organizations.set([organization])
+        ResearchNote.objects.create(project=project, title=f'Note {i}', content='Sources', tags='history')
+    return project
@@ -0,0 +1,360 @@
+import hashlib
+import os
+import sys
+import shutil
+import tempfile
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.core.files.base import ContentFile
+from . import extraction, search, storage, uploads
+from .models import FileBlob, Project, ResearchFileChunk, ResearchNote, UploadSession
+from .testing import make_project
+
+
+class MediaTestCase(TestCase):
+    """Stores files in a temporary MEDIA_ROOT, removed after each test."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+@override_settings(RESEARCH_UPLOAD_CHUNK_BYTES=4)
+class ResumableUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('writer')
+        self.client.force_login(user)
+        self.project = Project.objects.create(name='Novel', description='', user=user)
+        self.note = ResearchNote.objects.create(project=self.project, title='Sources', content='')
+
+    def _upload(self, data, note=None, send=None):
+        response = self.client.post(reverse('upload_start', args=[self.project.pk]), {
+            'file_name': 'sources.txt', 'size': len(data), 'note_id': note and note.pk,
+        }, content_type='application/json')
+        upload = response.json()['upload']
+        for index in send if send is not None else range(upload['chunks']):
+            self.client.put(f"{upload['url']}?offset={index * 4}", data[index * 4:index * 4 + 4],
+                            content_type='application/octet-stream')
+        return upload
+
+    def test_finish_attaches_to_note(self):
+        upload = self._upload(b'chapter one notes', note=self.note)
+        response = self.client.post(upload['finish_url'])
+
+        data = response.json()
+        self.assertTrue(data['attached'])
+        self.assertTrue(data['upload']['completed'])
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.file.read(), b'chapter one notes')
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'upload_parts', str(upload['id']))))
+
+    def test_parts_are_joined_outside_a_transaction(self):
+        upload = self._upload(b'chapter one notes')
+        join_parts = uploads._join_parts
+        # The transactions TestCase wraps each test in
+        test_blocks = len(connection.atomic_blocks)
+
+        def join_outside_transaction(session):
+            self.assertEqual(UploadSession.objects.get(pk=session.pk).status, 'finishing')
+            self.assertEqual(len(connection.atomic_blocks), test_blocks)
+            return join_parts(session)
+
+        with mock.patch.object(uploads, '_join_parts', join_outside_transaction):
+            response = self.client.post(upload['finish_url'])
+        self.assertEqual(response.json()['upload']['completed'], True)
+        self.assertEqual(UploadSession.objects.get().file.read(), b'chapter one notes')
+
+    def test_missing_chunk(self):
+        upload = self._upload(b'chapter one notes', send=[0, 1, 3, 4])
+        response = self.client.post(upload['finish_url'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['upload']['received'], [0, 1, 3, 4])
+        self.assertEqual(UploadSession.objects.get().status, 'receiving')
+
+
+class FileExtractionTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('writer'))
+
+    def _note(self, file_name, content):
+        return ResearchNote.objects.create(project=self.project, title='Sources', content='',
+                                           file=ContentFile(content, name=file_name))
+
+    def test_text_file(self):
+        note = self._note('sources.txt', b'The siege lasted ' + b'many days ' * 300)
+        extraction.process_note_file(note.pk)
+        note.refresh_from_db()
+        self.assertEqual(note.file_text_status, 'done')
+        self.assertTrue(note.file_chunks.first().text.startswith('The siege lasted'))
+
+    def test_pdf_without_pypdf(self):
+        note = self._note('sources.pdf', b'%PDF-1.4')
+        # None in sys.modules makes the import fail
+        with mock.patch.dict(sys.modules, {'pypdf': None}):
+            extraction.process_note_file(note.pk)
+        note.refresh_from_db()
+        self.assertEqual(note.file_text_status, 'unsupported')
+        self.assertFalse(note.file_chunks.exists())
+
+    def test_chunks_are_written_in_batches(self):
+        note = self._note('sources.txt', b'First draft')
+        extraction.process_note_file(note.pk)
+        note.file = ContentFile(b'word ' * 1000, name='sources.txt')
+        note.save()
+        bulk_create = ResearchFileChunk.objects.bulk_create
+        batches = []
+
+        def record_batch(chunks):
+            batches.append(len(chunks))
+            # Still the previous text until the new chunks are all written
+            self.assertEqual([chunk.text for chunk in note.file_chunks.filter(position__gte=0)], ['First draft'])
+            return bulk_create(chunks)
+
+        with mock.patch.object(extraction, 'CHUNK_BATCH', 2), \
+                mock.patch.object(ResearchFileChunk.objects, 'bulk_create', side_effect=record_batch):
+            self.assertEqual(extraction.extract_note_file(note), 5)
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(list(note.file_chunks.values_list('position', flat=True)), [0, 1, 2, 3, 4])
+
+    def test_failed_write_keeps_previous_chunks(self):
+        note = self._note('sources.txt', b'First draft')
+        extraction.process_note_file(note.pk)
+        with mock.patch.object(ResearchFileChunk.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                extraction.extract_note_file(note)
+        self.assertEqual(note.file_chunks.get().text, 'First draft')
+
+
+class FileReferenceTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('writer'))
+
+    def _note(self, content):
+        return ResearchNote.objects.create(project=self.project, title='Sources', content='',
+                                           file=ContentFile(content, name='sources.txt'))
+
+    def test_saving_takes_the_reference(self):
+        name = storage.research_file_storage().save('research_notes/sources.txt', ContentFile(b'The siege'))
+        self.assertEqual(FileBlob.objects.get(name=name).ref_count, 1)
+
+    @mock.patch('core.signals.schedule_extraction')
+    def test_fields_are_counted_once(self, schedule_extraction):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self._note(b'The siege')
+            self._note(b'The siege')
+            # The same content saved again over itself
+            first.file = ContentFile(b'The siege', name='sources.txt')
+            first.save()
+        self.assertEqual(FileBlob.objects.get(name=first.file.name).ref_count, 2)
+
+    @mock.patch('core.signals.schedule_extraction')
+    def test_blob_is_deleted_with_its_last_reference(self, schedule_extraction):
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = self._note(b'The siege'), self._note(b'The siege')
+        name = first.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(FileBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(storage.research_file_storage().exists(name))
+
+        # Replacing the file releases the old one too
+        with self.captureOnCommitCallbacks(execute=True):
+            second.file = ContentFile(b'The second siege', name='sources.txt')
+            second.save()
+        self.assertFalse(FileBlob.objects.filter(name=name).exists())
+        self.assertFalse(storage.research_file_storage().exists(name))
+
+
+class ResearchFileDownloadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('writer')
+        self.client.force_login(user)
+        project = Project.objects.create(name='Novel', description='', user=user)
+        note = ResearchNote.objects.create(project=project, title='Sources', content='',
+                                           file=ContentFile(b'0123456789', name='sources.txt'))
+        self.url = reverse('researchnote_file', args=[project.pk, note.pk])
+
+    def _content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._content(response), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # The content-addressed name is the file's SHA-256
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(b"0123456789").hexdigest()}"')
+
+    def test_ranges(self):
+        for header, status, content_range, content in [
+            ('bytes=2-5', 206, 'bytes 2-5/10', b'2345'),
+            ('bytes=7-', 206, 'bytes 7-9/10', b'789'),
+            ('bytes=-3', 206, 'bytes 7-9/10', b'789'),
+            ('bytes=20-', 416, 'bytes */10', None),
+        ]:
+            with self.subTest(range=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response['Content-Range'], content_range)
+                if content is not None:
+                    self.assertEqual(self._content(response), content)
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A range for another version of the file gets the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._content(response), b'0123456789')
+
+
+class FileBlobBackfillTests(TransactionTestCase):
+    before = [('core', '0027_search_index_rowids')]
+    after = [('core', '0028_backfill_fileblobs')]
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(media_root, 'research_notes'))
+        with open(os.path.join(media_root, 'research_notes', 'old.txt'), 'wb') as file:
+            file.write(b'The siege')
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_files_stored_before_get_blobs(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        user = apps.get_model('auth', 'User').objects.create(username='writer')
+        project = apps.get_model('core', 'Project').objects.create(name='Novel', description='', user_id=user.pk)
+        for _ in range(2):
+            apps.get_model('core', 'ResearchNote').objects.create(project=project, title='Sources', content='',
+                                                                  file='research_notes/old.txt')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        blob = FileBlob.objects.get()
+        self.assertEqual((blob.name, blob.size, blob.ref_count), ('research_notes/old.txt', 9, 2))
+
+        ResearchNote.objects.first().delete()
+        storage.release_reference('research_notes/old.txt')
+        # Deleted with its last reference
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(storage.research_file_storage().exists('research_notes/old.txt'))
+
+
+class SearchIndexMigrationTests(TransactionTestCase):
+    before = [('core', '0021_character_updated_at_chapter_updated_at_and_more')]
+    after = [('core', '0022_search_index')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_indexes_existing_entities(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        user = apps.get_model('auth', 'User').objects.create(username='writer')
+        project = apps.get_model('core', 'Project').objects.create(name='Novel', description='', user_id=user.pk)
+        apps.get_model('core', 'Character').objects.create(project=project, name='Ada', role='Lead',
+                                                           description='A cartographer')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT title FROM {search.TABLE} WHERE {search.TABLE} MATCH 'cartographer'")
+            self.assertEqual(cursor.fetchall(), [('Ada',)])
+
+    def test_rows_get_rowids(self):
+        before, after = [('core', '0026_uploadsession_status')], [('core', '0027_search_index_rowids')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.TABLE}")
+            cursor.executemany(
+                f"INSERT INTO {search.TABLE} (title, body, entity_type, entity_id, project_id) VALUES (%s, %s, %s, %s, 1)",
+                [('Ada', 'A cartographer', 'character', 3), ('Sources', 'first', 'research_file', 2),
+                 ('Sources', 'second', 'research_file', 2), ('Sources', 'Notes', 'research_note', 2)])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(after)
+        first, _ = search.file_rowids(2)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid, body FROM {search.TABLE} ORDER BY rowid')
+            self.assertEqual(cursor.fetchall(), [
+                (first, 'first'), (first + 1, 'second'),
+                (search.entity_rowid('research_note', 2), 'Notes'),
+                (search.entity_rowid('character', 3), 'A cartographer'),
+            ])
+
+
+class SearchIndexTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(name='Novel', description='', user=User.objects.create_user('writer'))
+
+    def _rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid, entity_type, body FROM {search.TABLE} ORDER BY rowid')
+            return cursor.fetchall()
+
+    def test_rows_are_replaced_and_deleted_by_rowid(self):
+        note = ResearchNote.objects.create(project=self.project, title='Sources', content='Maps',
+                                           file=ContentFile(b'The siege', name='sources.txt'))
+        extraction.process_note_file(note.pk)
+        note.content = 'Old maps'
+        note.save()
+        first, _ = search.file_rowids(note.pk)
+        self.assertEqual(self._rows(), [
+            (first, 'research_file', 'The siege'),
+            (search.entity_rowid('research_note', note.pk), 'research_note', 'Sources\n\nOld maps'),
+        ])
+
+        note.delete()
+        self.assertEqual(self._rows(), [])
+
+
+class PageQueryTests(TestCase):
+    """Project pages take the same number of queries however many entities a project has."""
+
+    PAGES = [
+        ('project_edit', 'pk', 17),
+        ('character_list', 'project_id', 4),
+        ('place_list', 'project_id', 5),
+        ('organization_list', 'project_id', 5),
+        ('plotpoint_list', 'project_id', 7),
+        ('chapter_list', 'project_id', 7),
+        ('researchnote_list', 'project_id', 4),
+    ]
+
+    def setUp(self):
+        user = User.objects.create_user('writer')
+        self.client.force_login(user)
+        self.projects = [make_project(user, 3), make_project(user, 10)]
+
+    def test_query_counts(self):
+        for url_name, argument, queries in self.PAGES:
+            for project in self.projects:
+                with self.subTest(page=url_name, entities=project.characters.count()):
+                    with self.assertNumQueries(queries):
+                        response = self.client.get(reverse(url_name, kwargs={argument: project.pk}))
+                    self.assertEqual(response.status_code, 200)
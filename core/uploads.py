@@ -0,0 +1,260 @@
+import hashlib
+import os
+import posixpath
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .models import UploadSession, UploadPart
+from .storage import release_reference
+
+# Parts are read back in blocks of this size when they are joined
+READ_SIZE = 64 * 1024
+# An upload left "finishing" this long was being joined by a process that died
+FINISH_TIMEOUT = timedelta(minutes=30)
+
+
+class UploadError(Exception):
+    pass
+
+
+class CorruptPart(UploadError):
+    def __init__(self, index):
+        super().__init__(f'Chunk {index} is corrupt; send it again')
+        self.index = index
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _HashingReader:
+    """Reads at most `limit` bytes from a stream, hashing them on the way through.
+
+    Storage backends consume it like a file, so a chunk goes from the request
+    body to storage without being held in memory.
+    """
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        # Read by File.size, for backends that want the length up front
+        self.size = limit
+        self.remaining = limit
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b''
+        self.remaining -= len(data)
+        self.digest.update(data)
+        return data
+
+
+class _JoinedParts:
+    """Reads an upload's parts one after the other, checking each against its recorded checksum."""
+
+    def __init__(self, session):
+        self.size = session.size
+        self.parts = list(session.parts.all())
+        self.digest = hashlib.sha256()
+        self.current = None
+        self.part_digest = None
+
+    def _next_part(self):
+        self._check_part()
+        if not self.parts:
+            return False
+        part = self.parts.pop(0)
+        self.current = (part, default_storage.open(part_name(part.session, part.index), 'rb'))
+        self.part_digest = hashlib.sha256()
+        return True
+
+    def _check_part(self):
+        if self.current is None:
+            return
+        part, file = self.current
+        file.close()
+        self.current = None
+        if self.part_digest.hexdigest() != part.checksum:
+            raise CorruptPart(part.index)
+
+    def read(self, size=-1):
+        size = READ_SIZE if size is None or size < 0 else size
+        while True:
+            if self.current is None and not self._next_part():
+                return b''
+            data = self.current[1].read(size)
+            if data:
+                self.part_digest.update(data)
+                self.digest.update(data)
+                return data
+            self._check_part()
+
+    def close(self):
+        if self.current is not None:
+            self.current[1].close()
+            self.current = None
+
+
+def chunk_size():
+    return _setting('RESEARCH_UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024)
+
+
+def part_name(session, index):
+    return f'upload_parts/{session.pk}/{index:06d}'
+
+
+def part_count(session):
+    return max(1, -(-session.size // session.chunk_size))
+
+
+def part_size(session, index):
+    """The size chunk `index` must have; only the last one may be short."""
+    return min(session.chunk_size, session.size - index * session.chunk_size)
+
+
+def received(session):
+    return list(session.parts.values_list('index', flat=True))
+
+
+def start_upload(project, file_name, size, checksum='', note=None):
+    file_name = os.path.basename(file_name or '').strip()
+    if not file_name:
+        raise UploadError('A file name is required')
+    if not isinstance(size, int) or size < 0:
+        raise UploadError('The file size must be a number of bytes')
+    if size > _setting('RESEARCH_UPLOAD_MAX_BYTES', 4 * 1024 ** 3):
+        raise UploadError('The file is too large')
+    checksum = (checksum or '').lower()
+    if checksum and (len(checksum) != 64 or any(c not in '0123456789abcdef' for c in checksum)):
+        raise UploadError('The checksum must be a hex SHA-256 digest')
+    return UploadSession.objects.create(project=project, note=note, file_name=file_name[:255], size=size,
+                                        chunk_size=chunk_size(), checksum=checksum)
+
+
+def store_part(session, offset, stream, length, checksum=''):
+    """Stream one chunk from `stream` into storage; `offset` must be where a chunk starts.
+
+    A chunk sent again replaces the earlier copy, so a client can retry any
+    chunk whose response it didn't get.
+    """
+    if session.status == 'completed':
+        raise UploadError('The upload is already finished')
+    if session.status == 'finishing':
+        raise UploadError('The upload is being finished')
+    if offset < 0 or offset % session.chunk_size or offset >= max(session.size, 1):
+        raise UploadError(f'Chunks start at multiples of {session.chunk_size} bytes')
+    index = offset // session.chunk_size
+    if length != part_size(session, index):
+        raise UploadError(f'Chunk {index} must be {part_size(session, index)} bytes')
+
+    name = part_name(session, index)
+    reader = _HashingReader(stream, length)
+    default_storage.delete(name)
+    saved = default_storage.save(name, File(reader, name=name))
+    digest = reader.digest.hexdigest()
+    if reader.remaining or (checksum and checksum.lower() != digest):
+        default_storage.delete(saved)
+        raise UploadError(f'Chunk {index} arrived incomplete or corrupted; send it again')
+    UploadPart.objects.update_or_create(session=session, index=index, defaults={'size': length, 'checksum': digest})
+    return index
+
+
+def _delete_part(session, index):
+    default_storage.delete(part_name(session, index))
+    session.parts.filter(index=index).delete()
+
+
+def _delete_parts(session):
+    for index in received(session):
+        default_storage.delete(part_name(session, index))
+    session.parts.all().delete()
+    try:
+        # File system storage leaves the emptied directory behind
+        os.rmdir(default_storage.path(posixpath.dirname(part_name(session, 0))))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def _claim_for_finishing(session):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == 'completed':
+            return session
+        if session.status == 'finishing' and session.updated_at > timezone.now() - FINISH_TIMEOUT:
+            raise UploadError('The upload is already being finished')
+        missing = sorted(set(range(part_count(session))) - set(received(session)))
+        if missing and session.size:
+            raise UploadError(f'{len(missing)} chunks are missing, starting with chunk {missing[0]}')
+        session.status = 'finishing'
+        session.save(update_fields=['status', 'updated_at'])
+    return session
+
+
+def _join_parts(session):
+    """Save the joined parts to the upload's storage; returns the stored name."""
+    # The content-addressed storage discards what it wrote if reading a part fails
+    field = session.file.field
+    name = field.generate_filename(session, session.file_name)
+    joined = _JoinedParts(session)
+    try:
+        name = field.storage.save(name, File(joined, name=name), max_length=field.max_length)
+    except CorruptPart as e:
+        joined.close()
+        _delete_part(session, e.index)
+        raise
+    _delete_parts(session)
+    if session.checksum and joined.digest.hexdigest() != session.checksum:
+        # Drops the reference saving took; kept if other files refer to the same content
+        release_reference(name)
+        raise UploadError('The file does not match its checksum; upload it again')
+    return name
+
+
+def finish_upload(session):
+    """Join the parts into the final file and verify it.
+
+    The session is only locked to mark it "finishing" and to record the
+    result; the parts are joined and hashed in between, outside any
+    transaction. A corrupt part is dropped so the client can send it again;
+    a file not matching the upload's checksum drops all the upload's data.
+    """
+    session = _claim_for_finishing(session)
+    if session.status == 'completed':
+        return session
+    try:
+        name = _join_parts(session)
+    except BaseException:
+        UploadSession.objects.filter(pk=session.pk).update(status='receiving', updated_at=timezone.now())
+        raise
+    with transaction.atomic():
+        session.file.name = name
+        # Saving the joined parts took the reference the session now holds
+        session._file_reference_taken = True
+        session.status = 'completed'
+        session.completed_at = timezone.now()
+        session.save()
+    return session
+
+
+def attach_upload(note, session):
+    """Give a note the file of a finished upload; the session goes away."""
+    note.file.name = session.file.name
+    note.original_filename = session.file_name
+    note.save()
+    session.delete()
+
+
+def prune_uploads():
+    """Delete uploads started more than RESEARCH_UPLOAD_EXPIRY_HOURS ago and never attached; returns how many."""
+    cutoff = timezone.now() - timedelta(hours=_setting('RESEARCH_UPLOAD_EXPIRY_HOURS', 24))
+    count = 0
+    for session in UploadSession.objects.filter(created_at__lt=cutoff):
+        # The assembled file, if any, goes with its last reference
+        _delete_parts(session)
+        session.delete()
+        count += 1
+    return count
@@ -7,6 +7,8 @@ urlpatterns = [
     path('projects/<int:pk>/edit/', views.project_edit, name='project_edit'),
     path('projects/<int:pk>/details/edit/', views.project_details_edit, name='project_details_edit'),
     path('projects/<int:pk>/delete/', views.project_delete, name='project_delete'),
+    path('projects/<int:project_id>/search/', views.project_search, name='project_search'),
+    path('projects/<int:project_id>/search/results/', views.project_search_results, name='project_search_results'),
     path('projects/<int:project_id>/characters/', views.character_list, name='character_list'),
     path('projects/<int:project_id>/characters/create/', views.character_create, name='character_create'),
     path('projects/<int:project_id>/characters/<int:character_id>/edit/', views.character_edit, name='character_edit'),
@@ -27,6 +29,10 @@ urlpatterns = [
     path('projects/<int:project_id>/researchnotes/create/', views.researchnote_create, name='researchnote_create'),
     path('projects/<int:project_id>/researchnotes/<int:note_id>/edit/', views.researchnote_edit, name='researchnote_edit'),
     path('projects/<int:project_id>/researchnotes/<int:note_id>/delete/', views.researchnote_delete, name='researchnote_delete'),
+    path('projects/<int:project_id>/researchnotes/<int:note_id>/file/', views.researchnote_file, name='researchnote_file'),
+    path('projects/<int:project_id>/uploads/', views.upload_start, name='upload_start'),
+    path('projects/<int:project_id>/uploads/<int:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('projects/<int:project_id>/uploads/<int:upload_id>/finish/', views.upload_finish, name='upload_finish'),
     path('projects/<int:project_id>/chapters/', views.chapter_list, name='chapter_list'),
     path('projects/<int:project_id>/chapters/create/', views.chapter_create, name='chapter_create'),
     path('projects/<int:project_id>/chapters/<int:chapter_id>/edit/', views.chapter_edit, name='chapter_edit'),
@@ -1,9 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from .models import Project, Character, CharacterRelationship, Place, Organization, PlotPoint, ResearchNote, Chapter
+import json
+from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+from django.urls import reverse
+from .models import Project, Character, CharacterRelationship, Place, Organization, PlotPoint, ResearchNote, Chapter, UploadSession
 from django.db import models
+from django.db.models import Count, F, Prefetch
 from .forms import ProjectForm, CharacterForm, PlaceForm, OrganizationForm, PlotPointForm, ResearchNoteForm, ChapterForm
+from .media import serve_file
+from .search import search_project
+from .uploads import UploadError, attach_upload, finish_upload, part_count, received, start_upload, store_part
+
+# The fields each related model's __str__ shows, for list rows joining their names
+NAME_FIELDS = {
+    'characters': (Character, ['name', 'role']),
+    'places': (Place, ['name', 'type']),
+    'organizations': (Organization, ['name']),
+}
+
+def _names_prefetch(*lookups):
+    return [Prefetch(lookup, queryset=NAME_FIELDS[lookup][0].objects.only(*NAME_FIELDS[lookup][1])) for lookup in lookups]
+
+# List querysets: each prefetches or annotates what its list template shows, so a
+# list page costs the same number of queries however many rows it has.
+def _place_list(project):
+    return project.places.prefetch_related(*_names_prefetch('characters'))
+
+def _organization_list(project):
+    return project.organizations.prefetch_related(*_names_prefetch('characters'))
+
+def _plot_point_list(project):
+    return project.plot_points.prefetch_related(*_names_prefetch('characters', 'places', 'organizations'))
+
+def _chapter_list(project):
+    return project.chapters.annotate(
+        plot_point_count=Count('plot_points'),
+        point_of_view_name=F('point_of_view__name'),
+    ).prefetch_related(*_names_prefetch('characters', 'places', 'organizations'))
 
 @login_required
 def project_list(request):
@@ -33,6 +67,12 @@ def project_edit(request, pk):
     return render(request, 'core/project_form.html', {
         'form': form,
         'project': project,
+        'characters': project.characters.all(),
+        'places': _place_list(project),
+        'organizations': _organization_list(project),
+        'plot_points': _plot_point_list(project),
+        'chapters': _chapter_list(project),
+        'research_notes': project.research_notes.all(),
         'trunc': 20,
         'action': 'Save',
         'editing_project_details': False
@@ -165,7 +205,7 @@ def character_delete(request, project_id, character_id):
 @login_required
 def place_list(request, project_id):
     project = get_object_or_404(Project, pk=project_id, user=request.user)
-    places = project.places.all()
+    places = _place_list(project)
     return render(request, 'core/place_list.html', {
         'project': project,
         'places': places,
@@ -232,7 +272,7 @@ def place_delete(request, project_id, place_id):
 @login_required
 def organization_list(request, project_id):
     project = get_object_or_404(Project, pk=project_id, user=request.user)
-    organizations = project.organizations.all()
+    organizations = _organization_list(project)
     return render(request, 'core/organization_list.html', {
         'project': project,
         'organizations': organizations,
@@ -308,7 +348,7 @@ def organization_delete(request, project_id, organization_id):
 @login_required
 def plotpoint_list(request, project_id):
     project = get_object_or_404(Project, pk=project_id, user=request.user)
-    plot_points = project.plot_points.all()
+    plot_points = _plot_point_list(project)
     return render(request, 'core/plotpoint_list.html', {
         'project': project,
         'plot_points': plot_points,
@@ -389,15 +429,25 @@ def plotpoint_delete(request, project_id, plotpoint_id):
         'plot_point': plot_point
     })
 
+def _finished_upload(request, project):
+    # A file sent beforehand through the resumable upload API, in place of a form upload
+    upload_id = request.POST.get('upload_id')
+    if not upload_id or not upload_id.isdigit():
+        return None
+    return UploadSession.objects.filter(pk=upload_id, project=project, status='completed').first()
+
 @login_required
 def researchnote_create(request, project_id):
     project = get_object_or_404(Project, pk=project_id, user=request.user)
     if request.method == 'POST':
         form = ResearchNoteForm(request.POST, request.FILES)
+        upload = _finished_upload(request, project)
         if form.is_valid():
             note = form.save(commit=False)
             note.project = project
             note.save()
+            if upload:
+                attach_upload(note, upload)
             messages.success(request, 'Research note created successfully!')
             return redirect('project_edit', pk=project.id)
         else:
@@ -416,8 +466,11 @@ def researchnote_edit(request, project_id, note_id):
     note = get_object_or_404(ResearchNote, pk=note_id, project=project)
     if request.method == 'POST':
         form = ResearchNoteForm(request.POST, request.FILES, instance=note)
+        upload = _finished_upload(request, project)
         if form.is_valid():
             form.save()
+            if upload:
+                attach_upload(note, upload)
             messages.success(request, 'Research note updated successfully!')
             return redirect('project_edit', pk=project.id)
         else:
@@ -446,6 +499,17 @@ def researchnote_delete(request, project_id, note_id):
         'note': note
     })
 
+@login_required
+def researchnote_file(request, project_id, note_id):
+    """The file of a research note, for its project's owner only; supports Range and conditional GETs."""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    note = get_object_or_404(ResearchNote, pk=note_id, project=project)
+    if not note.file or not note.file.storage.exists(note.file.name):
+        raise Http404('This research note has no file')
+    return serve_file(request, note.file.storage, note.file.name, note.file_display_name)
+
 @login_required
 def researchnote_list(request, project_id):
     project = get_object_or_404(Project, pk=project_id, user=request.user)
@@ -458,7 +522,7 @@ def researchnote_list(request, project_id):
 @login_required
 def chapter_list(request, project_id):
     project = get_object_or_404(Project, pk=project_id, user=request.user)
-    chapters = project.chapters.all()
+    chapters = _chapter_list(project)
     return render(request, 'core/chapter_list.html', {
         'project': project,
         'chapters': chapters,
@@ -559,3 +623,91 @@ def chapter_delete(request, project_id, chapter_id):
         'project': project,
         'chapter': chapter
     })
+
+@login_required
+def project_search(request, project_id):
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    query = request.GET.get('q', '').strip()
+    return render(request, 'core/project_search.html', {
+        'project': project,
+        'query': query,
+        'results': search_project(project, query) if query else [],
+    })
+
+@login_required
+def project_search_results(request, project_id):
+    """JSON search results; each snippet is HTML with the matches in <mark> tags."""
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    query = request.GET.get('q', '').strip()
+    return JsonResponse({'status': 'success', 'query': query, 'results': search_project(project, query)})
+
+def _upload_json(project, session):
+    return {
+        'id': session.pk,
+        'file_name': session.file_name,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'chunks': part_count(session),
+        'received': received(session),
+        'completed': session.status == 'completed',
+        'url': reverse('upload_detail', args=[project.pk, session.pk]),
+        'finish_url': reverse('upload_finish', args=[project.pk, session.pk]),
+    }
+
+@login_required
+def upload_start(request, project_id):
+    """Start a resumable upload of a research note file: JSON with file_name, size and optional checksum and note_id."""
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON in request body'}, status=400)
+    note = None
+    if data.get('note_id') is not None:
+        note = get_object_or_404(ResearchNote, pk=data['note_id'], project=project)
+    try:
+        session = start_upload(project, data.get('file_name'), data.get('size'), data.get('checksum'), note)
+    except UploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'status': 'success', 'upload': _upload_json(project, session)}, status=201)
+
+@login_required
+def upload_detail(request, project_id, upload_id):
+    """GET an upload's progress, or PUT one chunk: ?offset=<byte offset>, optional X-Chunk-SHA256 header."""
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    session = get_object_or_404(UploadSession, pk=upload_id, project=project)
+    if request.method == 'GET':
+        return JsonResponse({'status': 'success', 'upload': _upload_json(project, session)})
+    if request.method != 'PUT':
+        return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or '')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'An integer offset and Content-Length are required'}, status=400)
+    try:
+        # The body is read straight from the request stream, never buffered whole
+        index = store_part(session, offset, request, length, request.headers.get('X-Chunk-SHA256', ''))
+    except UploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'status': 'success', 'index': index})
+
+@login_required
+def upload_finish(request, project_id, upload_id):
+    """Join and verify the chunks of an upload once they have all arrived."""
+    project = get_object_or_404(Project, pk=project_id, user=request.user)
+    session = get_object_or_404(UploadSession, pk=upload_id, project=project)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Unsupported request method'}, status=405)
+    try:
+        session = finish_upload(session)
+    except UploadError as e:
+        session.refresh_from_db()
+        return JsonResponse({'status': 'error', 'message': str(e), 'upload': _upload_json(project, session)}, status=400)
+    upload = _upload_json(project, session)
+    if session.note_id:
+        # Given to the note it was started for; the session goes away
+        attach_upload(session.note, session)
+    return JsonResponse({'status': 'success', 'attached': bool(session.note_id), 'upload': upload})
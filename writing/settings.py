@@ -72,6 +72,177 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The AI context cache keeps a per-project content version next to the cached
+# context, so point 'ai_context' at a shared backend (Redis, Memcached or the
+# database) when running more than one worker process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ai_context': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ai-context',
+    },
+    # AI rate limit buckets; shared by every worker process, or limits only hold
+    # per process (the table is created by migration ai 0007)
+    'ai_rate_limit': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'ai_rate_limit_cache',
+    },
+}
+
+AI_CONTEXT_CACHE_ALIAS = 'ai_context'
+AI_RATE_LIMIT_CACHE_ALIAS = 'ai_rate_limit'
+AI_CONTEXT_CACHE_TIMEOUT = 60 * 60
+
+# How many relationship links away from the improved entity a scoped context reaches
+AI_CONTEXT_SCOPE_DEPTH = 2
+
+# Default token budget for prompt contexts (None = unlimited); ?budget= overrides it.
+# Over budget, research note bodies are dropped first, then chapter content is cut
+# to excerpts of AI_CONTEXT_EXCERPT_CHARS, then the most distant entities are removed.
+AI_CONTEXT_TOKEN_BUDGET = None
+AI_CONTEXT_EXCERPT_CHARS = 600
+
+# Chapter summaries are regenerated in the background when a chapter's content
+# changes by more than AI_SUMMARY_CHANGE_THRESHOLD (fraction of paragraphs), and
+# replace the content of non-adjacent chapters when writing a chapter. Acts group
+# AI_ACT_SIZE consecutive chapters. Each refresh is an LLM call, so it is off
+# unless turned on.
+AI_CHAPTER_SUMMARIES = False
+AI_SUMMARY_CHANGE_THRESHOLD = 0.2
+AI_SUMMARY_WORKERS = 2
+AI_ACT_SIZE = 5
+
+# Serve the AI context and improve views as async views. Enable when running under
+# an ASGI server (e.g. `uvicorn writing.asgi:application`), so requests waiting on
+# the LLM don't each hold a worker thread.
+AI_ASYNC_VIEWS = False
+
+# LLM backend: 'gemini', or 'local' for a deterministic offline stand-in that
+# answers after AI_LOCAL_LLM_LATENCY seconds at AI_LOCAL_LLM_TOKENS_PER_SECOND
+# (None = instantly), for benchmarks and tests without the network.
+AI_LLM_PROVIDER = 'gemini'
+AI_LOCAL_LLM_LATENCY = 0.5
+AI_LOCAL_LLM_TOKENS_PER_SECOND = None
+
+# Model used for generation. The provider client is set up once per process;
+# with AI_LLM_WARM_UP it also connects at startup (to AI_LLM_WARM_UP_MODELS,
+# default AI_LLM_MODEL) so the first request doesn't pay for it.
+AI_LLM_MODEL = 'gemini-2.0-flash'
+AI_LLM_TRANSPORT = None
+AI_LLM_WARM_UP = False
+
+# Opt-in cache of LLM responses keyed by model, generation settings and prompt: a
+# per-process LRU of AI_RESPONSE_CACHE_MEMORY_ENTRIES in front of a database table
+# capped at AI_RESPONSE_CACHE_MAX_ENTRIES. Responses expire after AI_RESPONSE_CACHE_TTL
+# seconds; "bypass_cache": true in an improve POST asks for a fresh response.
+AI_RESPONSE_CACHE = False
+AI_RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+AI_RESPONSE_CACHE_MEMORY_ENTRIES = 256
+AI_RESPONSE_CACHE_MAX_ENTRIES = 5000
+
+# With AI_GENERATION_JOBS, improve POSTs queue a GenerationJob (answered with 202 and
+# a URL to poll) that `manage.py run_generation_worker` runs, instead of calling the
+# LLM inside the request. Jobs running longer than AI_JOB_TIMEOUT seconds are
+# assumed to belong to a dead worker and queued again. A job hitting a rate limit
+# or an open circuit breaker is retried after AI_JOB_RETRY_DELAY seconds, doubling
+# with each retry up to AI_JOB_RETRY_MAX_DELAY. After AI_JOB_MAX_RETRIES retries
+# (timeouts included) a job is marked failed.
+AI_GENERATION_JOBS = False
+AI_JOB_WORKER_CONCURRENCY = 4
+AI_JOB_TIMEOUT = 10 * 60
+AI_JOB_RETRY_DELAY = 5
+AI_JOB_RETRY_MAX_DELAY = 5 * 60
+AI_JOB_MAX_RETRIES = 10
+
+# Most LLM calls an "improve all" request runs at the same time
+AI_BULK_MAX_CONCURRENCY = 8
+
+# Token-bucket limits on LLM calls per user and across all users, in requests and
+# estimated tokens (prompt plus AI_RATE_LIMIT_RESPONSE_TOKENS) per minute; None
+# lifts a limit. Buckets live in the AI_RATE_LIMIT_CACHE_ALIAS cache, which must be
+# shared across processes (the system checks warn about a process-local one). Over
+# a limit, up to AI_RATE_LIMIT_MAX_WAITERS requests wait at most
+# AI_RATE_LIMIT_WAIT_TIMEOUT seconds; others get a 429 with Retry-After.
+# An "improve all" run counts as one request with the tokens of all its prompts.
+# A request or run needing more tokens than a limit allows is refused with a 413.
+AI_RATE_LIMITS = {
+    'user': {'requests_per_minute': 10, 'tokens_per_minute': 250_000},
+    'global': {'requests_per_minute': 60, 'tokens_per_minute': 1_000_000},
+}
+AI_RATE_LIMIT_RESPONSE_TOKENS = 1000
+AI_RATE_LIMIT_MAX_WAITERS = 20
+AI_RATE_LIMIT_WAIT_TIMEOUT = 10
+
+# Resilience policy for LLM calls: AI_LLM_TIMEOUT seconds per call (retries
+# included), up to AI_LLM_RETRIES retries of transient errors with jittered
+# exponential backoff, and optionally a hedged second request when the first is
+# slower than AI_LLM_HEDGE_DELAY (default: the observed p95). After
+# AI_LLM_BREAKER_FAILURES failures in a row calls fail fast for AI_LLM_BREAKER_RESET seconds.
+AI_LLM_TIMEOUT = 60
+AI_LLM_RETRIES = 2
+AI_LLM_BACKOFF_BASE = 0.5
+AI_LLM_BACKOFF_MAX = 8
+AI_LLM_HEDGE = False
+AI_LLM_HEDGE_DELAY = None
+AI_LLM_BREAKER_FAILURES = 5
+AI_LLM_BREAKER_RESET = 30
+
+# Prompts start with the project context. With AI_PROVIDER_CONTEXT_CACHE, contexts of
+# at least AI_PROVIDER_CONTEXT_CACHE_MIN_TOKENS are stored with the provider (Gemini
+# context caching) for AI_PROVIDER_CONTEXT_CACHE_TTL seconds and reused across calls
+# instead of being sent each time.
+AI_PROVIDER_CONTEXT_CACHE = False
+AI_PROVIDER_CONTEXT_CACHE_MIN_TOKENS = 4096
+AI_PROVIDER_CONTEXT_CACHE_TTL = 60 * 60
+
+# Every LLM call is recorded (ai.models.LLMCallRecord) with its timings and token
+# counts, shown at /ai/llm-telemetry/page/ to staff. Records older than
+# AI_LLM_TELEMETRY_RETENTION_DAYS are deleted by `manage.py llm_telemetry --prune`;
+# percentiles are over the latest AI_LLM_TELEMETRY_SAMPLE calls of a window.
+AI_LLM_TELEMETRY = True
+AI_LLM_TELEMETRY_RETENTION_DAYS = 90
+AI_LLM_TELEMETRY_SAMPLE = 10000
+
+# With AI_RETRIEVAL, chapters and research notes are split into passages of about
+# AI_RETRIEVAL_CHUNK_WORDS words and indexed locally (hashed TF-IDF, see ai.retrieval)
+# as they are saved. Prompt contexts then carry the AI_RETRIEVAL_TOP_K passages most
+# relevant to the entity instead of research note bodies and the text of chapters
+# away from the one being written. `manage.py build_retrieval_index` indexes
+# existing projects.
+AI_RETRIEVAL = False
+AI_RETRIEVAL_CHUNK_WORDS = 200
+AI_RETRIEVAL_TOP_K = 8
+
+# The text of files uploaded to research notes (txt, md, html, and pdf with the
+# pypdf package) is extracted on RESEARCH_FILE_WORKERS background threads, streamed
+# into passages of about RESEARCH_FILE_CHUNK_WORDS words and stored compressed (see
+# core.extraction). The passages are searchable, and retrieval and the context
+# builder use them. `manage.py extract_research_files` processes existing files.
+RESEARCH_FILE_CHUNK_WORDS = 200
+RESEARCH_FILE_WORKERS = 1
+
+# Large research files can be sent through a resumable upload API (see core.uploads)
+# in chunks of RESEARCH_UPLOAD_CHUNK_BYTES, each stored as it arrives and joined and
+# verified once all are in. Uploads never finished are deleted by `manage.py
+# prune_uploads` after RESEARCH_UPLOAD_EXPIRY_HOURS.
+RESEARCH_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+RESEARCH_UPLOAD_MAX_BYTES = 4 * 1024 ** 3
+RESEARCH_UPLOAD_EXPIRY_HOURS = 24
+
+# Research files are served to their project's owner by core.views.researchnote_file,
+# with Range, ETag and Last-Modified support. Set RESEARCH_MEDIA_OFFLOAD to
+# 'x-accel-redirect' (nginx, with an internal location at RESEARCH_MEDIA_OFFLOAD_PREFIX
+# aliasing MEDIA_ROOT) or 'x-sendfile' (Apache mod_xsendfile, lighttpd) to have the
+# proxy send the file after the permission check.
+RESEARCH_MEDIA_OFFLOAD = None
+RESEARCH_MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 